@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Time the chef end to end without network access.
+
+`pressurecooker.youtube.YouTubeResource` and the Sheets `spreadsheets()` service are
+replaced with local fakes with a configurable latency and failure rate, and a synthetic
+PLAYLIST_MAP is generated for each playlist size. For every size, the script times:
+  - construct_channel with an empty cache, then with a warm cache
+  - upload_description_to_google_sheet of every video (batch mode)
+  - insert_video_info of a few videos extracted again
+and reports the wall time, throughput and peak traced memory of each scenario.
+
+Usage: python benchmarks/chef_benchmark.py [--sizes=10,100,1000] [--languages=3] [--latency=0.0]
+           [--failure-rate=0.0] [--sheet-latency=0.0] [--sheet-failure-rate=0.0] [--insert=20]
+           [--no-memory] [--save-baseline=PATH] [--baseline=PATH] [--threshold=1.25]
+--latency is in seconds per YouTube request; failures are transient (HTTP 429) and are
+retried by the extraction scheduler. Results are compared with a baseline saved by a
+previous run; exits with status 1 when a scenario fails or is slower than `threshold` times
+its baseline. The baseline is not saved when a scenario failed.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from tests.sheet_service_stub import FakeSheetService
+
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_LANGUAGES = 3
+DEFAULT_INSERT_COUNT = 20
+DEFAULT_THRESHOLD = 1.25
+SHEET_ID = 'benchmark-sheet'
+
+
+class FakeYouTube():
+    """
+    Synthetic playlists (playlist id => video ids) served with a latency and a transient failure rate
+    """
+    playlists = dict()
+    latency = 0.0
+    failure_rate = 0.0
+    request_count = 0
+    random = random.Random(0)
+
+    @classmethod
+    def get_video_info(cls, video_id):
+        return {
+            'id': video_id,
+            'title': 'Video ' + video_id,
+            'description': 'Description of video ' + video_id,
+            'thumbnail': 'https://i.ytimg.com/vi/{0}/hqdefault.jpg'.format(video_id),
+            'source_url': 'https://www.youtube.com/watch?v=' + video_id,
+            'license': 'Standard YouTube License',
+            # Unused fields of a real info dict, dropped from compact cache records
+            'formats': [{'format_id': str(index), 'url': 'https://example.com/' + video_id} for index in range(20)],
+        }
+
+    @classmethod
+    def request(cls, url):
+        cls.request_count += 1
+        if cls.latency:
+            time.sleep(cls.latency)
+        if cls.random.random() < cls.failure_rate:
+            raise Exception("HTTP Error 429: Too Many Requests")
+
+
+class FakeYouTubeResource():
+    """
+    Stand-in of pressurecooker.youtube.YouTubeResource backed by FakeYouTube
+    """
+
+    def __init__(self, url, **kwargs):
+        self.url = url
+
+    def get_resource_info(self, options=None):
+        FakeYouTube.request(self.url)
+        if 'list=' in self.url:
+            playlist_id = self.url.split('list=')[1]
+            return {
+                'id': playlist_id,
+                'title': 'Playlist ' + playlist_id,
+                'children': [FakeYouTube.get_video_info(video_id) for video_id in FakeYouTube.playlists[playlist_id]],
+            }
+        return FakeYouTube.get_video_info(self.url.split('v=')[1])
+
+
+def make_playlist_map(languages, size):
+    """
+    Synthetic PLAYLIST_MAP of `size` videos per language, with their video descriptions
+    """
+    playlist_map = dict()
+    descriptions = dict()
+    for lang_index, lang in enumerate(languages):
+        playlist_id = 'PLbench{0:02d}x{1:07d}'.format(lang_index, size)
+        video_ids = ['{0:02d}{1:09d}'.format(lang_index, index) for index in range(size)]
+        FakeYouTube.playlists[playlist_id] = video_ids
+        playlist_map[lang] = [playlist_id]
+        for video_id in video_ids:
+            descriptions[video_id] = {'Description': 'Description of video ' + video_id}
+    return playlist_map, descriptions
+
+
+def run_scenario(name, size, items, func, trace_memory):
+    """
+    Time `func()`, returns the result dict of the scenario; a failed scenario has an `error`
+    and no timings
+    """
+    if trace_memory:
+        tracemalloc.start()
+    requests = FakeYouTube.request_count
+    start = time.perf_counter()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        traceback.print_exc()
+        error = '{0}: {1}'.format(type(e).__name__, e)
+    seconds = time.perf_counter() - start if error is None else None
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'scenario': name,
+        'size': size,
+        'items': items,
+        'seconds': seconds,
+        'throughput': items / seconds if seconds else None,
+        'peak_mb': peak / 1e6 if peak is not None else None,
+        'youtube_requests': FakeYouTube.request_count - requests,
+        'error': error,
+    }
+
+
+def run_size(size, options, work_root):
+    import sushichef
+    import utils
+
+    work_dir = os.path.join(work_root, 'size-{0}'.format(size))
+    os.makedirs(os.path.join(work_dir, 'chefdata', 'youtubecache'))
+    os.chdir(work_dir)
+    utils.close_youtube_cache()
+    utils._negative_cache = None
+    utils.configure_extraction_scheduler(rate=0, max_retries=10, backoff_base=0.001, backoff_max=0.01)
+
+    languages = list(ORIGINAL_PLAYLIST_MAP)[:options['languages']]
+    playlist_map, descriptions = make_playlist_map(languages, size)
+    # sushichef reads the same dict object through `from utils import *`
+    utils.PLAYLIST_MAP.clear()
+    utils.PLAYLIST_MAP.update(playlist_map)
+    with open(utils.VIDEO_DESCRIPTION_JSON_PATH, 'w') as json_file:
+        json.dump(descriptions, json_file)
+
+    video_count = size * len(languages)
+    chef_options = {'--reportdir': os.path.join(work_root, 'reports')}
+    sheet_service = FakeSheetService(latency=options['sheet_latency'], failure_rate=options['sheet_failure_rate'])
+    sushichef.RefugeeResponseSheetWriter.build_sheet_service = lambda writer: sheet_service
+    insert_lang = languages[0]
+    insert_ids = FakeYouTube.playlists[playlist_map[insert_lang][0]][:options['insert']]
+
+    def construct():
+        sushichef.RefugeeResponseSushiChef().construct_channel(**chef_options)
+
+    results = [
+        run_scenario('construct_channel (cold)', size, video_count, construct, options['memory']),
+        run_scenario('construct_channel (warm)', size, video_count, construct, options['memory']),
+        run_scenario('upload_description_to_google_sheet', size, video_count,
+                     lambda: sushichef.upload_description_to_google_sheet(SHEET_ID), options['memory']),
+        run_scenario('insert_video_info', size, len(insert_ids),
+                     lambda: sushichef.insert_video_info(insert_ids, insert_lang, use_cache=False),
+                     options['memory']),
+    ]
+    utils.close_youtube_cache()
+    os.chdir(REPO_DIR)
+    return results
+
+
+def get_result_key(result):
+    return '{0}/{1}'.format(result['scenario'], result['size'])
+
+
+def print_result(result, baseline, threshold):
+    """
+    Print one result line, returns True if it failed or regressed compared with the baseline
+    """
+    if result['error']:
+        print("{0:38} {1:>6} FAILED: {2}".format(result['scenario'], result['size'], result['error']))
+        return True
+    peak = '{0:8.1f} MB'.format(result['peak_mb']) if result['peak_mb'] is not None else '       - MB'
+    line = "{0:38} {1:>6} {2:9.3f} s {3:10.1f}/s {4} {5:6} req".format(
+        result['scenario'], result['size'], result['seconds'], result['throughput'] or 0, peak,
+        result['youtube_requests'])
+    regressed = False
+    previous = baseline.get(get_result_key(result))
+    if previous and previous['seconds']:
+        ratio = result['seconds'] / previous['seconds']
+        line += "  x{0:.2f} baseline".format(ratio)
+        if ratio > threshold:
+            line += " SLOWER"
+            regressed = True
+    print(line)
+    return regressed
+
+
+def main(argv):
+    options = dict(sizes=DEFAULT_SIZES, languages=DEFAULT_LANGUAGES, latency=0.0, failure_rate=0.0,
+                   sheet_latency=0.0, sheet_failure_rate=0.0, insert=DEFAULT_INSERT_COUNT, memory=True,
+                   save_baseline=None, baseline=None, threshold=DEFAULT_THRESHOLD)
+    for arg in argv:
+        name, _, value = arg.lstrip('-').partition('=')
+        name = name.replace('-', '_')
+        if name == 'sizes':
+            options['sizes'] = [int(size) for size in value.split(',')]
+        elif name in ('languages', 'insert'):
+            options[name] = max(1, int(value))
+        elif name in ('latency', 'failure_rate', 'sheet_latency', 'sheet_failure_rate', 'threshold'):
+            options[name] = float(value)
+        elif name == 'no_memory':
+            options['memory'] = False
+        elif name in ('save_baseline', 'baseline'):
+            options[name] = value
+        else:
+            print("Unknown option: " + arg)
+            return 2
+
+    try:
+        import pressurecooker.youtube
+        import utils
+    except ImportError as e:
+        print("skipped (dependencies not installed): {0}".format(e))
+        return 0
+    global ORIGINAL_PLAYLIST_MAP
+    ORIGINAL_PLAYLIST_MAP = dict(utils.PLAYLIST_MAP)
+    if options['languages'] > len(ORIGINAL_PLAYLIST_MAP):
+        print("At most {0} languages".format(len(ORIGINAL_PLAYLIST_MAP)))
+        return 2
+    pressurecooker.youtube.YouTubeResource = FakeYouTubeResource
+    FakeYouTube.latency = options['latency']
+    FakeYouTube.failure_rate = options['failure_rate']
+    logging.disable(logging.INFO)
+
+    baseline = dict()
+    if options['baseline']:
+        with open(options['baseline']) as json_file:
+            baseline = json.load(json_file)
+
+    print("{0:38} {1:>6} {2:>11} {3:>12} {4:>11} {5:>10}".format(
+        'scenario', 'size', 'time', 'throughput', 'peak memory', 'YouTube'))
+    work_root = tempfile.mkdtemp(prefix='chef-benchmark-')
+    atexit.register(shutil.rmtree, work_root, True)
+    results = []
+    regressed = False
+    for size in options['sizes']:
+        for result in run_size(size, options, work_root):
+            regressed = print_result(result, baseline, options['threshold']) or regressed
+            results.append(result)
+
+    failed = [result for result in results if result['error']]
+    if failed:
+        print("{0} of {1} scenarios failed".format(len(failed), len(results)))
+    elif options['save_baseline']:
+        with open(options['save_baseline'], 'w') as json_file:
+            json.dump(dict((get_result_key(result), result) for result in results), json_file, indent=4)
+        print("Saved baseline to " + options['save_baseline'])
+    return 1 if regressed or failed else 0
+
+
+ORIGINAL_PLAYLIST_MAP = dict()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
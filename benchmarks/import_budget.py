@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Check the import time of the chef modules against a budget.
+
+Each module is imported in a fresh interpreter several times and the median wall time
+is compared with its budget. Heavy dependencies that must only be loaded by the code
+paths using them are also checked to stay out of `sys.modules`.
+
+Usage: python benchmarks/import_budget.py [--repeat=N]
+Exits with status 1 when a budget is exceeded.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module => import time budget in milliseconds, interpreter startup excluded
+IMPORT_TIME_BUDGET_MS = {
+    'cache_utils': 50,
+    'utils': 50,
+    'google_sheet_utils': 50,
+    'sushichef': 1500,
+}
+
+# Modules that must not be imported as a side effect of importing the chef modules
+DEFERRED_MODULES = ['youtube_dl', 'pressurecooker.youtube', 'googleapiclient', 'google_auth_oauthlib']
+
+MEASURE_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules]
+print(elapsed * 1000)
+print(','.join(loaded))
+"""
+
+
+def measure_import(module, repeat):
+    """
+    Returns (median milliseconds, deferred modules loaded), or None if the module can't be imported
+    """
+    timings = []
+    loaded = ''
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-c', MEASURE_SCRIPT.format(module=module, deferred=DEFERRED_MODULES)],
+            cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+        )
+        if result.returncode != 0:
+            return None
+        lines = result.stdout.splitlines()
+        timings.append(float(lines[0]))
+        loaded = lines[1] if len(lines) > 1 else ''
+    return statistics.median(timings), loaded
+
+
+def main(argv):
+    repeat = 5
+    for arg in argv:
+        if arg.startswith('--repeat='):
+            repeat = max(1, int(arg.split('=', 1)[1]))
+
+    failed = False
+    for module, budget in IMPORT_TIME_BUDGET_MS.items():
+        measurement = measure_import(module, repeat)
+        if measurement is None:
+            print("{0:20} skipped (dependencies not installed)".format(module))
+            continue
+        elapsed, loaded = measurement
+        status = 'ok'
+        if elapsed > budget:
+            status = 'OVER BUDGET'
+            failed = True
+        if loaded:
+            status += ', eagerly imported: ' + loaded
+            failed = True
+        print("{0:20} {1:8.1f} ms (budget {2} ms) {3}".format(module, elapsed, budget, status))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
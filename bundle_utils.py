@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import tarfile
+
+LOGGER = logging.getLogger("RefugeeResponseBundle")
+LOGGER.setLevel(logging.DEBUG)
+
+CACHE_BUNDLE_PATH = os.path.join('chefdata', 'youtubecache.tar.gz')
+CHECKSUM_FILE_SUFFIX = '.sha256'
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Files of an interrupted write and lock files, never bundled
+TEMPORARY_FILE_SUFFIXES = ('.tmp', '.part', '-journal', '.lock')
+
+
+class RefugeeResponseBundleError(Exception):
+    pass
+
+
+def get_file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as bundle_file:
+        for chunk in iter(lambda: bundle_file.read(CHECKSUM_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_checksum_path(bundle_path):
+    return bundle_path + CHECKSUM_FILE_SUFFIX
+
+
+def create_bundle(source_dir, bundle_path=CACHE_BUNDLE_PATH):
+    """
+    Pack the files of `source_dir` into a gzip compressed tar file, with its SHA-256 in
+    `<bundle_path>.sha256` (sha256sum format). Returns the checksum.
+    """
+    bundle_dir = os.path.dirname(bundle_path)
+    if bundle_dir and not os.path.isdir(bundle_dir):
+        os.makedirs(bundle_dir, exist_ok=True)
+    temp_path = bundle_path + '.tmp'
+    file_count = 0
+    with tarfile.open(temp_path, 'w:gz') as bundle:
+        for dir_path, dir_names, file_names in os.walk(source_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(TEMPORARY_FILE_SUFFIXES):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                bundle.add(path, arcname=os.path.relpath(path, source_dir))
+                file_count += 1
+    os.replace(temp_path, bundle_path)
+    checksum = get_file_sha256(bundle_path)
+    with open(get_checksum_path(bundle_path), 'w') as checksum_file:
+        checksum_file.write('{0}  {1}\n'.format(checksum, os.path.basename(bundle_path)))
+    LOGGER.info("Packed %d files of %s into %s (%.1f MB, sha256 %s)", file_count, source_dir, bundle_path,
+                os.path.getsize(bundle_path) / 1e6, checksum)
+    return checksum
+
+
+def verify_bundle(bundle_path):
+    """
+    Raise RefugeeResponseBundleError unless the bundle matches its checksum file
+    """
+    try:
+        with open(get_checksum_path(bundle_path)) as checksum_file:
+            expected = checksum_file.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        raise RefugeeResponseBundleError("No checksum for bundle " + bundle_path)
+    checksum = get_file_sha256(bundle_path)
+    if checksum != expected:
+        raise RefugeeResponseBundleError("Checksum mismatch of bundle {0}: {1} != {2}".format(
+            bundle_path, checksum, expected))
+
+
+def extract_bundle(bundle_path, target_dir):
+    """
+    Verify the bundle, then unpack it into `target_dir`, replacing the files it contains
+    """
+    verify_bundle(bundle_path)
+    target_dir = os.path.abspath(target_dir)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir, exist_ok=True)
+    with tarfile.open(bundle_path, 'r:gz') as bundle:
+        members = bundle.getmembers()
+        for member in members:
+            path = os.path.abspath(os.path.join(target_dir, member.name))
+            if not (member.isfile() or member.isdir()) or os.path.commonpath([target_dir, path]) != target_dir:
+                raise RefugeeResponseBundleError("Unsafe member {0} in bundle {1}".format(member.name, bundle_path))
+        bundle.extractall(target_dir, members)
+    LOGGER.info("Unpacked %d files of %s into %s", len(members), bundle_path, target_dir)
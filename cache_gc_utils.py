@@ -0,0 +1,116 @@
+import logging
+import time
+
+from cache_utils import ENTRY_KIND_VIDEO, ENTRY_KIND_PLAYLIST, ENTRY_KIND_TEMP
+from collections import Counter, OrderedDict
+
+LOGGER = logging.getLogger("RefugeeResponseCacheGC")
+LOGGER.setLevel(logging.DEBUG)
+
+# Orphaned entries read or written this recently are kept: another chef process sharing the
+# cache may be writing the playlist that references them
+CACHE_GC_GRACE_PERIOD = 24 * 60 * 60
+
+GC_ORPHAN = 'orphan'
+GC_EVICTED = 'evicted'
+
+
+def format_size(size):
+    return '{0:.1f} MB'.format(size / 1e6)
+
+
+def collect_cache_garbage(cache, playlist_ids, max_size=None, grace_period=CACHE_GC_GRACE_PERIOD, now=None):
+    """
+    Delete the cache entries the playlists `playlist_ids` do not need:
+      - orphans: the other playlists, the videos none of the playlists references and the leftovers
+        of interrupted writes, unless they were used within `grace_period` seconds;
+      - then, while the remaining entries take more than `max_size` bytes, the least recently used
+        playlists with the videos that no other playlist references. They are extracted again on next use.
+    Returns an OrderedDict report: counts and bytes of the entries before and after, and of the
+    deleted entries by '<reason> <kind>', e.g. 'orphan video'.
+    """
+    now = now or time.time()
+    cache.flush_access_times()
+    disk_size_before = cache.get_disk_size()
+    entries = list(cache.iter_entry_stats())
+    playlist_ids = set(playlist_ids)
+    references = dict()
+    for kind, key, size, used_at in entries:
+        if kind == ENTRY_KIND_PLAYLIST and key in playlist_ids:
+            references[key] = set(cache.iter_playlist_video_ids(key))
+    referenced_ids = set().union(*references.values()) if references else set()
+
+    deleted = OrderedDict()
+
+    def delete(reason, kind, key, size):
+        cache.delete_entry(kind, key)
+        counts = deleted.setdefault('{0} {1}'.format(reason, kind), OrderedDict(count=0, bytes=0))
+        counts['count'] += 1
+        counts['bytes'] += size
+
+    live = OrderedDict()
+    for kind, key, size, used_at in entries:
+        if kind == ENTRY_KIND_PLAYLIST:
+            is_orphan = key not in playlist_ids
+        elif kind == ENTRY_KIND_VIDEO:
+            is_orphan = key not in referenced_ids
+        else:
+            is_orphan = kind == ENTRY_KIND_TEMP
+        if is_orphan and used_at < now - grace_period:
+            delete(GC_ORPHAN, kind, key, size)
+        else:
+            live[(kind, key)] = (size, used_at)
+
+    live_size = sum(size for size, used_at in live.values())
+    if max_size is not None and live_size > max_size:
+        reference_counts = Counter()
+        for video_ids in references.values():
+            reference_counts.update(video_ids)
+        playlists = sorted((used_at, key) for (kind, key), (size, used_at) in live.items()
+                           if kind == ENTRY_KIND_PLAYLIST and key in playlist_ids)
+        for used_at, playlist_id in playlists:
+            if live_size <= max_size:
+                break
+            size, used_at = live.pop((ENTRY_KIND_PLAYLIST, playlist_id))
+            delete(GC_EVICTED, ENTRY_KIND_PLAYLIST, playlist_id, size)
+            live_size -= size
+            for video_id in references[playlist_id]:
+                reference_counts[video_id] -= 1
+                if reference_counts[video_id] <= 0 and (ENTRY_KIND_VIDEO, video_id) in live:
+                    size, used_at = live.pop((ENTRY_KIND_VIDEO, video_id))
+                    delete(GC_EVICTED, ENTRY_KIND_VIDEO, video_id, size)
+                    live_size -= size
+        if live_size > max_size:
+            LOGGER.warning("Cache entries still take %s, over the cap of %s", format_size(live_size),
+                           format_size(max_size))
+
+    if deleted:
+        try:
+            cache.compact()
+        except Exception as e:
+            LOGGER.error("Failed to compact the cache: %s", e)
+    report = OrderedDict(
+        entries_before=len(entries),
+        bytes_before=sum(size for kind, key, size, used_at in entries),
+        entries_after=len(live),
+        bytes_after=live_size,
+        disk_bytes_before=disk_size_before,
+        disk_bytes_after=cache.get_disk_size(),
+        deleted=deleted,
+    )
+    LOGGER.info("Cache garbage collection: %s", "; ".join(format_gc_report(report)))
+    return report
+
+
+def format_gc_report(report):
+    """
+    Lines of a collect_cache_garbage report
+    """
+    lines = ["{0} entries ({1}) before, {2} entries ({3}) after".format(
+        report['entries_before'], format_size(report['bytes_before']),
+        report['entries_after'], format_size(report['bytes_after']))]
+    for name, counts in report['deleted'].items():
+        lines.append("{0}: {1} deleted ({2})".format(name, counts['count'], format_size(counts['bytes'])))
+    lines.append("reclaimed {0} on disk".format(
+        format_size(max(0, report['disk_bytes_before'] - report['disk_bytes_after']))))
+    return lines
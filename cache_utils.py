@@ -0,0 +1,1195 @@
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from metrics_utils import get_metrics, PHASE_CACHE_GET, PHASE_CACHE_PUT, PHASE_JSON_DECODE, PHASE_JSON_ENCODE
+from scheduler_utils import is_permanent_error
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the locks only apply between the threads of one process
+    fcntl = None
+
+LOGGER = logging.getLogger("RefugeeResponseCache")
+LOGGER.setLevel(logging.DEBUG)
+
+YOUTUBE_CACHE_DIR = os.path.join('chefdata', 'youtubecache')
+CACHE_DB_PATH = os.path.join(YOUTUBE_CACHE_DIR, 'youtubecache.sqlite3')
+
+CACHE_BACKEND_SQLITE = 'sqlite'
+CACHE_BACKEND_JSON = 'json'
+CACHE_BACKENDS = (CACHE_BACKEND_SQLITE, CACHE_BACKEND_JSON)
+
+# Version of the projected cache records, bump it when VIDEO_CACHE_FIELDS or PLAYLIST_CACHE_FIELDS change
+CACHE_SCHEMA_VERSION = 1
+SCHEMA_VERSION_KEY = 'schema_version'
+
+# The youtube_dl info fields the chef reads, everything else is dropped from cache records
+VIDEO_CACHE_FIELDS = ('id', 'title', 'description', 'thumbnail', 'source_url', 'license')
+PLAYLIST_CACHE_FIELDS = ('id', 'title', 'children')
+
+NEGATIVE_CACHE_FILE_NAME = 'negative_cache.json'
+
+# Seconds to wait before probing a failed id again. Only permanent failures, videos or playlists
+# reported as unavailable/private/removed, are recorded; transient errors (throttling, network,
+# 404 of a request) are retried on the next run. The window doubles with each consecutive failure,
+# up to NEGATIVE_CACHE_MAX_RETRY_AFTER.
+NEGATIVE_CACHE_RETRY_AFTER_UNAVAILABLE = 7 * 24 * 60 * 60
+NEGATIVE_CACHE_MAX_RETRY_AFTER = 60 * 24 * 60 * 60
+
+# Read size and number of rows fetched at a time when streaming playlist children
+STREAM_CHUNK_SIZE = 64 * 1024
+SQLITE_STREAM_BATCH_SIZE = 100
+SQLITE_STAGING_SUFFIX = '#staging'
+
+# Seconds a SQLite statement waits for the write lock held by another chef process
+SQLITE_BUSY_TIMEOUT = 60
+
+# Lock files of the chef processes sharing a cache directory. The keys of a kind are spread
+# over LOCK_STRIPES lock files, so that their number stays bounded.
+LOCK_DIR_NAME = '.locks'
+LOCK_STRIPES = 64
+
+# Kinds of cache entries, also the namespaces of their locks. Temporary entries are
+# the leftovers of interrupted writes.
+ENTRY_KIND_VIDEO = 'video'
+ENTRY_KIND_PLAYLIST = 'playlist'
+ENTRY_KIND_TEMP = 'temp'
+
+# Number of entry reads buffered before their access times are written
+ACCESS_FLUSH_SIZE = 100
+
+# Entry kind and key column of the SQLite tables
+SQLITE_TABLE_KINDS = OrderedDict([('videos', ENTRY_KIND_VIDEO), ('playlists', ENTRY_KIND_PLAYLIST)])
+SQLITE_TABLE_KEYS = dict(videos='video_id', playlists='playlist_id')
+
+CHILDREN_ARRAY_REGEX = re.compile(r'(?<!\\)"children"\s*:\s*\[')
+
+# Files inside YOUTUBE_CACHE_DIR that are not youtube_dl cache entries
+NON_CACHE_JSON_FILES = ('video_description.json', NEGATIVE_CACHE_FILE_NAME)
+
+
+_thread_locks = dict()
+_thread_locks_lock = threading.Lock()
+
+
+def get_lock_path(directory, name):
+    return os.path.join(directory, LOCK_DIR_NAME, name + '.lock')
+
+
+def get_key_lock_path(directory, kind, key):
+    stripe = zlib.crc32(key.encode('utf-8')) % LOCK_STRIPES
+    return get_lock_path(directory, '{0}-{1:02x}'.format(kind, stripe))
+
+
+class RefugeeResponseFileLock():
+    """
+    Exclusive lock between the threads of this process and the other processes (flock of
+    the lock file at `path`), used as a context manager. It is not reentrant.
+    """
+    path = ''
+    file = None
+
+    def __init__(self, path):
+        self.path = path
+        with _thread_locks_lock:
+            self.thread_lock = _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if fcntl is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a')
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        if self.file is not None:
+            # Closing the file releases the flock
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+
+def get_temp_path(path):
+    """
+    Temporary file next to `path`, unique to the calling process and thread
+    """
+    return '{0}.{1}-{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def write_file_atomic(path, data):
+    """
+    Write `data` to a temporary file and move it in place, so that readers
+    (in any process) see either the previous file or the whole new one
+    """
+    temp_path = get_temp_path(path)
+    try:
+        with open(temp_path, 'w') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def index_playlist_children(children, replace=False):
+    """
+    Ordered video id => entry index of playlist children, in one pass.
+    `None` entries (private or deleted videos skipped by youtube_dl) and entries without
+    an id are dropped. A duplicated id keeps its first position, and its first entry
+    unless `replace` is set, in which case the last entry wins.
+    """
+    index = OrderedDict()
+    for child in children or []:
+        if not child or not child.get('id'):
+            continue
+        if replace or child['id'] not in index:
+            index[child['id']] = child
+    return index
+
+
+def normalize_playlist_info(playlist_info, replace=False):
+    """
+    Dedupe the `children` of a playlist info dict in place, returns the children index
+    """
+    index = index_playlist_children(playlist_info.get('children'), replace)
+    playlist_info['children'] = list(index.values())
+    return index
+
+
+def project_video_info(video_info):
+    """
+    Compact cache record of a youtube_dl video info dict
+    """
+    if video_info is None:
+        return None
+    record = dict((field, video_info.get(field)) for field in VIDEO_CACHE_FIELDS if field in video_info)
+    record[SCHEMA_VERSION_KEY] = CACHE_SCHEMA_VERSION
+    return record
+
+
+def project_playlist_info(playlist_info):
+    """
+    Compact cache record of a youtube_dl playlist info dict, with compact children records
+    """
+    if playlist_info is None:
+        return None
+    record = dict((field, playlist_info.get(field)) for field in PLAYLIST_CACHE_FIELDS if field in playlist_info)
+    record['children'] = [project_video_info(child) for child in playlist_info.get('children') or []]
+    record[SCHEMA_VERSION_KEY] = CACHE_SCHEMA_VERSION
+    return record
+
+
+def iter_json_array(json_path, array_regex=CHILDREN_ARRAY_REGEX, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield the items of the first JSON array matched by `array_regex` (e.g. `"children": [`)
+    in the file, decoding one item at a time so that only one item is held in memory.
+    Falls back to loading the whole file if the array is not found.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path) as json_file:
+        buffer = ''
+        match = None
+        while match is None:
+            chunk = json_file.read(chunk_size)
+            if not chunk:
+                break
+            # keep enough of the previous chunk for a match spanning two chunks
+            buffer = buffer[-chunk_size:] + chunk
+            match = array_regex.search(buffer)
+        if match is None:
+            json_file.seek(0)
+            for item in json.load(json_file).get('children') or []:
+                yield item
+            return
+
+        buffer = buffer[match.end():]
+        position = 0
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position >= len(buffer):
+                    raise ValueError("need more data")
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise ValueError("Truncated JSON array in " + json_path)
+                chunk = json_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            buffer = buffer[end:]
+            position = 0
+
+
+class RefugeeResponsePlaylistWriter():
+    """
+    Writes a playlist to the cache one child at a time: children are deduped by id (the
+    first entry wins) and the written playlist replaces the cached one on `commit()`.
+    Used as a context manager, it commits on success and discards the children on error.
+    This default implementation buffers the children and commits them with `put_playlist`;
+    the JSON and SQLite writers store each child once as a video entry shared by all
+    playlists and keep only its id in the playlist.
+    """
+    cache = None
+    playlist_id = ''
+    header = None
+
+    def __init__(self, cache, playlist_id, playlist_info):
+        self.cache = cache
+        self.playlist_id = playlist_id
+        self.header = dict((key, value) for key, value in playlist_info.items() if key != 'children')
+        self.seen_ids = set()
+        self.children = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    def append(self, child):
+        """
+        Add a child, returns False if it is empty or a duplicate
+        """
+        if not child or not child.get('id') or child['id'] in self.seen_ids:
+            return False
+        self.seen_ids.add(child['id'])
+        self.write_child(child)
+        return True
+
+    def append_cached(self, child):
+        """
+        Add a child read back from the cache: only its id is written when its shared
+        video entry is still cached, returns False if it is empty or a duplicate
+        """
+        if not child or not child.get('id') or child['id'] in self.seen_ids:
+            return False
+        self.seen_ids.add(child['id'])
+        if self.has_video(child['id']):
+            self.write_reference(child['id'])
+        else:
+            self.write_child(child)
+        return True
+
+    def extend(self, children):
+        for child in children:
+            self.append(child)
+
+    def has_video(self, video_id):
+        return False
+
+    def write_reference(self, video_id):
+        raise NotImplementedError()
+
+    def write_child(self, child):
+        self.children.append(child)
+
+    def commit(self):
+        self.cache.put_playlist(self.playlist_id, dict(self.header, children=self.children))
+
+    def abort(self):
+        self.children = []
+
+
+class RefugeeResponseCache():
+    """
+    Key/value store of youtube_dl info dicts, keyed by YouTube video id and playlist id.
+    Entries are written as compact records (see VIDEO_CACHE_FIELDS), or as the
+    full youtube_dl info dict when `raw` is set.
+    Chef processes sharing the cache directory serialize their writes of a key with
+    the lock files in `lock_dir`.
+    """
+    raw = False
+    lock_dir = YOUTUBE_CACHE_DIR
+    accessed = None
+    access_lock = None
+
+    def __init__(self, raw=False):
+        self.raw = raw
+        self.accessed = dict()
+        self.access_lock = threading.Lock()
+
+    def get_lock(self, kind, key):
+        """
+        RefugeeResponseFileLock of a video or playlist id, kind is ENTRY_KIND_VIDEO or ENTRY_KIND_PLAYLIST
+        """
+        return RefugeeResponseFileLock(get_key_lock_path(self.lock_dir, kind, key))
+
+    def prepare_video(self, video_info):
+        return video_info if self.raw else project_video_info(video_info)
+
+    def prepare_playlist(self, playlist_info):
+        normalize_playlist_info(playlist_info)
+        return playlist_info if self.raw else project_playlist_info(playlist_info)
+
+    def prepare_playlist_header(self, playlist_header):
+        """
+        Cache record of a playlist info dict without its children
+        """
+        header = dict((key, value) for key, value in playlist_header.items() if key != 'children')
+        if self.raw:
+            return header
+        header = dict((field, header[field]) for field in PLAYLIST_CACHE_FIELDS if field in header)
+        header[SCHEMA_VERSION_KEY] = CACHE_SCHEMA_VERSION
+        return header
+
+    def check_schema_version(self, kind, key, record):
+        """
+        The cache record, None if it was written with another CACHE_SCHEMA_VERSION: it may lack fields
+        the chef reads, so the entry is a miss and gets extracted again. Records without a version are
+        full youtube_dl info dicts, which hold the fields of every version.
+        """
+        if record is not None and record.get(SCHEMA_VERSION_KEY, CACHE_SCHEMA_VERSION) != CACHE_SCHEMA_VERSION:
+            LOGGER.info("Ignored cached %s %s of schema version %s", kind, key, record[SCHEMA_VERSION_KEY])
+            return None
+        return record
+
+    def get_video(self, video_id):
+        raise NotImplementedError()
+
+    def put_video(self, video_id, video_info):
+        raise NotImplementedError()
+
+    def get_playlist(self, playlist_id):
+        raise NotImplementedError()
+
+    def put_playlist(self, playlist_id, playlist_info):
+        raise NotImplementedError()
+
+    def get_video_updated_at(self, video_id):
+        """
+        Unix time the video entry was last written, None if it is not cached
+        """
+        raise NotImplementedError()
+
+    def has_playlist(self, playlist_id):
+        return self.get_playlist(playlist_id) is not None
+
+    def get_playlist_header(self, playlist_id):
+        """
+        Cached playlist info without its children, None if the playlist is not cached
+        """
+        playlist_info = self.get_playlist(playlist_id)
+        if playlist_info is None:
+            return None
+        return dict((key, value) for key, value in playlist_info.items() if key != 'children')
+
+    def iter_playlist_children(self, playlist_id):
+        """
+        Yield the cached children of a playlist one at a time
+        """
+        playlist_info = self.get_playlist(playlist_id) or dict()
+        for child in playlist_info.get('children') or []:
+            yield child
+
+    def open_playlist_writer(self, playlist_id, playlist_info):
+        """
+        RefugeeResponsePlaylistWriter replacing the playlist, `playlist_info` gives its other fields
+        """
+        return RefugeeResponsePlaylistWriter(self, playlist_id, playlist_info)
+
+    def mark_accessed(self, kind, key):
+        """
+        Record a read of the entry, for the least recently used eviction
+        """
+        with self.access_lock:
+            self.accessed[(kind, key)] = time.time()
+            is_full = len(self.accessed) >= ACCESS_FLUSH_SIZE
+        if is_full:
+            self.flush_access_times()
+
+    def flush_access_times(self):
+        with self.access_lock:
+            accessed, self.accessed = self.accessed, dict()
+        if accessed:
+            self.write_access_times(accessed)
+
+    def write_access_times(self, accessed):
+        """
+        Store the access times of (kind, key) => Unix time
+        """
+        raise NotImplementedError()
+
+    def iter_entry_stats(self):
+        """
+        Yield (kind, key, size in bytes, Unix time of the last read or write) of every cache entry
+        """
+        raise NotImplementedError()
+
+    def iter_playlist_video_ids(self, playlist_id):
+        """
+        Yield the video ids a cached playlist references, without reading the videos
+        """
+        for child in self.iter_playlist_children(playlist_id):
+            if child and child.get('id'):
+                yield child['id']
+
+    def delete_entry(self, kind, key):
+        raise NotImplementedError()
+
+    def get_disk_size(self):
+        """
+        Bytes taken by the cache files
+        """
+        raise NotImplementedError()
+
+    def compact(self):
+        """
+        Give the space of the deleted entries back to the file system
+        """
+        pass
+
+    def close(self):
+        self.flush_access_times()
+
+
+class RefugeeResponseJSONCache(RefugeeResponseCache):
+    """
+    The original cache layout: one pretty-printed `<youtube_id>.json` per video and
+    one `<lang>.json` per playlist inside `cache_dir`.
+    playlist_names: playlist id => file name (without extension) of the playlist.
+    """
+    cache_dir = YOUTUBE_CACHE_DIR
+    playlist_names = None
+
+    def __init__(self, cache_dir=YOUTUBE_CACHE_DIR, playlist_names=None, raw=False):
+        super().__init__(raw)
+        self.cache_dir = cache_dir
+        self.lock_dir = cache_dir
+        self.playlist_names = playlist_names or dict()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_video_path(self, video_id):
+        return os.path.join(self.cache_dir, video_id + '.json')
+
+    def get_playlist_path(self, playlist_id):
+        return os.path.join(self.cache_dir, self.playlist_names.get(playlist_id, playlist_id) + '.json')
+
+    def read_json(self, path):
+        """
+        Decoded JSON file, None if it does not exist or is corrupted (it is then extracted again)
+        """
+        metrics = get_metrics()
+        with metrics.measure(PHASE_CACHE_GET) as measurement:
+            try:
+                with open(path) as json_file:
+                    data = json_file.read()
+            except FileNotFoundError:
+                measurement.hit = False
+                return None
+            except ValueError as e:
+                LOGGER.warning("Ignored corrupted cache file %s: %s", path, e)
+                measurement.hit = False
+                return None
+            measurement.hit = True
+            measurement.bytes = len(data)
+        with metrics.measure(PHASE_JSON_DECODE) as measurement:
+            measurement.bytes = len(data)
+            try:
+                return json.loads(data)
+            except ValueError as e:
+                LOGGER.warning("Ignored corrupted cache file %s: %s", path, e)
+                return None
+
+    def get_updated_at(self, path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def write_json(self, path, info, sort_keys):
+        metrics = get_metrics()
+        with metrics.measure(PHASE_JSON_ENCODE) as measurement:
+            if self.raw:
+                data = json.dumps(info, indent=4, ensure_ascii=False, sort_keys=sort_keys)
+            else:
+                data = json.dumps(info, ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':'))
+            measurement.bytes = len(data)
+        with metrics.measure(PHASE_CACHE_PUT) as measurement:
+            write_file_atomic(path, data)
+            measurement.bytes = len(data)
+
+    def get_video(self, video_id):
+        video_info = self.check_schema_version(ENTRY_KIND_VIDEO, video_id,
+                                               self.read_json(self.get_video_path(video_id)))
+        if video_info is not None:
+            self.mark_accessed(ENTRY_KIND_VIDEO, video_id)
+        return video_info
+
+    def put_video(self, video_id, video_info):
+        with self.get_lock(ENTRY_KIND_VIDEO, video_id):
+            self.write_json(self.get_video_path(video_id), self.prepare_video(video_info), True)
+
+    def get_playlist(self, playlist_id):
+        playlist_info = self.check_schema_version(ENTRY_KIND_PLAYLIST, playlist_id,
+                                                  self.read_json(self.get_playlist_path(playlist_id)))
+        if playlist_info is not None:
+            self.mark_accessed(ENTRY_KIND_PLAYLIST, playlist_id)
+            playlist_info['children'] = list(self.iter_playlist_children(playlist_id))
+        return playlist_info
+
+    def put_playlist(self, playlist_id, playlist_info):
+        normalize_playlist_info(playlist_info)
+        with self.open_playlist_writer(playlist_id, playlist_info) as writer:
+            writer.extend(playlist_info.get('children') or [])
+
+    def get_video_updated_at(self, video_id):
+        return self.get_updated_at(self.get_video_path(video_id))
+
+    def has_playlist(self, playlist_id):
+        # A corrupted playlist file is not cached
+        return self.get_playlist_header(playlist_id) is not None
+
+    def get_playlist_header(self, playlist_id):
+        # Children are video ids, the playlist file stays small
+        header = self.check_schema_version(ENTRY_KIND_PLAYLIST, playlist_id,
+                                           self.read_json(self.get_playlist_path(playlist_id)))
+        if header is not None:
+            self.mark_accessed(ENTRY_KIND_PLAYLIST, playlist_id)
+            header.pop('children', None)
+        return header
+
+    def iter_playlist_children(self, playlist_id):
+        path = self.get_playlist_path(playlist_id)
+        if not os.path.exists(path):
+            return
+        try:
+            for child in iter_json_array(path):
+                if not isinstance(child, str):
+                    # Playlist written before videos were shared between playlists
+                    yield child
+                    continue
+                video_info = self.get_video(child)
+                if video_info is None:
+                    LOGGER.warning("[Playlist %s] Video %s is not cached, skipped", playlist_id, child)
+                    continue
+                yield video_info
+        except ValueError as e:
+            LOGGER.warning("[Playlist %s] Ignored the rest of corrupted cache file %s: %s", playlist_id, path, e)
+
+    def open_playlist_writer(self, playlist_id, playlist_info):
+        return RefugeeResponseJSONPlaylistWriter(self, playlist_id, playlist_info)
+
+    def get_entry_path(self, kind, key):
+        if kind == ENTRY_KIND_VIDEO:
+            return self.get_video_path(key)
+        if kind == ENTRY_KIND_PLAYLIST:
+            return self.get_playlist_path(key)
+        return os.path.join(self.cache_dir, key)
+
+    def write_access_times(self, accessed):
+        for (kind, key), accessed_at in accessed.items():
+            path = self.get_entry_path(kind, key)
+            try:
+                # The modification time stays the time the entry was written
+                os.utime(path, (accessed_at, os.path.getmtime(path)))
+            except OSError:
+                pass
+
+    def iter_entry_stats(self):
+        playlist_ids = dict((name, playlist_id) for playlist_id, name in self.playlist_names.items())
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            used_at = max(stat.st_atime, stat.st_mtime)
+            if entry.name.endswith('.tmp'):
+                yield ENTRY_KIND_TEMP, entry.name, stat.st_size, stat.st_mtime
+            elif entry.name.endswith('.json') and entry.name not in NON_CACHE_JSON_FILES:
+                name = entry.name[:-len('.json')]
+                if name in playlist_ids:
+                    yield ENTRY_KIND_PLAYLIST, playlist_ids[name], stat.st_size, used_at
+                else:
+                    # Also the playlists that are no longer named, i.e. no longer in PLAYLIST_MAP
+                    yield ENTRY_KIND_VIDEO, name, stat.st_size, used_at
+
+    def iter_playlist_video_ids(self, playlist_id):
+        path = self.get_playlist_path(playlist_id)
+        if not os.path.exists(path):
+            return
+        try:
+            for child in iter_json_array(path):
+                video_id = child if isinstance(child, str) else (child or dict()).get('id')
+                if video_id:
+                    yield video_id
+        except ValueError as e:
+            LOGGER.warning("[Playlist %s] Ignored the rest of corrupted cache file %s: %s", playlist_id, path, e)
+
+    def delete_entry(self, kind, key):
+        path = self.get_entry_path(kind, key)
+        if kind == ENTRY_KIND_TEMP:
+            os.remove(path)
+            return
+        with self.get_lock(kind, key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get_disk_size(self):
+        return sum(size for kind, key, size, used_at in self.iter_entry_stats())
+
+
+class RefugeeResponseJSONPlaylistWriter(RefugeeResponsePlaylistWriter):
+    """
+    Streams the playlist to a temporary file with the array of video ids last, so that
+    iter_json_array can read it back item by item, and moves it in place on commit.
+    Each child is written once to its shared `<youtube_id>.json` video entry.
+    The playlist lock is held from opening to commit, so reading the cached children
+    while writing (e.g. to insert videos) does not lose the writes of another process.
+    """
+
+    def __init__(self, cache, playlist_id, playlist_info):
+        super().__init__(cache, playlist_id, playlist_info)
+        self.path = cache.get_playlist_path(playlist_id)
+        self.temp_path = get_temp_path(self.path)
+        self.count = 0
+        self.file_lock = cache.get_lock(ENTRY_KIND_PLAYLIST, playlist_id)
+        self.file_lock.acquire()
+        try:
+            self.file = open(self.temp_path, 'w')
+            header = json.dumps(cache.prepare_playlist_header(self.header), ensure_ascii=False)
+            self.file.write(header[:-1] + (', ' if header != '{}' else '') + '"children": [\n')
+        except BaseException:
+            self.file_lock.release()
+            raise
+
+    def write_child(self, child):
+        self.cache.put_video(child['id'], child)
+        self.write_reference(child['id'])
+
+    def has_video(self, video_id):
+        return os.path.exists(self.cache.get_video_path(video_id))
+
+    def write_reference(self, video_id):
+        if self.count:
+            self.file.write(',\n')
+        self.file.write(json.dumps(video_id))
+        self.count += 1
+
+    def commit(self):
+        try:
+            self.file.write('\n]}\n')
+            self.file.close()
+            os.replace(self.temp_path, self.path)
+        finally:
+            self.file_lock.release()
+
+    def abort(self):
+        try:
+            self.file.close()
+            os.remove(self.temp_path)
+        finally:
+            self.file_lock.release()
+
+
+class RefugeeResponseSQLiteCache(RefugeeResponseCache):
+    """
+    All cache entries in one SQLite file, with a primary key index on video and playlist ids.
+    The connection is shared between threads and guarded by a lock; other chef processes
+    are waited for up to SQLITE_BUSY_TIMEOUT seconds.
+    """
+    db_path = CACHE_DB_PATH
+    connection = None
+    lock = None
+
+    def __init__(self, db_path=CACHE_DB_PATH, raw=False):
+        self.db_path = db_path
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        super().__init__(raw)
+        self.lock_dir = db_dir or '.'
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS videos "
+                "(video_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, accessed_at REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS playlists "
+                "(playlist_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, accessed_at REAL)"
+            )
+            # Playlists reference their videos by id, one row each so that they can be streamed
+            # in playlist order; a video in several playlists is stored once in `videos`
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS playlist_videos "
+                "(playlist_id TEXT NOT NULL, position INTEGER NOT NULL, video_id TEXT NOT NULL, "
+                "PRIMARY KEY (playlist_id, position))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS playlist_videos_video_id ON playlist_videos (video_id)"
+            )
+
+    def get(self, table, key_name, key):
+        metrics = get_metrics()
+        with metrics.measure(PHASE_CACHE_GET) as measurement:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT data FROM {0} WHERE {1} = ?".format(table, key_name), (key,)
+                ).fetchone()
+            measurement.hit = row is not None
+            if row is None:
+                return None
+            measurement.bytes = len(row[0])
+        self.mark_accessed(SQLITE_TABLE_KINDS[table], key)
+        with metrics.measure(PHASE_JSON_DECODE) as measurement:
+            measurement.bytes = len(row[0])
+            try:
+                return json.loads(row[0])
+            except ValueError as e:
+                LOGGER.warning("Ignored corrupted cache entry %s %s: %s", table, key, e)
+                return None
+
+    def put(self, table, key_name, key, info):
+        metrics = get_metrics()
+        with metrics.measure(PHASE_JSON_ENCODE) as measurement:
+            data = json.dumps(info, ensure_ascii=False, separators=(',', ':'))
+            measurement.bytes = len(data)
+        with metrics.measure(PHASE_CACHE_PUT) as measurement:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO {0} ({1}, data, updated_at) VALUES (?, ?, ?)".format(table, key_name),
+                    (key, data, time.time())
+                )
+            measurement.bytes = len(data)
+
+    def get_updated_at(self, table, key_name, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT updated_at FROM {0} WHERE {1} = ?".format(table, key_name), (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_video(self, video_id):
+        return self.check_schema_version(ENTRY_KIND_VIDEO, video_id, self.get('videos', 'video_id', video_id))
+
+    def put_video(self, video_id, video_info):
+        self.put('videos', 'video_id', video_id, self.prepare_video(video_info))
+
+    def get_playlist(self, playlist_id):
+        header = self.get_playlist_record(playlist_id)
+        if header is not None:
+            header['children'] = list(self.iter_playlist_children(playlist_id))
+        return header
+
+    def put_playlist(self, playlist_id, playlist_info):
+        with self.open_playlist_writer(playlist_id, playlist_info) as writer:
+            writer.extend(playlist_info.get('children') or [])
+
+    def get_playlist_record(self, playlist_id):
+        return self.check_schema_version(ENTRY_KIND_PLAYLIST, playlist_id,
+                                         self.get('playlists', 'playlist_id', playlist_id))
+
+    def has_playlist(self, playlist_id):
+        # A playlist of another schema version is not cached
+        return self.get_playlist_record(playlist_id) is not None
+
+    def get_playlist_header(self, playlist_id):
+        return self.get_playlist_record(playlist_id)
+
+    def iter_playlist_children(self, playlist_id):
+        if not self.has_playlist(playlist_id):
+            return
+        metrics = get_metrics()
+        position = -1
+        while True:
+            with metrics.measure(PHASE_CACHE_GET) as measurement:
+                with self.lock:
+                    rows = self.connection.execute(
+                        "SELECT playlist_videos.position, playlist_videos.video_id, videos.data "
+                        "FROM playlist_videos LEFT JOIN videos ON videos.video_id = playlist_videos.video_id "
+                        "WHERE playlist_videos.playlist_id = ? AND playlist_videos.position > ? "
+                        "ORDER BY playlist_videos.position LIMIT ?", (playlist_id, position, SQLITE_STREAM_BATCH_SIZE)
+                    ).fetchall()
+                measurement.bytes = sum(len(data) for position, video_id, data in rows if data)
+            if not rows:
+                return
+            for position, video_id, data in rows:
+                if data is None:
+                    LOGGER.warning("[Playlist %s] Video %s is not cached, skipped", playlist_id, video_id)
+                    continue
+                with metrics.measure(PHASE_JSON_DECODE) as measurement:
+                    measurement.bytes = len(data)
+                    try:
+                        video_info = json.loads(data)
+                    except ValueError as e:
+                        LOGGER.warning("[Playlist %s] Video %s is corrupted, skipped: %s", playlist_id, video_id, e)
+                        continue
+                if self.check_schema_version(ENTRY_KIND_VIDEO, video_id, video_info) is None:
+                    LOGGER.warning("[Playlist %s] Video %s is not cached, skipped", playlist_id, video_id)
+                    continue
+                self.mark_accessed(ENTRY_KIND_VIDEO, video_id)
+                yield video_info
+
+    def open_playlist_writer(self, playlist_id, playlist_info):
+        return RefugeeResponseSQLitePlaylistWriter(self, playlist_id, playlist_info)
+
+    def get_video_updated_at(self, video_id):
+        return self.get_updated_at('videos', 'video_id', video_id)
+
+    def write_access_times(self, accessed):
+        with self.lock, self.connection:
+            for table, kind in SQLITE_TABLE_KINDS.items():
+                self.connection.executemany(
+                    "UPDATE {0} SET accessed_at = ? WHERE {1} = ?".format(table, SQLITE_TABLE_KEYS[table]),
+                    [(accessed_at, key) for (entry_kind, key), accessed_at in accessed.items() if entry_kind == kind]
+                )
+
+    def iter_entry_stats(self):
+        with self.lock:
+            rows = []
+            for table, kind in SQLITE_TABLE_KINDS.items():
+                rows.extend((kind,) + row for row in self.connection.execute(
+                    "SELECT {0}, length(data), COALESCE(accessed_at, updated_at) FROM {1}".format(
+                        SQLITE_TABLE_KEYS[table], table)
+                ))
+            # References staged by writers that did not finish
+            rows.extend((ENTRY_KIND_TEMP,) + row for row in self.connection.execute(
+                "SELECT playlist_id, SUM(length(video_id)), 0 FROM playlist_videos "
+                "WHERE instr(playlist_id, ?) > 0 GROUP BY playlist_id", (SQLITE_STAGING_SUFFIX,)
+            ))
+        for row in rows:
+            yield row
+
+    def iter_playlist_video_ids(self, playlist_id):
+        with self.lock:
+            video_ids = [video_id for video_id, in self.connection.execute(
+                "SELECT video_id FROM playlist_videos WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+            )]
+        for video_id in video_ids:
+            yield video_id
+
+    def delete_entry(self, kind, key):
+        if kind == ENTRY_KIND_TEMP:
+            # Once the lock is held, the writer of the staged references is gone
+            lock_kind, key_name = ENTRY_KIND_PLAYLIST, key.split(SQLITE_STAGING_SUFFIX)[0]
+        else:
+            lock_kind, key_name = kind, key
+        with self.get_lock(lock_kind, key_name), self.lock, self.connection:
+            if kind == ENTRY_KIND_VIDEO:
+                self.connection.execute("DELETE FROM videos WHERE video_id = ?", (key,))
+            else:
+                self.connection.execute("DELETE FROM playlist_videos WHERE playlist_id = ?", (key,))
+                self.connection.execute("DELETE FROM playlists WHERE playlist_id = ?", (key,))
+
+    def get_disk_size(self):
+        return os.path.getsize(self.db_path)
+
+    def compact(self):
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def close(self):
+        self.flush_access_times()
+        with self.lock:
+            self.connection.close()
+
+
+class RefugeeResponseNegativeCache():
+    """
+    Persistent record of video and playlist ids whose extraction failed, with the failure
+    reason, time and the time after which they can be probed again.
+    Entries are keyed by '<kind>:<id>', e.g. 'video:abcdefghijk'.
+    Each save merges the entries changed since the last save into the file, so that
+    chef processes sharing it keep the failures recorded by each other.
+    """
+    json_path = ''
+    entries = None
+    changes = None
+    lock = None
+    file_lock = None
+
+    def __init__(self, json_path=os.path.join(YOUTUBE_CACHE_DIR, NEGATIVE_CACHE_FILE_NAME)):
+        self.json_path = json_path
+        self.lock = threading.Lock()
+        self.file_lock = RefugeeResponseFileLock(
+            get_lock_path(os.path.dirname(self.json_path) or '.', os.path.basename(self.json_path)))
+        self.changes = dict()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.json_path) as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            LOGGER.error("Ignored invalid negative cache %s: %s", self.json_path, e)
+        return dict()
+
+    @staticmethod
+    def get_key(kind, item_id):
+        return '{0}:{1}'.format(kind, item_id)
+
+    @staticmethod
+    def is_unavailable_error(reason):
+        # The extraction scheduler does not retry the same errors
+        return is_permanent_error(reason)
+
+    def save(self):
+        json_dir = os.path.dirname(self.json_path)
+        if json_dir:
+            os.makedirs(json_dir, exist_ok=True)
+        with self.file_lock:
+            entries = self.load()
+            for key, entry in self.changes.items():
+                if entry is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = entry
+            write_file_atomic(self.json_path, json.dumps(entries, indent=4, ensure_ascii=False, sort_keys=True))
+        self.entries = entries
+        self.changes = dict()
+
+    def get(self, kind, item_id):
+        with self.lock:
+            return self.entries.get(self.get_key(kind, item_id))
+
+    def should_skip(self, kind, item_id, now=None):
+        """
+        True while the retry window of a recorded failure has not expired
+        """
+        entry = self.get(kind, item_id)
+        # Entries of transient errors recorded by earlier versions are not skipped
+        if not entry or not self.is_unavailable_error(entry['reason']):
+            return False
+        return (now or time.time()) < entry['retry_after']
+
+    def record_failure(self, kind, item_id, reason):
+        """
+        Record a permanent failure, returns False if `reason` is a transient error that is not recorded
+        """
+        if not self.is_unavailable_error(reason):
+            return False
+        now = time.time()
+        key = self.get_key(kind, item_id)
+        with self.lock:
+            failures = self.entries.get(key, dict()).get('failures', 0) + 1
+            retry_after = min(NEGATIVE_CACHE_RETRY_AFTER_UNAVAILABLE * 2 ** (failures - 1),
+                              NEGATIVE_CACHE_MAX_RETRY_AFTER)
+            self.entries[key] = self.changes[key] = dict(
+                reason=str(reason),
+                failed_at=now,
+                retry_after=now + retry_after,
+                failures=failures
+            )
+            self.save()
+        return True
+
+    def clear(self, kind, item_id):
+        key = self.get_key(kind, item_id)
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.changes[key] = None
+                self.save()
+
+
+class RefugeeResponseSQLitePlaylistWriter(RefugeeResponsePlaylistWriter):
+    """
+    Writes each child to its shared video entry and inserts the video references in
+    batches under a staging key of its own, then swaps them with the cached references
+    in one transaction on commit. Like the JSON writer, it holds the playlist lock from
+    opening to commit.
+    """
+
+    def __init__(self, cache, playlist_id, playlist_info):
+        super().__init__(cache, playlist_id, playlist_info)
+        self.staging_id = '{0}{1}-{2}-{3}'.format(playlist_id, SQLITE_STAGING_SUFFIX, os.getpid(),
+                                                  threading.get_ident())
+        self.position = 0
+        self.videos = []
+        self.file_lock = cache.get_lock(ENTRY_KIND_PLAYLIST, playlist_id)
+        self.file_lock.acquire()
+        try:
+            self.delete_staging()
+        except BaseException:
+            self.file_lock.release()
+            raise
+
+    def write_child(self, child):
+        with get_metrics().measure(PHASE_JSON_ENCODE) as measurement:
+            data = json.dumps(self.cache.prepare_video(child), ensure_ascii=False, separators=(',', ':'))
+            measurement.bytes = len(data)
+        self.videos.append((child['id'], data, time.time()))
+        self.write_reference(child['id'])
+
+    def has_video(self, video_id):
+        return self.cache.get_video_updated_at(video_id) is not None
+
+    def write_reference(self, video_id):
+        self.children.append((self.staging_id, self.position, video_id))
+        self.position += 1
+        if len(self.children) >= SQLITE_STREAM_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.children and not self.videos:
+            return
+        with get_metrics().measure(PHASE_CACHE_PUT) as measurement:
+            with self.cache.lock, self.cache.connection:
+                self.cache.connection.executemany(
+                    "INSERT OR REPLACE INTO videos (video_id, data, updated_at) VALUES (?, ?, ?)", self.videos
+                )
+                self.cache.connection.executemany(
+                    "INSERT INTO playlist_videos (playlist_id, position, video_id) VALUES (?, ?, ?)", self.children
+                )
+            measurement.bytes = sum(len(data) for video_id, data, updated_at in self.videos)
+        self.children = []
+        self.videos = []
+
+    def commit(self):
+        try:
+            self.flush()
+            header = json.dumps(self.cache.prepare_playlist_header(self.header), ensure_ascii=False,
+                                separators=(',', ':'))
+            connection = self.cache.connection
+            with self.cache.lock, connection:
+                connection.execute("DELETE FROM playlist_videos WHERE playlist_id = ?", (self.playlist_id,))
+                connection.execute("UPDATE playlist_videos SET playlist_id = ? WHERE playlist_id = ?",
+                                   (self.playlist_id, self.staging_id))
+                connection.execute(
+                    "INSERT OR REPLACE INTO playlists (playlist_id, data, updated_at) VALUES (?, ?, ?)",
+                    (self.playlist_id, header, time.time())
+                )
+        finally:
+            self.file_lock.release()
+
+    def abort(self):
+        self.children = []
+        self.videos = []
+        try:
+            self.delete_staging()
+        finally:
+            self.file_lock.release()
+
+    def delete_staging(self):
+        with self.cache.lock, self.cache.connection:
+            self.cache.connection.execute("DELETE FROM playlist_videos WHERE playlist_id = ?", (self.staging_id,))
+
+
+def migrate_json_cache(cache, cache_dir=YOUTUBE_CACHE_DIR, playlist_names=None):
+    """
+    Copy the per-file JSON cache in `cache_dir` into `cache`.
+    playlist_names: playlist id => file name (without extension) of the playlist;
+    every other `<name>.json` file is migrated as the video with id `name`.
+    Returns the paths of the migrated files, for the caller to remove once the store is in place.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    playlist_ids = dict((name, playlist_id) for playlist_id, name in (playlist_names or dict()).items())
+    video_count = 0
+    playlist_infos = []
+    migrated_paths = []
+    for file_name in sorted(os.listdir(cache_dir)):
+        if not file_name.endswith('.json') or file_name in NON_CACHE_JSON_FILES:
+            continue
+        name = file_name[:-len('.json')]
+        try:
+            with open(os.path.join(cache_dir, file_name)) as json_file:
+                info = json.load(json_file)
+        except ValueError as e:
+            LOGGER.error("Skipped invalid cache file %s: %s", file_name, e)
+            continue
+        migrated_paths.append(os.path.join(cache_dir, file_name))
+        if name in playlist_ids:
+            playlist_infos.append((playlist_ids[name], info))
+        else:
+            cache.put_video(name, info)
+            video_count += 1
+    # Playlists last: their children may be ids of the videos migrated above
+    for playlist_id, info in playlist_infos:
+        children = info.pop('children', None) or []
+        with cache.open_playlist_writer(playlist_id, info) as writer:
+            for child in children:
+                if isinstance(child, str):
+                    writer.append_cached(cache.get_video(child))
+                else:
+                    writer.append(child)
+    LOGGER.info("Migrated %d videos and %d playlists from %s", video_count, len(playlist_infos), cache_dir)
+    return migrated_paths
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def open_cache(backend=CACHE_BACKEND_SQLITE, cache_dir=YOUTUBE_CACHE_DIR, playlist_names=None, raw=False):
+    """
+    Open the cache store of the given backend. The JSON layout found in `cache_dir`,
+    if any, is moved into a new SQLite store.
+    raw: store full youtube_dl info dicts instead of compact records
+    """
+    if backend == CACHE_BACKEND_JSON:
+        return RefugeeResponseJSONCache(cache_dir, playlist_names, raw)
+    if backend != CACHE_BACKEND_SQLITE:
+        raise ValueError("Unknown cache backend: " + str(backend))
+
+    db_path = os.path.join(cache_dir, os.path.basename(CACHE_DB_PATH))
+    # Only the first of several chef processes opening a new store migrates into it
+    with RefugeeResponseFileLock(get_lock_path(cache_dir, os.path.basename(db_path))):
+        if not os.path.exists(db_path):
+            # The store is migrated under a temporary name and moved into place once complete,
+            # so an interrupted migration leaves no store and starts over on the next run;
+            # the JSON files are only removed after the move
+            remove_files(glob.glob(glob.escape(db_path) + '.*.tmp*'))
+            temp_path = get_temp_path(db_path)
+            try:
+                temp_cache = RefugeeResponseSQLiteCache(temp_path, raw)
+                try:
+                    migrated_paths = migrate_json_cache(temp_cache, cache_dir, playlist_names)
+                finally:
+                    temp_cache.close()
+                os.replace(temp_path, db_path)
+            finally:
+                remove_files([temp_path])
+            remove_files(migrated_paths)
+        return RefugeeResponseSQLiteCache(db_path, raw)
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import time
+
+from cache_utils import write_file_atomic
+from collections import OrderedDict
+from manifest_utils import drop_missing_local_paths
+
+LOGGER = logging.getLogger("RefugeeResponseCheckpoint")
+LOGGER.setLevel(logging.DEBUG)
+
+CHECKPOINT_DIR = os.path.join('chefdata', 'checkpoint')
+CHECKPOINT_VERSION = 1
+
+
+class RefugeeResponseCheckpoint():
+    """
+    Topics of the build in progress: the video node data of each completed language in its own
+    `<lang>.json` file, written as soon as the language is done, so that an interrupted build
+    can be resumed without extracting these languages again. Cleared once the build succeeds.
+    """
+    checkpoint_dir = CHECKPOINT_DIR
+
+    def __init__(self, checkpoint_dir=CHECKPOINT_DIR):
+        self.checkpoint_dir = checkpoint_dir
+
+    def get_path(self, lang):
+        return os.path.join(self.checkpoint_dir, lang + '.json')
+
+    def save_topic(self, lang, node_datas):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        write_file_atomic(self.get_path(lang), json.dumps(
+            dict(version=CHECKPOINT_VERSION, built_at=time.time(), lang=lang, node_datas=node_datas),
+            indent=4, ensure_ascii=False))
+        LOGGER.info("[Language %s] Checkpointed %d video nodes", lang, len(node_datas))
+
+    def load_topic(self, lang):
+        """
+        Checkpointed video node data of the language without the local files that no longer
+        exist, None if the language has no valid checkpoint
+        """
+        try:
+            with open(self.get_path(lang)) as json_file:
+                checkpoint = json.load(json_file)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            LOGGER.error("[Language %s] Ignored invalid checkpoint: %s", lang, e)
+            return None
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('lang') != lang:
+            LOGGER.warning("[Language %s] Ignored checkpoint of another version", lang)
+            return None
+        node_datas = [drop_missing_local_paths(node_data) for node_data in checkpoint['node_datas']]
+        LOGGER.info("[Language %s] Resuming from the checkpoint of %s, %d video nodes", lang,
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(checkpoint.get('built_at', 0))), len(node_datas))
+        return node_datas
+
+    def load_topics(self, languages):
+        """
+        OrderedDict of lang => node data of the `languages` that have a checkpoint, in input order
+        """
+        topics = OrderedDict()
+        for lang in languages:
+            node_datas = self.load_topic(lang)
+            if node_datas is not None:
+                topics[lang] = node_datas
+        return topics
+
+    def clear(self, languages):
+        for lang in languages:
+            try:
+                os.remove(self.get_path(lang))
+            except FileNotFoundError:
+                pass
@@ -1,25 +1,44 @@
 from __future__ import print_function
+import json
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import time
+
+from cache_utils import write_file_atomic
+from metrics_utils import get_metrics, PHASE_SHEETS
 
 # If modifying these scopes, delete the file token.pickle.
 # Since the updating is completed for google sheet, change scope to read only
 # SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+# The Drive metadata scope lets RefugeeResponseSheetReader read the spreadsheet revision
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly',
+          'https://www.googleapis.com/auth/drive.metadata.readonly']
 
 
 # Google sheet ID
 SPREADSHEET_ID = '1dL2V0_ne4j-y0_ZVU4Mm4B_C_O0qoGpd34yHzs99U3s'
 
+SHEET_NAME = 'Sheet1'
+
+# Number of rows a buffered writer collects before sending one update request
+DEFAULT_FLUSH_SIZE = 500
+
 TITLE_LIST = ['Video ID',
               'Video URL',
               'Video Title',
               'Video Language',
               'Description']
 
+DESCRIPTION_TITLE = 'Description'
+LANGUAGE_TITLE = 'Video Language'
+
+# Consecutive columns of an existing row that RefugeeResponseSheetSyncWriter keeps in sync with
+# YouTube; the other ones, the Description above all, belong to the sheet editors
+SYNCED_TITLES = ('Video URL', 'Video Title')
+
+# Sidecar of a downloaded description index, holding the spreadsheet revision it was read from
+REVISION_FILE_SUFFIX = '.revision'
+
 class RefugeeResponseDescriptionRecord():
     video_id = ''
     video_title = ''
@@ -34,14 +53,47 @@ class RefugeeResponseDescriptionRecord():
         self.video_title = title
         self.video_language = language
 
-class RefugeeResponseSheetWriter():
+    def to_row(self):
+        return [
+            self.video_id,
+            self.video_url,
+            self.video_title,
+            self.video_language,
+            self.description
+        ]
+
+class RefugeeResponseSheetClient():
+    """
+    Authorized access to the Sheets API of one spreadsheet
+    """
     spreadsheet_id = ''
     sheet_service = None
     creds = None
-    titled = False
 
-    def __init__(self, spreadsheet_id):
+    def __init__(self, spreadsheet_id, sheet_service=None):
+        """
+        sheet_service: optional `spreadsheets()` resource, skips the OAuth flow when given
+        (e.g. a local stub of the Sheets service).
+        """
         self.spreadsheet_id = spreadsheet_id
+        if sheet_service is not None:
+            self.sheet_service = sheet_service
+        else:
+            self.sheet_service = self.build_sheet_service()
+
+    def build_sheet_service(self):
+        from googleapiclient.discovery import build
+        service = build('sheets', 'v4', credentials=self.get_credentials())
+        return service.spreadsheets()
+
+    def get_credentials(self):
+        # The Google client libraries are slow to import, only load them when the sheet is used
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
+        if self.creds is not None:
+            return self.creds
+
         if os.path.exists('token.pickle'):
             try:
                 token = open('token.pickle', 'rb')
@@ -61,19 +113,153 @@ class RefugeeResponseSheetWriter():
             # Save the credentials for the next run
             with open('token.pickle', 'wb') as token:
                 pickle.dump(self.creds, token)
+        return self.creds
+
+    def execute(self, request, body=None):
+        """
+        Execute a Sheets API request, measured as one call of the `sheets` phase
+        with the size of its JSON body
+        """
+        with get_metrics().measure(PHASE_SHEETS) as measurement:
+            if body:
+                measurement.bytes = len(json.dumps(body))
+            return request.execute()
+
+
+class RefugeeResponseSheetReader(RefugeeResponseSheetClient):
+    """
+    Downloads the description rows of the sheet with one `values().batchGet` request into
+    the Video ID => {Video Language => {column title: value}} index read by
+    utils.get_video_description, where a 'EXCLUDE' Description excludes the video from the
+    topic of that language (a video listed in several playlists has one row per language).
+    The download is skipped when the Drive revision (`version`) of the spreadsheet is still
+    the one it was last downloaded at; without a revision the sheet is always downloaded.
+    """
+    drive_service = None
+    request_count = 0
+
+    def __init__(self, spreadsheet_id, sheet_service=None, drive_service=None):
+        """
+        drive_service: optional Drive v3 `files()` resource; when a stub sheet_service is given
+        without it, the revision is not checked.
+        """
+        self.request_count = 0
+        super().__init__(spreadsheet_id, sheet_service)
+        if drive_service is not None:
+            self.drive_service = drive_service
+        elif sheet_service is None:
+            self.drive_service = self.build_drive_service()
+
+    def build_drive_service(self):
+        from googleapiclient.discovery import build
+        service = build('drive', 'v3', credentials=self.get_credentials())
+        return service.files()
 
-        service = build('sheets', 'v4', credentials=self.creds)
-        self.sheet_service = service.spreadsheets()
+    def get_revision(self):
+        """
+        Drive revision of the spreadsheet, increased by every edit, None if it can't be read
+        (e.g. with a token.pickle created before the Drive scope was added)
+        """
+        if self.drive_service is None:
+            return None
+        try:
+            result = self.execute(self.drive_service.get(fileId=self.spreadsheet_id, fields='version'))
+            self.request_count += 1
+        except Exception as e:
+            print("Failed to get the spreadsheet revision, downloading the sheet: {0}".format(e))
+            return None
+        return result.get('version')
 
+    @staticmethod
+    def get_revision_path(json_path):
+        return json_path + REVISION_FILE_SUFFIX
+
+    def get_downloaded_revision(self, json_path):
+        if not os.path.exists(json_path):
+            return None
+        try:
+            with open(self.get_revision_path(json_path)) as revision_file:
+                downloaded = json.load(revision_file)
+        except (OSError, ValueError):
+            return None
+        if downloaded.get('spreadsheet_id') != self.spreadsheet_id:
+            return None
+        return downloaded.get('revision')
+
+    def read_descriptions(self):
+        """
+        Video ID => {Video Language => {column title: value}} of every row, an empty cell is None.
+        Rows without a language are indexed under ''.
+        """
+        range = "{0}!A:{1}".format(SHEET_NAME, chr(ord('A') + len(TITLE_LIST) - 1))
+        result = self.execute(self.sheet_service.values().batchGet(
+            spreadsheetId=self.spreadsheet_id, ranges=[range], majorDimension='ROWS'))
+        self.request_count += 1
+        value_ranges = result.get('valueRanges') or [dict()]
+        values = value_ranges[0].get('values', [])
+        if not values or not values[0]:
+            return dict()
+        titles = values[0]
+        if TITLE_LIST[0] not in titles[0] or DESCRIPTION_TITLE not in titles:
+            raise Exception("Invalid google sheet format found!")
+        descriptions = dict()
+        for row in values[1:]:
+            if not row or not row[0]:
+                continue
+            fields = dict(
+                (title, row[column] if column < len(row) and row[column] != '' else None)
+                for column, title in enumerate(titles) if column > 0
+            )
+            descriptions.setdefault(row[0], dict())[fields.get(LANGUAGE_TITLE) or ''] = fields
+        return descriptions
+
+    def download_descriptions(self, json_path):
+        """
+        Write the description index to `json_path` unless the sheet is unchanged since the
+        last download, returns True if it was downloaded
+        """
+        revision = self.get_revision()
+        if revision is not None and revision == self.get_downloaded_revision(json_path):
+            print("Google sheet unchanged since revision {0}, keeping {1}".format(revision, json_path))
+            return False
+        descriptions = self.read_descriptions()
+        json_dir = os.path.dirname(json_path)
+        if json_dir:
+            os.makedirs(json_dir, exist_ok=True)
+        write_file_atomic(json_path, json.dumps(descriptions, indent=4, ensure_ascii=False, sort_keys=True))
+        revision_path = self.get_revision_path(json_path)
+        if revision is None:
+            if os.path.exists(revision_path):
+                os.remove(revision_path)
+        else:
+            write_file_atomic(revision_path, json.dumps(
+                dict(spreadsheet_id=self.spreadsheet_id, revision=revision, downloaded_at=time.time())))
+        print("Downloaded {0} video descriptions of revision {1} to {2}".format(len(descriptions), revision,
+                                                                                 json_path))
+        return True
+
+
+class RefugeeResponseSheetWriter(RefugeeResponseSheetClient):
+    titled = False
+
+    def __init__(self, spreadsheet_id, sheet_service=None):
+        super().__init__(spreadsheet_id, sheet_service)
         if self.title_exist():
             self.titled = True
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
     def clear_old_records(self, range_str):
         body = {}
-        clear_response = self.sheet_service.values().clear(
+        clear_response = self.execute(self.sheet_service.values().clear(
             spreadsheetId=self.spreadsheet_id,
             range=range_str,
-            body=body).execute()
+            body=body))
 
     def add_title_line(self):
         values = [
@@ -84,16 +270,16 @@ class RefugeeResponseSheetWriter():
             'values': values
         }
         range = "Sheet1!A:A"
-        response = self.sheet_service.values().append(
+        response = self.execute(self.sheet_service.values().append(
             spreadsheetId=self.spreadsheet_id, range=range,
-            valueInputOption="USER_ENTERED", body=body).execute()
+            valueInputOption="USER_ENTERED", body=body), body)
         self.titled = True
         print("title range: {0}".format(response.get('tableRange')))
 
     def title_exist(self):
         range = "Sheet1!A1"
-        result = self.sheet_service.values().get(
-            spreadsheetId=self.spreadsheet_id, range=range).execute()
+        result = self.execute(self.sheet_service.values().get(
+            spreadsheetId=self.spreadsheet_id, range=range))
         values = result.get('values', [])
         if not values:
             return False
@@ -111,13 +297,7 @@ class RefugeeResponseSheetWriter():
             self.add_title_line()
 
         values = [
-            [
-                description_record.video_id,
-                description_record.video_url,
-                description_record.video_title,
-                description_record.video_language,
-                description_record.description
-            ]
+            description_record.to_row()
         ]
         body = {
             "majorDimension": "ROWS",
@@ -125,6 +305,195 @@ class RefugeeResponseSheetWriter():
         }
         range = "Sheet1!A:A"
 
-        response = self.sheet_service.values().append(
+        response = self.execute(self.sheet_service.values().append(
+            spreadsheetId=self.spreadsheet_id, range=range,
+            valueInputOption="USER_ENTERED", body=body), body)
+
+    def flush(self):
+        # Every record is sent as soon as it is written
+        pass
+
+
+class RefugeeResponseBufferedSheetWriter(RefugeeResponseSheetWriter):
+    """
+    Collects description records and writes them in one `values().update` request
+    every `flush_size` rows, instead of one append request per record.
+    Use it as a context manager so the remaining rows are flushed on exit.
+    """
+    flush_size = DEFAULT_FLUSH_SIZE
+    buffer = None
+    next_row = 1
+    request_count = 0
+
+    def __init__(self, spreadsheet_id, flush_size=DEFAULT_FLUSH_SIZE, sheet_service=None):
+        self.flush_size = max(1, int(flush_size))
+        self.buffer = []
+        self.next_row = 1
+        self.request_count = 0
+        super().__init__(spreadsheet_id, sheet_service)
+
+    def title_exist(self):
+        # Read the whole first column once to learn both the title and the first empty row
+        range = "{0}!A:A".format(SHEET_NAME)
+        result = self.execute(self.sheet_service.values().get(
+            spreadsheetId=self.spreadsheet_id, range=range))
+        self.request_count += 1
+        values = result.get('values', [])
+        self.next_row = len(values) + 1
+        if not values or not values[0]:
+            return False
+        if TITLE_LIST[0] in values[0][0]:
+            return True
+        raise Exception("Invalid google sheet format found!")
+
+    def add_title_line(self):
+        self.buffer.insert(0, list(TITLE_LIST))
+        self.titled = True
+
+    def write_description_record(self, description_record):
+        if not self.titled:
+            self.add_title_line()
+        self.buffer.append(description_record.to_row())
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        first_row = self.next_row
+        last_row = first_row + len(self.buffer) - 1
+        range = "{0}!A{1}:{2}{3}".format(SHEET_NAME, first_row, chr(ord('A') + len(TITLE_LIST) - 1), last_row)
+        body = {
+            "majorDimension": "ROWS",
+            'values': self.buffer
+        }
+        self.execute(self.sheet_service.values().update(
             spreadsheetId=self.spreadsheet_id, range=range,
-            valueInputOption="USER_ENTERED", body=body).execute()
+            valueInputOption="USER_ENTERED", body=body), body)
+        self.request_count += 1
+        self.next_row = last_row + 1
+        self.buffer = []
+
+
+class RefugeeResponseSheetSyncWriter(RefugeeResponseSheetWriter):
+    """
+    Reads the sheet once and indexes its rows by `Video ID` and `Video Language` (a video
+    listed in several playlists has one row per language), then appends the missing rows and,
+    on existing rows, only updates the SYNCED_TITLES columns that changed on YouTube: the
+    sheet is the source of the descriptions, an edited Description is never overwritten.
+    Writes are targeted range updates sent in `values().batchUpdate` requests of up to
+    `flush_size` ranges. Use it as a context manager so the pending updates are sent on exit.
+    """
+    flush_size = DEFAULT_FLUSH_SIZE
+    row_index = None
+    pending_rows = None
+    next_row = 1
+    counts = None
+    request_count = 0
+
+    def __init__(self, spreadsheet_id, flush_size=DEFAULT_FLUSH_SIZE, sheet_service=None):
+        self.flush_size = max(1, int(flush_size))
+        self.row_index = dict()
+        self.pending_rows = dict()
+        self.next_row = 1
+        self.counts = dict(inserted=0, updated=0, unchanged=0)
+        self.request_count = 0
+        super().__init__(spreadsheet_id, sheet_service)
+
+    def title_exist(self):
+        # One read of the whole table builds the (Video ID, Video Language) => (row number, values) index
+        range = "{0}!A:{1}".format(SHEET_NAME, chr(ord('A') + len(TITLE_LIST) - 1))
+        result = self.execute(self.sheet_service.values().get(
+            spreadsheetId=self.spreadsheet_id, range=range))
+        self.request_count += 1
+        values = result.get('values', [])
+        self.next_row = len(values) + 1
+        if not values or not values[0]:
+            return False
+        if TITLE_LIST[0] not in values[0][0]:
+            raise Exception("Invalid google sheet format found!")
+        for row_number, row in enumerate(values[1:], start=2):
+            if row and row[0]:
+                row = self.normalize_row(row)
+                self.row_index[self.get_row_key(row)] = (row_number, row)
+        return True
+
+    @staticmethod
+    def get_row_key(row):
+        return row[TITLE_LIST.index('Video ID')], row[TITLE_LIST.index('Video Language')]
+
+    @staticmethod
+    def normalize_row(row):
+        row = ['' if value is None else str(value) for value in row]
+        return row + [''] * (len(TITLE_LIST) - len(row))
+
+    def add_title_line(self):
+        self.pending_rows[1] = (0, list(TITLE_LIST))
+        self.next_row = max(self.next_row, 2)
+        self.titled = True
+
+    def write_description_record(self, description_record):
+        if not self.titled:
+            self.add_title_line()
+
+        row = self.normalize_row(description_record.to_row())
+        row_key = self.get_row_key(row)
+        if row_key in self.row_index:
+            row_number, old_row = self.row_index[row_key]
+            first_column = TITLE_LIST.index(SYNCED_TITLES[0])
+            last_column = first_column + len(SYNCED_TITLES)
+            if old_row[first_column:last_column] == row[first_column:last_column]:
+                self.counts['unchanged'] += 1
+                return
+            self.counts['updated'] += 1
+            row = old_row[:first_column] + row[first_column:last_column] + old_row[last_column:]
+            self.pending_rows[row_number] = (first_column, row[first_column:last_column])
+        else:
+            row_number = self.next_row
+            self.next_row += 1
+            self.counts['inserted'] += 1
+            self.pending_rows[row_number] = (0, row)
+        self.row_index[row_key] = (row_number, row)
+        if len(self.pending_rows) >= self.flush_size:
+            self.flush()
+
+    def get_pending_ranges(self):
+        """
+        Groups pending rows with consecutive row numbers and the same columns into one range each
+        """
+        ranges = []
+        for row_number in sorted(self.pending_rows):
+            first_column, values = self.pending_rows[row_number]
+            if (ranges and ranges[-1]['last_row'] == row_number - 1 and ranges[-1]['first_column'] == first_column
+                    and len(ranges[-1]['values'][0]) == len(values)):
+                ranges[-1]['last_row'] = row_number
+                ranges[-1]['values'].append(values)
+            else:
+                ranges.append(dict(first_row=row_number, last_row=row_number, first_column=first_column,
+                                   values=[values]))
+        return [
+            {
+                "range": "{0}!{1}{2}:{3}{4}".format(
+                    SHEET_NAME, chr(ord('A') + item['first_column']), item['first_row'],
+                    chr(ord('A') + item['first_column'] + len(item['values'][0]) - 1), item['last_row']),
+                "majorDimension": "ROWS",
+                "values": item['values']
+            }
+            for item in ranges
+        ]
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        body = {
+            "valueInputOption": "USER_ENTERED",
+            "data": self.get_pending_ranges()
+        }
+        self.execute(self.sheet_service.values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id, body=body), body)
+        self.request_count += 1
+        self.pending_rows = dict()
+
+    def get_summary(self):
+        return "inserted: {0}, updated: {1}, unchanged: {2}, requests: {3}".format(
+            self.counts['inserted'], self.counts['updated'], self.counts['unchanged'], self.request_count)
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import os
+
+from cache_utils import RefugeeResponseFileLock, get_lock_path, write_file_atomic
+from collections import OrderedDict
+
+LOGGER = logging.getLogger("RefugeeResponseManifest")
+LOGGER.setLevel(logging.DEBUG)
+
+MANIFEST_PATH = os.path.join('chefdata', 'manifest.json')
+MANIFEST_VERSION = 1
+
+# Fields of a video node data dict that make up its content hash; `id` is the YouTube id
+# of the video file. Local paths (LOCAL_PATH_FIELDS) are not hashed.
+CONTENT_HASH_FIELDS = ('title', 'description', 'thumbnail', 'language', 'id')
+# Files of a video node on this machine, set by the download stages
+LOCAL_PATH_FIELDS = ('thumbnail_path', 'video_path')
+MANIFEST_LOCK_NAME = 'manifest'
+
+DIFF_ADDED = 'added'
+DIFF_CHANGED = 'changed'
+DIFF_REMOVED = 'removed'
+DIFF_UNCHANGED = 'unchanged'
+DIFF_KINDS = (DIFF_ADDED, DIFF_CHANGED, DIFF_REMOVED, DIFF_UNCHANGED)
+
+
+def drop_missing_local_paths(node_data):
+    """
+    Copy of a video node data dict without the local files that no longer exist
+    """
+    return dict((key, value) for key, value in node_data.items()
+                if key not in LOCAL_PATH_FIELDS or not value or os.path.exists(value))
+
+
+def strip_local_paths(node_data):
+    """
+    Copy of a video node data dict without its local files, e.g. for another machine
+    """
+    return dict((key, value) for key, value in node_data.items() if key not in LOCAL_PATH_FIELDS)
+
+
+def get_content_hash(node_data):
+    values = [node_data.get(field) for field in CONTENT_HASH_FIELDS]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def diff_nodes(old_hashes, node_datas):
+    """
+    OrderedDict of DIFF_KINDS => list of source ids, between the `old_hashes`
+    (source id => content hash) of a topic and its new video node data dicts
+    """
+    diff = OrderedDict((kind, []) for kind in DIFF_KINDS)
+    new_ids = set()
+    for node_data in node_datas:
+        source_id = node_data['source_id']
+        new_ids.add(source_id)
+        if source_id not in old_hashes:
+            diff[DIFF_ADDED].append(source_id)
+        elif old_hashes[source_id] != get_content_hash(node_data):
+            diff[DIFF_CHANGED].append(source_id)
+        else:
+            diff[DIFF_UNCHANGED].append(source_id)
+    diff[DIFF_REMOVED] = [source_id for source_id in old_hashes if source_id not in new_ids]
+    return diff
+
+
+def is_unchanged_diff(diff):
+    return not (diff[DIFF_ADDED] or diff[DIFF_CHANGED] or diff[DIFF_REMOVED])
+
+
+def format_diff(diff):
+    return ", ".join("{0} {1}".format(len(diff[kind]), kind) for kind in DIFF_KINDS)
+
+
+class RefugeeResponseManifest():
+    """
+    Record of the last successful build: for every topic, the content hash and the
+    node data of each of its video nodes, in tree order, keyed by source id.
+    The next build diffs its topics against it and can reuse the nodes of unchanged topics.
+    Shard builds share the file: `save` merges the topics this build set or dropped into the
+    manifest on disk under a file lock, so that concurrent shards keep each other's topics.
+    """
+    json_path = MANIFEST_PATH
+    topics = None
+    changes = None
+
+    def __init__(self, json_path=MANIFEST_PATH):
+        self.json_path = json_path
+        self.file_lock = RefugeeResponseFileLock(get_lock_path(os.path.dirname(json_path), MANIFEST_LOCK_NAME))
+        # topic id => nodes set by this build, or None for a dropped topic
+        self.changes = OrderedDict()
+        self.topics = self.load()
+
+    def load(self):
+        try:
+            with open(self.json_path) as json_file:
+                manifest = json.load(json_file, object_pairs_hook=OrderedDict)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest['topics']
+            LOGGER.warning("Ignored manifest %s of another version", self.json_path)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            LOGGER.error("Ignored invalid manifest %s: %s", self.json_path, e)
+        return OrderedDict()
+
+    def has_topic(self, topic_id):
+        return topic_id in self.topics
+
+    def get_hashes(self, topic_id):
+        nodes = self.topics.get(topic_id) or OrderedDict()
+        return OrderedDict((source_id, node['hash']) for source_id, node in nodes.items())
+
+    def get_node_datas(self, topic_id):
+        """
+        Video node data dicts of the topic, without the local files that no longer exist
+        """
+        nodes = self.topics.get(topic_id) or OrderedDict()
+        return [drop_missing_local_paths(node['data']) for node in nodes.values()]
+
+    def diff(self, topic_id, node_datas):
+        return diff_nodes(self.get_hashes(topic_id), node_datas)
+
+    def set_topic(self, topic_id, node_datas):
+        self.topics[topic_id] = OrderedDict(
+            (node_data['source_id'], dict(hash=get_content_hash(node_data), data=node_data))
+            for node_data in node_datas
+        )
+        self.changes[topic_id] = self.topics[topic_id]
+
+    def retain_topics(self, topic_ids):
+        """
+        Drop the topics that are not in `topic_ids`, e.g. languages removed from PLAYLIST_MAP
+        """
+        topic_ids = set(topic_ids)
+        for topic_id in list(self.topics):
+            if topic_id not in topic_ids:
+                del self.topics[topic_id]
+                self.changes[topic_id] = None
+
+    def save(self):
+        json_dir = os.path.dirname(self.json_path)
+        if json_dir and not os.path.isdir(json_dir):
+            os.makedirs(json_dir, exist_ok=True)
+        with self.file_lock:
+            topics = self.load()
+            for topic_id, nodes in self.changes.items():
+                if nodes is None:
+                    topics.pop(topic_id, None)
+                else:
+                    topics[topic_id] = nodes
+            write_file_atomic(self.json_path, json.dumps(dict(version=MANIFEST_VERSION, topics=topics),
+                                                         indent=4, ensure_ascii=False))
+        self.topics = topics
+        self.changes = OrderedDict()
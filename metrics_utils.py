@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger("RefugeeResponseMetrics")
+LOGGER.setLevel(logging.DEBUG)
+
+METRICS_REPORT_DIR = os.path.join('chefdata', 'reports')
+
+# Scope of the measurements taken outside of any language, e.g. Sheets calls
+RUN_SCOPE = 'run'
+
+PHASE_CACHE_GET = 'cache_get'
+PHASE_CACHE_PUT = 'cache_put'
+PHASE_JSON_DECODE = 'json_decode'
+PHASE_JSON_ENCODE = 'json_encode'
+PHASE_EXTRACT = 'youtube_dl'
+PHASE_NODE = 'node'
+PHASE_SHEETS = 'sheets'
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Nearest-rank percentile of a sorted list, None if it is empty
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(percentile / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class RefugeeResponsePhaseMetrics():
+    """
+    Counts, cache hits/misses, bytes and latencies of one phase
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def add(self, seconds, size=0, hit=None, error=False):
+        self.count += 1
+        self.bytes += size or 0
+        self.latencies.append(seconds)
+        if error:
+            self.errors += 1
+        if hit is True:
+            self.hits += 1
+        elif hit is False:
+            self.misses += 1
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        report = OrderedDict(count=self.count, errors=self.errors)
+        if self.hits or self.misses:
+            report['hits'] = self.hits
+            report['misses'] = self.misses
+        report['bytes'] = self.bytes
+        report['seconds'] = round(sum(latencies), 6)
+        for name, percentile in (('p50_ms', 50), ('p95_ms', 95), ('max_ms', 100)):
+            value = get_percentile(latencies, percentile)
+            report[name] = round(value * 1000, 3) if value is not None else None
+        return report
+
+
+class RefugeeResponseMeasurement():
+    """
+    Times the enclosed block as one call of `phase`; set `bytes` and `hit` inside the block.
+    An exception leaving the block is counted as an error.
+    """
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.bytes = 0
+        self.hit = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.phase, time.perf_counter() - self.start, self.bytes, self.hit, exc_type is not None)
+        return False
+
+
+class RefugeeResponseMetrics():
+    """
+    Thread-safe phase metrics of a run, grouped by scope (the language being built, see `scope()`)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.scopes = OrderedDict()
+            self.started_at = time.time()
+
+    def get_scope(self):
+        return getattr(self.local, 'scope', RUN_SCOPE)
+
+    @contextmanager
+    def scope(self, name):
+        """
+        Attribute the measurements of the current thread to scope `name` inside the block
+        """
+        previous = self.get_scope()
+        self.local.scope = name
+        try:
+            yield
+        finally:
+            self.local.scope = previous
+
+    def iter_in_scope(self, name, iterable):
+        """
+        Yield the items of `iterable`, producing each of them in scope `name`
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.scope(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def measure(self, phase):
+        return RefugeeResponseMeasurement(self, phase)
+
+    def record(self, phase, seconds, size=0, hit=None, error=False):
+        scope = self.get_scope()
+        with self.lock:
+            phases = self.scopes.setdefault(scope, OrderedDict())
+            if phase not in phases:
+                phases[phase] = RefugeeResponsePhaseMetrics()
+            phases[phase].add(seconds, size, hit, error)
+
+    def get_report(self, scope):
+        with self.lock:
+            phases = self.scopes.get(scope) or OrderedDict()
+            return OrderedDict(
+                scope=scope,
+                started_at=self.started_at,
+                phases=OrderedDict((phase, metrics.to_dict()) for phase, metrics in sorted(phases.items())),
+            )
+
+    def write_reports(self, report_dir=METRICS_REPORT_DIR):
+        """
+        Write one `<scope>.json` report per scope into a new `<report_dir>/<run start time>` directory,
+        returns the directory or None if nothing was measured
+        """
+        with self.lock:
+            scopes = list(self.scopes)
+        if not scopes:
+            return None
+        run_dir = os.path.join(report_dir, time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at)))
+        os.makedirs(run_dir, exist_ok=True)
+        for scope in scopes:
+            with open(os.path.join(run_dir, '{0}.json'.format(scope)), 'w') as json_file:
+                json.dump(self.get_report(scope), json_file, indent=4)
+        LOGGER.info("Wrote the metrics of %d scopes to %s", len(scopes), run_dir)
+        return run_dir
+
+
+_metrics = RefugeeResponseMetrics()
+
+def get_metrics():
+    """
+    Shared metrics of the run
+    """
+    return _metrics
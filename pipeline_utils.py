@@ -0,0 +1,122 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger("RefugeeResponsePipeline")
+LOGGER.setLevel(logging.DEBUG)
+
+DEFAULT_PIPELINE_PRODUCERS = 4
+DEFAULT_PIPELINE_QUEUE_SIZE = 32    # entries buffered per item before its producer blocks
+# Seconds between checks of a blocked producer that the event loop is still running
+PRODUCER_POLL_INTERVAL = 0.5
+
+
+class RefugeeResponsePipelineEnd():
+    """
+    Queue marker closing the entries of one item, `error` is set if its producer failed
+    """
+    def __init__(self, error=None):
+        self.error = error
+
+
+def put_entry(loop, queue, entry):
+    """
+    Put `entry` in the asyncio `queue` from a worker thread, blocking while the queue is full.
+    Returns False if the event loop stopped before the entry was queued.
+    """
+    try:
+        future = asyncio.run_coroutine_threadsafe(queue.put(entry), loop)
+    except RuntimeError:
+        # The event loop is closed
+        return False
+    while True:
+        try:
+            future.result(PRODUCER_POLL_INTERVAL)
+            return True
+        except concurrent.futures.TimeoutError:
+            if not loop.is_running():
+                future.cancel()
+                return False
+
+
+def produce_entries(loop, queue, iter_entries, item, stop):
+    """
+    Runs in a worker thread: put every entry of `iter_entries(item)` in the asyncio `queue`,
+    blocking while the queue is full. Stops at the next entry once the `stop` event is set.
+    """
+    error = None
+    try:
+        for entry in iter_entries(item):
+            if stop.is_set() or not put_entry(loop, queue, entry):
+                break
+    except Exception as e:
+        error = e
+    put_entry(loop, queue, RefugeeResponsePipelineEnd(error))
+
+
+async def run_pipeline_async(items, iter_entries, consume_entry, finish_item,
+                             max_producers=DEFAULT_PIPELINE_PRODUCERS, queue_size=DEFAULT_PIPELINE_QUEUE_SIZE):
+    loop = asyncio.get_running_loop()
+    items = list(items)
+    max_producers = max(1, max_producers)
+    queues = [asyncio.Queue(maxsize=max(1, queue_size)) for item in items]
+    producer_slots = asyncio.Semaphore(max_producers)
+    # Set when the consumer fails or is interrupted: no producer starts after it,
+    # and the running ones stop at their next entry
+    stop = threading.Event()
+    started = []
+
+    with ThreadPoolExecutor(max_workers=max_producers) as executor:
+
+        async def start_producers():
+            # Producers take their slot in item order, so the item being consumed always
+            # holds a slot (or is done) and the pipeline can't deadlock on backpressure
+            for item, queue in zip(items, queues):
+                await producer_slots.acquire()
+                if stop.is_set():
+                    producer_slots.release()
+                    break
+                future = loop.run_in_executor(executor, produce_entries, loop, queue, iter_entries, item, stop)
+                future.add_done_callback(lambda future: producer_slots.release())
+                started.append(future)
+            await asyncio.gather(*started)
+
+        producers = asyncio.ensure_future(start_producers())
+        consumed = 0
+        try:
+            for item, queue in zip(items, queues):
+                while True:
+                    entry = await queue.get()
+                    if isinstance(entry, RefugeeResponsePipelineEnd):
+                        consumed += 1
+                        finish_item(item, entry.error)
+                        break
+                    consume_entry(item, entry)
+        except BaseException:
+            # Stop the producers and unblock the started ones before giving up
+            stop.set()
+            for queue in queues[consumed:len(started)]:
+                while not isinstance(await queue.get(), RefugeeResponsePipelineEnd):
+                    pass
+            raise
+        finally:
+            await producers
+
+
+def run_pipeline(items, iter_entries, consume_entry, finish_item,
+                 max_producers=DEFAULT_PIPELINE_PRODUCERS, queue_size=DEFAULT_PIPELINE_QUEUE_SIZE):
+    """
+    Stream the entries of every item from bounded-concurrency producers to a consumer.
+      - iter_entries(item): blocking generator of the item's entries, run in a worker thread
+      - consume_entry(item, entry): called in the event loop for each entry, in item order then entry order
+      - finish_item(item, error): called once all entries of the item were consumed, with the
+        producer's exception or None
+    At most `max_producers` items are produced at a time and each buffers at most `queue_size`
+    entries, so memory stays bounded no matter how many items there are.
+    If consume_entry or finish_item raises (or on Ctrl-C), no other item is started and the
+    running producers stop at their next entry before the exception is re-raised.
+    """
+    asyncio.run(run_pipeline_async(items, iter_entries, consume_entry, finish_item, max_producers, queue_size))
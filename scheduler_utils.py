@@ -0,0 +1,175 @@
+import logging
+import random
+import re
+import threading
+import time
+
+from collections import defaultdict
+
+LOGGER = logging.getLogger("RefugeeResponseScheduler")
+LOGGER.setLevel(logging.DEBUG)
+
+DEFAULT_REQUEST_RATE = 2.0          # requests per second, over all hosts
+DEFAULT_REQUEST_BURST = 4           # requests allowed at once after an idle period
+DEFAULT_HOST_CONCURRENCY = 4        # requests in flight per host
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 2.0          # seconds before the first retry
+DEFAULT_BACKOFF_MAX = 120.0         # upper bound of a single backoff
+
+# HTTP status of an error message, e.g. 'HTTP Error 503: Service Unavailable'
+HTTP_STATUS_REGEX = re.compile(r'http error (\d{3})')
+# Throttling and server errors are retried whatever their message says
+TRANSIENT_HTTP_STATUSES = (429,) + tuple(range(500, 600))
+# Lower case fragments of error messages worth retrying (throttling, network or server errors)
+TRANSIENT_ERROR_MARKERS = (
+    'too many requests', 'timed out', 'timeout', 'connection reset', 'connection refused',
+    'connection aborted', 'temporary failure', 'remote end closed', 'unable to download',
+    'incomplete read',
+)
+# Lower case fragments of youtube_dl messages of videos or playlists that will not come back
+# on retry; not a bare 'unavailable', which also matches 'Service Unavailable'
+PERMANENT_ERROR_MARKERS = ('video unavailable', 'video is unavailable', 'private video', 'playlist is private',
+                           'has been removed', 'does not exist')
+
+
+class RefugeeResponseSchedulerError(Exception):
+    pass
+
+class RefugeeResponseTransientError(RefugeeResponseSchedulerError):
+    """
+    Raised by scheduled functions for a failure that may succeed on retry, e.g. an empty result
+    """
+    pass
+
+class RefugeeResponseDeadlineError(RefugeeResponseSchedulerError):
+    pass
+
+
+def get_http_status(error):
+    """
+    HTTP status code of an error (urllib HTTPError or youtube_dl message), None if it has none
+    """
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    match = HTTP_STATUS_REGEX.search(str(error).lower())
+    return int(match.group(1)) if match else None
+
+
+def is_permanent_error(error):
+    """
+    Whether the error (or error message) reports a video or playlist that is unavailable, private or removed
+    """
+    if get_http_status(error) in TRANSIENT_HTTP_STATUSES:
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in PERMANENT_ERROR_MARKERS)
+
+
+def is_transient_error(error):
+    if isinstance(error, RefugeeResponseTransientError):
+        return True
+    if get_http_status(error) in TRANSIENT_HTTP_STATUSES:
+        return True
+    if is_permanent_error(error):
+        return False
+    # The network modules are slow to import, only load them once a request failed
+    import socket
+    from urllib.error import URLError
+    if isinstance(error, (socket.timeout, ConnectionError, URLError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+class RefugeeResponseTokenBucket():
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most `capacity` tokens
+    """
+    rate = DEFAULT_REQUEST_RATE
+    capacity = DEFAULT_REQUEST_BURST
+
+    def __init__(self, rate=DEFAULT_REQUEST_RATE, capacity=DEFAULT_REQUEST_BURST):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Block until a token is available. Returns False if `deadline` (monotonic time) passes first.
+        """
+        if not self.rate or self.rate <= 0:
+            return True
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RefugeeResponseExtractionScheduler():
+    """
+    Runs extraction requests under a shared request rate (token bucket), a per-host
+    concurrency cap and an overall deadline, retrying transient errors with exponential
+    backoff and full jitter.
+    """
+
+    def __init__(self, rate=DEFAULT_REQUEST_RATE, burst=DEFAULT_REQUEST_BURST,
+                 host_concurrency=DEFAULT_HOST_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, deadline=None):
+        """
+        deadline: seconds from now after which no new request or retry is started
+        """
+        self.bucket = RefugeeResponseTokenBucket(rate, burst)
+        self.host_concurrency = max(1, host_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.host_semaphores = defaultdict(lambda: threading.BoundedSemaphore(self.host_concurrency))
+        self.lock = threading.Lock()
+
+    def get_host_semaphore(self, url):
+        from urllib.parse import urlparse
+        with self.lock:
+            return self.host_semaphores[urlparse(url).netloc]
+
+    def get_backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def check_deadline(self, url, wait=0):
+        if self.deadline is not None and time.monotonic() + wait > self.deadline:
+            raise RefugeeResponseDeadlineError("Extraction deadline passed before requesting " + url)
+
+    def run(self, url, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)` for a request to `url` and return its result
+        """
+        semaphore = self.get_host_semaphore(url)
+        attempt = 0
+        while True:
+            self.check_deadline(url)
+            if not self.bucket.acquire(self.deadline):
+                raise RefugeeResponseDeadlineError("Extraction deadline passed before requesting " + url)
+            with semaphore:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_transient_error(e):
+                        raise
+                    error = e
+            backoff = self.get_backoff(attempt)
+            attempt += 1
+            self.check_deadline(url, backoff)
+            LOGGER.info("Retry %d/%d for %s in %.1fs after error: %s",
+                        attempt, self.max_retries, url, backoff, error)
+            time.sleep(backoff)
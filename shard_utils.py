@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import time
+
+from cache_utils import write_file_atomic
+from collections import OrderedDict
+from manifest_utils import strip_local_paths
+
+LOGGER = logging.getLogger("RefugeeResponseShards")
+LOGGER.setLevel(logging.DEBUG)
+
+SHARD_DIR = os.path.join('chefdata', 'shards')
+SHARD_ARTIFACT_VERSION = 1
+SHARD_ARTIFACT_PREFIX = 'shard-'
+
+
+def parse_shard(value):
+    """
+    (index, count) of a '<index>/<count>' shard option, index from 0 to count - 1
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError("Invalid shard '{0}', expected '<index>/<count>', e.g. '0/4'".format(value))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard '{0}', index must be from 0 to count - 1".format(value))
+    return index, count
+
+
+def select_languages(languages, names=None, shard_index=None, shard_count=None):
+    """
+    Languages of a shard, in the order of `languages`: the listed `names`, and/or every
+    `shard_count`-th language starting at `shard_index`
+    """
+    languages = list(languages)
+    if names:
+        unknown = [name for name in names if name not in languages]
+        if unknown:
+            raise ValueError("Unknown languages: " + ", ".join(unknown))
+        languages = [lang for lang in languages if lang in names]
+    if shard_count:
+        languages = [lang for position, lang in enumerate(languages) if position % shard_count == shard_index]
+    return languages
+
+
+def get_shard_artifact_path(languages, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, SHARD_ARTIFACT_PREFIX + '-'.join(languages) + '.json')
+
+
+def iter_shard_artifact_names(shard_dir=SHARD_DIR):
+    if not os.path.isdir(shard_dir):
+        return
+    for file_name in sorted(os.listdir(shard_dir)):
+        if file_name.startswith(SHARD_ARTIFACT_PREFIX) and file_name.endswith('.json'):
+            yield file_name
+
+
+def remove_shard_artifacts(languages, shard_dir=SHARD_DIR):
+    """
+    Delete the artifacts holding any of the `languages`, e.g. of an earlier run with another split,
+    so that a merge can't pick them up. Returns the deleted file names.
+    """
+    languages = set(languages)
+    removed = []
+    for file_name in iter_shard_artifact_names(shard_dir):
+        path = os.path.join(shard_dir, file_name)
+        try:
+            with open(path) as json_file:
+                artifact_languages = set(json.load(json_file).get('languages') or [])
+        except (ValueError, AttributeError):
+            # An unreadable artifact would fail the merge anyway
+            artifact_languages = languages
+        if artifact_languages & languages:
+            os.remove(path)
+            removed.append(file_name)
+            LOGGER.info("Removed shard artifact %s replaced by this shard", file_name)
+    return removed
+
+
+def write_shard_artifact(path, topics, run_id=None):
+    """
+    Write the video node data of the topics built by a shard, lang => list of node data,
+    without the local files of this machine, which are not valid on the machine that merges the shards.
+    run_id: optional id of the sharded build, required back by read_shard_artifacts
+    """
+    artifact_dir = os.path.dirname(path)
+    if artifact_dir and not os.path.isdir(artifact_dir):
+        os.makedirs(artifact_dir, exist_ok=True)
+    languages = OrderedDict()
+    for lang, node_datas in topics.items():
+        languages[lang] = [strip_local_paths(node_data) for node_data in node_datas]
+    write_file_atomic(path, json.dumps(dict(version=SHARD_ARTIFACT_VERSION, built_at=time.time(), run_id=run_id,
+                                            languages=languages), indent=4, ensure_ascii=False))
+    LOGGER.info("Wrote %d languages to shard artifact %s", len(languages), path)
+
+
+def read_shard_artifacts(shard_dir=SHARD_DIR, run_id=None):
+    """
+    OrderedDict of lang => list of node data from every shard artifact in `shard_dir`.
+    Raises ValueError if an artifact is invalid, is not of the build `run_id` (when given)
+    or two artifacts hold the same language.
+    """
+    topics = OrderedDict()
+    sources = dict()
+    for file_name in iter_shard_artifact_names(shard_dir):
+        with open(os.path.join(shard_dir, file_name)) as json_file:
+            artifact = json.load(json_file, object_pairs_hook=OrderedDict)
+        if artifact.get('version') != SHARD_ARTIFACT_VERSION:
+            raise ValueError("Shard artifact {0} has an unsupported version".format(file_name))
+        if run_id is not None and artifact.get('run_id') != run_id:
+            raise ValueError("Shard artifact {0} is of run '{1}', not '{2}'".format(
+                file_name, artifact.get('run_id'), run_id))
+        for lang, node_datas in artifact['languages'].items():
+            if lang in topics:
+                raise ValueError("Language '{0}' is in both {1} and {2}".format(lang, sources[lang], file_name))
+            topics[lang] = node_datas
+            sources[lang] = file_name
+        LOGGER.info("Read %d languages from shard artifact %s", len(artifact['languages']), file_name)
+    return topics
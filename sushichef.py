@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 import argparse
+import atexit
 import logging
+import os
 import sys
-import youtube_dl
 
+from bundle_utils import CACHE_BUNDLE_PATH, RefugeeResponseBundleError, create_bundle, extract_bundle
+from checkpoint_utils import RefugeeResponseCheckpoint
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics_utils import METRICS_REPORT_DIR, PHASE_NODE, get_metrics
+from manifest_utils import RefugeeResponseManifest, is_unchanged_diff, format_diff, DIFF_KINDS, DIFF_UNCHANGED
+from pipeline_utils import run_pipeline, DEFAULT_PIPELINE_QUEUE_SIZE
+from shard_utils import (SHARD_DIR, parse_shard, select_languages, get_shard_artifact_path, write_shard_artifact,
+                         read_shard_artifacts, remove_shard_artifacts)
+from thumbnail_utils import RefugeeResponseThumbnailCache, iter_with_local_thumbnails
+from video_utils import RefugeeResponseVideoDownloader, iter_with_local_videos, resolve_youtube_source
 from ricecooker.chefs import SushiChef
-from ricecooker.classes import nodes, files, questions, licenses
+from ricecooker.classes import nodes, files, licenses
 from ricecooker.exceptions import raise_for_invalid_channel
-from le_utils.constants import exercises, content_kinds, file_formats, format_presets, languages
 
 from utils import *
 from google_sheet_utils import *
@@ -28,10 +39,49 @@ CHANNEL_THUMBNAIL = REFUGEE_RESPONSE_THUMBNAIL_PATH          # Local path or url
 ################################################################################
 NO_CACHE_KEYNAME = "--nocache"
 DOWNLOAD_TO_GOOGLE_SHEET_KEYNAME = "--tosheet"
+DOWNLOAD_FROM_GOOGLE_SHEET_KEYNAME = "--fromsheet"
 EXTRACT_VIDEO_INFO = "--video"
 EXTRACT_VIDEO_PLAYLIST_INFO = "--playlist"
+PLAYLIST_WORKERS_KEYNAME = "--workers"
+DEFAULT_PLAYLIST_WORKERS = 4
+SHEET_MODE_KEYNAME = "--sheetmode"
+SHEET_FLUSH_SIZE_KEYNAME = "--flushsize"
+SHEET_MODE_APPEND = "append"
+SHEET_MODE_BATCH = "batch"
+SHEET_MODE_SYNC = "sync"
+SHEET_MODES = (SHEET_MODE_APPEND, SHEET_MODE_BATCH, SHEET_MODE_SYNC)
+CACHE_BACKEND_KEYNAME = "--cache"
+RAW_CACHE_KEYNAME = "--rawcache"
+REPROBE_KEYNAME = "--reprobe"
+REQUEST_RATE_KEYNAME = "--rate"
+HOST_CONCURRENCY_KEYNAME = "--hostconcurrency"
+MAX_RETRIES_KEYNAME = "--retries"
+DEADLINE_KEYNAME = "--deadline"
+ASYNC_PIPELINE_KEYNAME = "--async"
+THUMBNAILS_KEYNAME = "--thumbnails"
+DOWNSCALE_THUMBNAILS_KEYNAME = "--downscale"
+PREDOWNLOAD_KEYNAME = "--predownload"
+VERIFY_VIDEOS_KEYNAME = "--verifyvideos"
+SECONDS_PER_MINUTE = 60
+INCREMENTAL_KEYNAME = "--incremental"
+CACHE_TTL_KEYNAME = "--ttl"
+REFRESH_LIMIT_KEYNAME = "--refreshlimit"
+PLAN_KEYNAME = "--plan"
+SHARD_KEYNAME = "--shard"
+LANGUAGES_KEYNAME = "--langs"
+SHARD_DIR_KEYNAME = "--sharddir"
+MERGE_KEYNAME = "--merge"
+RUN_ID_KEYNAME = "--runid"
+WARM_KEYNAME = "--warm"
+BUNDLE_KEYNAME = "--bundle"
+OFFLINE_KEYNAME = "--offline"
+REPORT_DIR_KEYNAME = "--reportdir"
+GC_KEYNAME = "--gc"
+CACHE_CAP_KEYNAME = "--cachecap"
+RESUME_KEYNAME = "--resume"
+SECONDS_PER_DAY = 24 * 60 * 60
+BYTES_PER_MB = 1000 * 1000
 REFUGEE_RESPONSE = "Refugee Response"
-YOUTUBE_VIDEO_URL_FORMAT = "https://www.youtube.com/watch?v={0}"
 TOPIC_NAME_FORMAT = "Crisis Advice from the Refugee Response ({0})"
 
 # The chef subclass
@@ -59,9 +109,40 @@ class RefugeeResponseSushiChef(SushiChef):
     use_cache = True   # field to indicate whether use cached json data
     to_sheet = False
     sheet_id = ''
+    from_sheet_id = None
+    sheet_mode = SHEET_MODE_BATCH
+    sheet_flush_size = DEFAULT_FLUSH_SIZE
     insert_video_info = False
     video_list = []
     to_playlist = ''
+    playlist_workers = DEFAULT_PLAYLIST_WORKERS
+    thumbnail_cache = None
+    video_downloader = None
+    incremental = False
+    cache_ttl = None
+    refresh_limit = DEFAULT_REFRESH_LIMIT
+    async_pipeline = False
+    prefetch_thumbnails = False
+    downscale_thumbnails = False
+    predownload_videos = False
+    verify_videos = False
+    plan = False
+    manifest = None
+    language_names = None
+    shard = None
+    shard_dir = SHARD_DIR
+    merge = False
+    run_id = None
+    languages = None
+    topic_node_datas = None
+    warm = False
+    bundle_path = None
+    report_dir = METRICS_REPORT_DIR
+    gc = False
+    cache_max_size = None
+    resume = False
+    checkpoint = None
+    resumed_topics = None
 
     def construct_channel(self, *args, **kwargs):
         """
@@ -75,11 +156,95 @@ class RefugeeResponseSushiChef(SushiChef):
             --nocache:  Do not use cached YouTube playlist or video info; 
             --tosheet:  Only upload YouTube video information to Google sheet, will not generate channel;
                         Please provide Google sheet ID in form '--tosheet=[sheet_id]';
+            --fromsheet:
+                        Before the build, download the video descriptions edited in the Google sheet
+                        '--fromsheet=[sheet_id]' into chefdata/youtubecache/video_description.json, in one
+                        batch read that is skipped when the spreadsheet revision is unchanged since the
+                        last download; rows with the description 'EXCLUDE' are left out of the channel;
+            --sheetmode:
+                        How --tosheet writes rows: 'batch' (default) buffers rows and writes them in
+                        large update requests, 'append' sends one append request per video,
+                        'sync' reads the sheet once, appends the missing rows (keyed by Video ID and
+                        Video Language) and only updates the URL and title of existing rows, keeping
+                        the descriptions edited in the sheet;
+            --flushsize:
+                        Number of rows (ranges in 'sync' mode) sent per update request, e.g. '--flushsize=200';
             --playlist, --video:
                         These two options must be used together. They are used to save YouTube video cache info
                         to a specified YouTube playlist cache file. This feature is useful when one or more videos
                         from a playlist keep failing during extraction. A single video extraction usually works better
                         than a playlist extraction. Multiple video IDs should be separated by commas.
+            --cache:    Cache store of YouTube info: 'sqlite' (default, one indexed file that the old
+                        per-file JSON cache is moved into on first use) or 'json' (one file per entry);
+            --rawcache: Store the full youtube_dl info in the cache instead of the compact records
+                        holding only the fields the chef reads;
+            --reprobe:  Extract videos recorded as permanently unavailable in the negative cache
+                        (chefdata/youtubecache/negative_cache.json) even if their retry window is not over;
+            --rate, --hostconcurrency, --retries, --deadline:
+                        Extraction scheduler limits: YouTube requests per second (e.g. '--rate=1.5'),
+                        requests in flight per host, retries of a throttled or failed request
+                        (exponential backoff with jitter), and minutes after which no new request starts;
+            --incremental:
+                        Refresh cached playlists by listing their video ids only, extracting the added
+                        videos and dropping the removed ones, instead of using the cache as is;
+                        Languages whose videos are all unchanged since the last build (see --plan) reuse
+                        their nodes from chefdata/manifest.json and skip the thumbnail and video downloads;
+            --ttl:      With --incremental, re-extract cached videos older than this many days, e.g. '--ttl=30';
+            --refreshlimit:
+                        With --ttl, maximum number of stale videos re-extracted per playlist and run;
+            --workers:  Number of YouTube playlists extracted at the same time, e.g. '--workers=8';
+                        defaults to DEFAULT_PLAYLIST_WORKERS.
+            --thumbnails:
+                        Download all video thumbnails concurrently into chefdata/thumbnails (one file per
+                        distinct image, reused by later runs) and give the nodes local paths;
+            --downscale:
+                        With --thumbnails, downscale thumbnails to Studio's 400x225 (requires Pillow);
+            --predownload:
+                        Download the video files of all included videos through a worker pool into
+                        chefdata/videos before the upload, resuming partial files and checking sizes and
+                        checksums; the nodes then use the local files instead of downloading from YouTube;
+            --verifyvideos:
+                        With --predownload, check the MD5 of every downloaded video before reusing it,
+                        instead of only the ones whose size or modification time changed;
+            --async:    Build the tree with the asyncio pipeline: video nodes of a language are built
+                        while the next playlists are still being extracted, with bounded buffering.
+            --plan:     Only print the added/changed/removed/unchanged videos of every language compared
+                        to the last successful build, will not generate channel;
+            --shard, --langs:
+                        Only build some languages and write their video nodes to a shard artifact in --sharddir
+                        instead of uploading: every count-th language of PLAYLIST_MAP from index with
+                        '--shard=<index>/<count>' (e.g. '--shard=0/4'), and/or the listed languages with
+                        e.g. '--langs=en,ar';
+            --sharddir: Directory of the shard artifacts, chefdata/shards by default;
+            --merge:    Build the channel from the shard artifacts in --sharddir, in PLAYLIST_MAP order,
+                        without extracting anything; fails if a language is missing. Each shard first
+                        deletes the artifacts holding its languages, e.g. of an earlier split;
+            --runid:    Id of a sharded build, e.g. '--runid=20240601', recorded by every shard in its
+                        artifact: --merge with the same id fails on artifacts of any other run;
+            --warm:     Only fill the cache with every PLAYLIST_MAP playlist and pack it, with
+                        video_description.json, into a compressed bundle with a SHA-256 checksum file,
+                        will not generate channel;
+            --bundle:   Path of the cache bundle, chefdata/youtubecache.tar.gz by default. Without --warm,
+                        the bundle is verified and unpacked into chefdata/youtubecache before the build;
+            --offline:  Fail on the first cache miss instead of extracting from YouTube, e.g. to build
+                        from a bundle on a node without network access.
+            --reportdir:
+                        Directory of the run reports, chefdata/reports by default.
+            --gc:       Only collect the garbage of the cache and print the reclaimed space, will not generate
+                        channel: playlists no longer in PLAYLIST_MAP, the videos none of its playlists
+                        references and leftovers of interrupted writes, unless used within the last day;
+            --cachecap: Size cap of the cache in MB, e.g. '--cachecap=500'; above it the least recently used
+                        playlists are deleted with the videos no other playlist references.
+            --resume:   Continue an interrupted build: the languages completed by the previous run are rebuilt
+                        from their checkpoint in chefdata/checkpoint, only the missing ones are extracted.
+        The cache garbage is also collected after every successful build (except shards and merges)
+        and before packing a --warm bundle.
+        Every build except --merge checkpoints the video nodes of each language as soon as it is complete;
+        the checkpoints are removed once every language of the build is done.
+        Every successful build records the content hash of each video node in chefdata/manifest.json.
+        Every run writes the counts, cache hits/misses, bytes and p50/p95 latencies of its cache lookups,
+        youtube_dl extractions, JSON (de)serialization, node construction and Sheets calls to one
+        JSON report per language (and 'run.json' for the rest) in <reportdir>/<start time>/.
         Returns: ChannelNode
         """
         # Update language info from option input
@@ -92,6 +257,18 @@ class RefugeeResponseSushiChef(SushiChef):
                 self.to_sheet = True
                 self.sheet_id = value
                 LOGGER.info("to_sheet = '%d'", self.to_sheet)
+            if key == DOWNLOAD_FROM_GOOGLE_SHEET_KEYNAME:
+                self.from_sheet_id = value
+                LOGGER.info("from_sheet_id = '%s'", self.from_sheet_id)
+            if key == SHEET_MODE_KEYNAME:
+                if value not in SHEET_MODES:
+                    LOGGER.error("Invalid sheet mode '%s', must be one of: %s", value, ", ".join(SHEET_MODES))
+                    exit(1)
+                self.sheet_mode = value
+                LOGGER.info("sheet_mode = '%s'", self.sheet_mode)
+            if key == SHEET_FLUSH_SIZE_KEYNAME:
+                self.sheet_flush_size = max(1, int(value))
+                LOGGER.info("sheet_flush_size = '%d'", self.sheet_flush_size)
             if key == EXTRACT_VIDEO_INFO:
                 self.insert_video_info = True
                 self.video_list = value.split(",")
@@ -99,14 +276,120 @@ class RefugeeResponseSushiChef(SushiChef):
                 self.insert_video_info = True
                 self.to_playlist = value
                 LOGGER.info("playlist = '%s'", self.to_playlist)
+            if key == CACHE_BACKEND_KEYNAME:
+                set_cache_backend(value)
+                LOGGER.info("cache backend = '%s'", value)
+            if key == RAW_CACHE_KEYNAME:
+                set_cache_raw(True)
+                LOGGER.info("raw cache records = '%d'", True)
+            if key == REPROBE_KEYNAME:
+                set_reprobe(True)
+                LOGGER.info("reprobe = '%d'", True)
+            if key == REQUEST_RATE_KEYNAME:
+                configure_extraction_scheduler(rate=float(value))
+                LOGGER.info("request rate = '%s'", value)
+            if key == HOST_CONCURRENCY_KEYNAME:
+                configure_extraction_scheduler(host_concurrency=int(value))
+                LOGGER.info("host concurrency = '%s'", value)
+            if key == MAX_RETRIES_KEYNAME:
+                configure_extraction_scheduler(max_retries=int(value))
+                LOGGER.info("max retries = '%s'", value)
+            if key == DEADLINE_KEYNAME:
+                configure_extraction_scheduler(deadline=float(value) * SECONDS_PER_MINUTE)
+                LOGGER.info("extraction deadline = '%s' minutes", value)
+            if key == INCREMENTAL_KEYNAME:
+                self.incremental = True
+                LOGGER.info("incremental = '%d'", self.incremental)
+            if key == CACHE_TTL_KEYNAME:
+                self.cache_ttl = float(value) * SECONDS_PER_DAY
+                LOGGER.info("cache_ttl = '%d' seconds", self.cache_ttl)
+            if key == REFRESH_LIMIT_KEYNAME:
+                self.refresh_limit = int(value)
+                LOGGER.info("refresh_limit = '%d'", self.refresh_limit)
+            if key == THUMBNAILS_KEYNAME:
+                self.prefetch_thumbnails = True
+                LOGGER.info("prefetch_thumbnails = '%d'", self.prefetch_thumbnails)
+            if key == DOWNSCALE_THUMBNAILS_KEYNAME:
+                self.downscale_thumbnails = True
+                LOGGER.info("downscale_thumbnails = '%d'", self.downscale_thumbnails)
+            if key == PREDOWNLOAD_KEYNAME:
+                self.predownload_videos = True
+                LOGGER.info("predownload_videos = '%d'", self.predownload_videos)
+            if key == VERIFY_VIDEOS_KEYNAME:
+                self.verify_videos = True
+                LOGGER.info("verify_videos = '%d'", self.verify_videos)
+            if key == ASYNC_PIPELINE_KEYNAME:
+                self.async_pipeline = True
+                LOGGER.info("async_pipeline = '%d'", self.async_pipeline)
+            if key == PLAN_KEYNAME:
+                self.plan = True
+                LOGGER.info("plan = '%d'", self.plan)
+            if key == SHARD_KEYNAME:
+                try:
+                    self.shard = parse_shard(value)
+                except ValueError as e:
+                    LOGGER.error(e)
+                    exit(1)
+                LOGGER.info("shard = '%s'", value)
+            if key == LANGUAGES_KEYNAME:
+                self.language_names = [name.strip() for name in value.split(",") if name.strip()]
+                LOGGER.info("languages = '%s'", value)
+            if key == SHARD_DIR_KEYNAME:
+                self.shard_dir = value
+                LOGGER.info("shard_dir = '%s'", self.shard_dir)
+            if key == MERGE_KEYNAME:
+                self.merge = True
+                LOGGER.info("merge = '%d'", self.merge)
+            if key == RUN_ID_KEYNAME:
+                self.run_id = value
+                LOGGER.info("run_id = '%s'", self.run_id)
+            if key == WARM_KEYNAME:
+                self.warm = True
+                LOGGER.info("warm = '%d'", self.warm)
+            if key == BUNDLE_KEYNAME:
+                self.bundle_path = value
+                LOGGER.info("bundle_path = '%s'", self.bundle_path)
+            if key == OFFLINE_KEYNAME:
+                set_offline(True)
+                LOGGER.info("offline = '%d'", True)
+            if key == REPORT_DIR_KEYNAME:
+                self.report_dir = value
+                LOGGER.info("report_dir = '%s'", self.report_dir)
+            if key == GC_KEYNAME:
+                self.gc = True
+                LOGGER.info("gc = '%d'", self.gc)
+            if key == CACHE_CAP_KEYNAME:
+                self.cache_max_size = int(float(value) * BYTES_PER_MB)
+                LOGGER.info("cache_max_size = '%d' bytes", self.cache_max_size)
+            if key == RESUME_KEYNAME:
+                self.resume = True
+                LOGGER.info("resume = '%d'", self.resume)
+            if key == PLAYLIST_WORKERS_KEYNAME:
+                self.playlist_workers = max(1, int(value))
+                LOGGER.info("playlist_workers = '%d'", self.playlist_workers)
+
+        # Written however the run ends, including the commands that exit early
+        get_metrics().reset()
+        atexit.register(get_metrics().write_reports, self.report_dir)
+
+        if self.bundle_path and not self.warm:
+            try:
+                extract_bundle(self.bundle_path, YOUTUBE_CACHE_DIR)
+            except (RefugeeResponseBundleError, OSError) as e:
+                LOGGER.error("Failed to unpack the cache bundle: %s", e)
+                exit(1)
+
+        if self.from_sheet_id:
+            download_descriptions_from_google_sheet(self.from_sheet_id)
 
         if self.to_sheet:
-            upload_description_to_google_sheet(self.sheet_id, self.use_cache)
+            upload_description_to_google_sheet(self.sheet_id, self.use_cache,
+                                               self.sheet_mode, self.sheet_flush_size)
             exit(0)
 
         if self.insert_video_info:
             if self.video_list is not None and self.to_playlist in PLAYLIST_MAP and len(self.video_list) > 0:
-                insert_video_info(self.video_list, self.to_playlist, self.use_cache)
+                insert_video_info(self.video_list, self.to_playlist, self.use_cache, self.playlist_workers)
                 exit(0)
             elif self.video_list is None or len(self.video_list) == 0:
                 LOGGER.error("Invalid video value!")
@@ -116,94 +399,567 @@ class RefugeeResponseSushiChef(SushiChef):
                              "And please make sure input YouTube playlist ID is inside 'PLAYLIST_MAP'")
                 exit(1)
 
+        if self.gc:
+            for line in format_gc_report(collect_youtube_cache_garbage(self.cache_max_size)):
+                print(line)
+            exit(0)
+
+        if self.warm:
+            if not warm_cache(self.bundle_path or CACHE_BUNDLE_PATH, self.use_cache, self.playlist_workers,
+                              self.get_playlist_options(), self.cache_max_size):
+                exit(1)
+            exit(0)
+
+        self.languages = list(PLAYLIST_MAP)
+        if self.is_shard():
+            try:
+                self.languages = select_languages(PLAYLIST_MAP, self.language_names, *(self.shard or (None, None)))
+            except ValueError as e:
+                LOGGER.error(e)
+                exit(1)
+            LOGGER.info("Building the shard of languages: %s", ", ".join(self.languages))
+
+        self.manifest = RefugeeResponseManifest()
+        self.topic_node_datas = OrderedDict()
+        self.checkpoint = None if self.merge else RefugeeResponseCheckpoint()
+        self.resumed_topics = OrderedDict()
+        if self.resume and self.checkpoint is not None and not self.plan:
+            self.resumed_topics = self.checkpoint.load_topics(self.languages)
+            LOGGER.info("Resuming the build, %d of %d languages are checkpointed", len(self.resumed_topics),
+                        len(self.languages))
+        if self.plan:
+            self.print_plan(get_language_objs(self.languages))
+            exit(0)
+        if self.is_shard():
+            # An artifact this shard replaces must not be merged, even if the shard fails
+            remove_shard_artifacts(self.languages, self.shard_dir)
+
         channel = self.get_channel(*args, **kwargs)  # Create ChannelNode from data in self.channel_info
 
         # Get YouTube playlist URL by language
-        for lang, id_list in PLAYLIST_MAP.items():
-            rr_lang_obj = RefugeeResponseLanguage(name=lang, code=lang)
-            if not rr_lang_obj.get_lang_obj():
-                raise RefugeeResponseLangInputError("Invalid Language: " + lang)
-
-            if id_list is not None and len(id_list) > 0:
-                playlist_id = id_list[0]
-                tipic_source_id = 'refugeeresponse-child-topic-{0}'.format(rr_lang_obj.name)
-                topic_node = nodes.TopicNode(
-                    title=rr_lang_obj.native_name,
-                    source_id=tipic_source_id,
-                    author=REFUGEE_RESPONSE,
-                    provider=REFUGEE_RESPONSE,
-                    description=CHANNEL_DESCRIPTION,
-                    language=rr_lang_obj.code
-                )
-                download_video_topics(topic_node, (lang, id_list), rr_lang_obj, self.use_cache)
-                channel.add_child(topic_node)
-                LOGGER.info("Added TopicNode: '%s'", tipic_source_id)
-            else:
-                raise RefugeeResponseConfigError("Empty playlist info for language: " + lang)
-          
+        rr_lang_objs = get_language_objs(self.languages)
+        self.thumbnail_cache = None
+        if self.prefetch_thumbnails:
+            self.thumbnail_cache = RefugeeResponseThumbnailCache(max_workers=self.playlist_workers * 2,
+                                                                 downscale=self.downscale_thumbnails)
+        self.video_downloader = None
+        if self.predownload_videos:
+            self.video_downloader = RefugeeResponseVideoDownloader(max_workers=self.playlist_workers,
+                                                                   resolve_source=resolve_scheduled_youtube_source,
+                                                                   verify_checksums=self.verify_videos)
+        if self.merge:
+            self.add_topics_from_shards(channel, rr_lang_objs)
+        elif self.async_pipeline:
+            self.add_topics_async(channel, rr_lang_objs)
+        else:
+            self.add_topics(channel, rr_lang_objs)
+
         raise_for_invalid_channel(channel)  # Check for errors in channel construction
+        self.clear_checkpoint()
+        if self.is_shard():
+            # A partial channel must not be uploaded, the merge step builds the full tree
+            write_shard_artifact(get_shard_artifact_path(self.languages, self.shard_dir), self.topic_node_datas,
+                                 self.run_id)
+            self.manifest.save()
+            exit(0)
+        self.manifest.retain_topics(get_topic_source_id(rr_lang_obj) for rr_lang_obj in rr_lang_objs.values())
+        self.manifest.save()
+        if not self.merge:
+            collect_garbage(self.cache_max_size)
         return channel 
-        
-def download_video_topics(topic_node, playlist_item, lang_obj, use_cache = True, to_sheet = False):
+
+    def is_shard(self):
+        return bool(self.shard or self.language_names) and not self.merge
+
+    def get_playlist_items(self):
+        """
+        (lang, id_list) items of the languages built by this run, in PLAYLIST_MAP order
+        """
+        return [(lang, PLAYLIST_MAP[lang]) for lang in self.languages]
+
+    def clear_checkpoint(self):
+        """
+        Remove the checkpoints of the build once every language is done, else keep them for --resume
+        """
+        if self.checkpoint is None:
+            return
+        missing = [lang for lang in self.languages if lang not in self.topic_node_datas]
+        if missing:
+            LOGGER.warning("Languages missing from the build: %s; rebuild only them with %s",
+                           ", ".join(missing), RESUME_KEYNAME)
+            return
+        self.checkpoint.clear(self.languages)
+
+    def add_topics(self, channel, rr_lang_objs):
+        """
+        Extract all playlists at the same time, then build the tree in PLAYLIST_MAP order,
+        streaming each playlist's children from the cache
+        """
+        playlist_items = [item for item in self.get_playlist_items() if item[0] not in self.resumed_topics]
+        fetched = fetch_playlists(playlist_items, self.use_cache, self.playlist_workers,
+                                  self.get_playlist_options())
+        failed = []
+        for lang, id_list in self.get_playlist_items():
+            rr_lang_obj = rr_lang_objs[lang]
+            if lang in self.resumed_topics:
+                self.add_topic_from_node_datas(channel, lang, rr_lang_obj, self.resumed_topics[lang])
+                continue
+            if not fetched.get(lang):
+                LOGGER.error("Failed language '%s': failed to get playlist %s", lang, id_list[0])
+                failed.append(lang)
+                continue
+
+            with get_metrics().scope(lang):
+                self.add_topic(channel, (lang, id_list), rr_lang_obj)
+        raise_for_failed_languages(failed)
+
+    def add_topic(self, channel, playlist_item, rr_lang_obj):
+        """
+        Build the TopicNode of a cached playlist and add it to the channel
+        """
+        topic_node = create_topic_node(rr_lang_obj)
+        node_datas = None
+        if self.incremental:
+            children = RefugeeResponsePlaylist(playlist_item).iter_children()
+            node_datas = self.get_unchanged_node_datas(rr_lang_obj, children)
+        if node_datas is not None:
+            node_datas = add_video_nodes(topic_node, node_datas)
+        else:
+            node_datas = download_video_topics(topic_node, playlist_item, rr_lang_obj, use_cache=True,
+                                               thumbnail_cache=self.thumbnail_cache,
+                                               video_downloader=self.video_downloader)
+        self.record_topic(playlist_item[0], rr_lang_obj, node_datas)
+        channel.add_child(topic_node)
+        LOGGER.info("Added TopicNode: '%s'", topic_node.source_id)
+
+    def add_topics_async(self, channel, rr_lang_objs):
+        """
+        Stream playlist children from bounded-concurrency producers into TopicNodes,
+        in PLAYLIST_MAP order
+        """
+        topic_nodes = dict()
+        topic_node_datas = dict()
+        failed = []
+        playlist_options = self.get_playlist_options()
+
+        def iter_entries(playlist_item):
+            lang = playlist_item[0]
+            with get_metrics().scope(lang):
+                entries = get_entries(playlist_item)
+            return get_metrics().iter_in_scope(lang, entries)
+
+        def get_entries(playlist_item):
+            rr_lang_obj = rr_lang_objs[playlist_item[0]]
+            if playlist_item[0] in self.resumed_topics:
+                return iter_with_local_files(self.resumed_topics[playlist_item[0]], self.thumbnail_cache,
+                                             self.video_downloader)
+            playlist_obj = RefugeeResponsePlaylist(playlist_item, self.use_cache, **playlist_options)
+            children = playlist_obj.iter_children()
+            if children is None:
+                raise RefugeeResponseConfigError("failed to get playlist " + playlist_item[1][0])
+            node_datas = iter_video_node_datas(children, rr_lang_obj)
+            if self.incremental:
+                node_datas = list(node_datas)
+                unchanged_node_datas = self.get_unchanged_node_datas(rr_lang_obj, node_datas)
+                if unchanged_node_datas is not None:
+                    return unchanged_node_datas
+            return iter_with_local_files(node_datas, self.thumbnail_cache, self.video_downloader)
+
+        def consume_entry(playlist_item, node_data):
+            lang = playlist_item[0]
+            if lang not in topic_nodes:
+                topic_nodes[lang] = create_topic_node(rr_lang_objs[lang])
+                topic_node_datas[lang] = []
+            with get_metrics().scope(lang):
+                if add_video_node_data(topic_nodes[lang], node_data):
+                    topic_node_datas[lang].append(node_data)
+
+        def finish_item(playlist_item, error):
+            lang = playlist_item[0]
+            if isinstance(error, RefugeeResponseOfflineError):
+                raise error
+            if error:
+                topic_nodes.pop(lang, None)
+                topic_node_datas.pop(lang, None)
+                LOGGER.error("Failed language '%s': %s", lang, error)
+                failed.append(lang)
+                return
+            topic_node = topic_nodes.pop(lang, None) or create_topic_node(rr_lang_objs[lang])
+            self.record_topic(lang, rr_lang_objs[lang], topic_node_datas.pop(lang, []))
+            channel.add_child(topic_node)
+            LOGGER.info("Added TopicNode: '%s'", topic_node.source_id)
+
+        run_pipeline(self.get_playlist_items(), iter_entries, consume_entry, finish_item,
+                     self.playlist_workers, DEFAULT_PIPELINE_QUEUE_SIZE)
+        raise_for_failed_languages(failed)
+
+    def add_topics_from_shards(self, channel, rr_lang_objs):
+        """
+        Build the tree in PLAYLIST_MAP order from the video nodes of the shard artifacts
+        """
+        try:
+            topics = read_shard_artifacts(self.shard_dir, self.run_id)
+        except ValueError as e:
+            raise RefugeeResponseConfigError("Invalid shard artifacts: {0}".format(e))
+        missing = [lang for lang in rr_lang_objs if lang not in topics]
+        if missing:
+            raise RefugeeResponseConfigError("No shard artifact for languages: " + ", ".join(missing))
+        for lang in topics:
+            if lang not in rr_lang_objs:
+                LOGGER.warning("Ignored language '%s' of the shard artifacts: not in PLAYLIST_MAP", lang)
+
+        for lang, rr_lang_obj in rr_lang_objs.items():
+            self.add_topic_from_node_datas(channel, lang, rr_lang_obj, topics[lang])
+
+    def add_topic_from_node_datas(self, channel, lang, rr_lang_obj, node_datas):
+        """
+        Build a TopicNode from the video node data of a shard artifact or checkpoint, without extracting
+        """
+        topic_node = create_topic_node(rr_lang_obj)
+        with get_metrics().scope(lang):
+            node_datas = add_video_nodes(topic_node, iter_with_local_files(node_datas, self.thumbnail_cache,
+                                                                           self.video_downloader))
+        self.record_topic(lang, rr_lang_obj, node_datas)
+        channel.add_child(topic_node)
+        LOGGER.info("Added TopicNode: '%s'", topic_node.source_id)
+
+    def get_playlist_options(self):
+        """
+        Extra keyword arguments of RefugeeResponsePlaylist from the command line options
+        """
+        return dict(incremental=self.incremental, ttl=self.cache_ttl, refresh_limit=self.refresh_limit)
+
+    def get_unchanged_node_datas(self, rr_lang_obj, children):
+        """
+        Node data of the language from the manifest if none of its videos changed since
+        the last build, else None. Local files missing from the manifest still go through the download stages.
+        """
+        topic_id = get_topic_source_id(rr_lang_obj)
+        if not self.manifest.has_topic(topic_id):
+            return None
+        diff = self.manifest.diff(topic_id, iter_video_node_datas(children or [], rr_lang_obj))
+        if not is_unchanged_diff(diff):
+            return None
+        LOGGER.info("[Language %s] Unchanged since the last build, reusing its %d nodes",
+                    rr_lang_obj.name, len(diff[DIFF_UNCHANGED]))
+        node_datas = self.manifest.get_node_datas(topic_id)
+        # Only fetch the local files that the last build did not have
+        thumbnail_cache = self.thumbnail_cache
+        if all(node_data.get('thumbnail_path') for node_data in node_datas):
+            thumbnail_cache = None
+        video_downloader = self.video_downloader
+        if all(node_data.get('video_path') for node_data in node_datas):
+            video_downloader = None
+        return iter_with_local_files(node_datas, thumbnail_cache, video_downloader)
+
+    def record_topic(self, lang, rr_lang_obj, node_datas):
+        """
+        Log the diff of a built topic, checkpoint it and record its nodes in the manifest,
+        saved once the build succeeds. Topics are keyed by their PLAYLIST_MAP `lang`.
+        """
+        topic_id = get_topic_source_id(rr_lang_obj)
+        node_datas = list(node_datas)
+        LOGGER.info("[Language %s] %s", rr_lang_obj.name, format_diff(self.manifest.diff(topic_id, node_datas)))
+        if self.checkpoint is not None:
+            self.checkpoint.save_topic(lang, node_datas)
+        self.manifest.set_topic(topic_id, node_datas)
+        self.topic_node_datas[lang] = node_datas
+
+    def print_plan(self, rr_lang_objs):
+        """
+        Print the diff of every language against the manifest of the last successful build
+        """
+        fetched = fetch_playlists(self.get_playlist_items(), self.use_cache, self.playlist_workers,
+                                  self.get_playlist_options())
+        for lang, id_list in self.get_playlist_items():
+            if not fetched.get(lang):
+                print("{0}: failed to get playlist {1}".format(lang, id_list[0]))
+                continue
+            rr_lang_obj = rr_lang_objs[lang]
+            children = RefugeeResponsePlaylist((lang, id_list)).iter_children()
+            diff = self.manifest.diff(get_topic_source_id(rr_lang_obj),
+                                      iter_video_node_datas(children or [], rr_lang_obj))
+            print("{0}: {1}".format(lang, format_diff(diff)))
+            for kind in DIFF_KINDS:
+                if kind == DIFF_UNCHANGED:
+                    continue
+                for source_id in diff[kind]:
+                    print("  {0} {1}".format(kind, source_id))
+
+def get_language_objs(languages = None):
+    """
+    OrderedDict of lang => RefugeeResponseLanguage for every PLAYLIST_MAP language,
+    or only the given ones (in PLAYLIST_MAP order)
+    """
+    rr_lang_objs = OrderedDict()
+    for lang, id_list in PLAYLIST_MAP.items():
+        if languages is not None and lang not in languages:
+            continue
+        rr_lang_obj = RefugeeResponseLanguage(name=lang, code=lang)
+        if not rr_lang_obj.get_lang_obj():
+            raise RefugeeResponseLangInputError("Invalid Language: " + lang)
+        if id_list is None or len(id_list) == 0:
+            raise RefugeeResponseConfigError("Empty playlist info for language: " + lang)
+        rr_lang_objs[lang] = rr_lang_obj
+    return rr_lang_objs
+
+def raise_for_failed_languages(failed):
+    """
+    Fail the build once every language was tried: a channel missing a topic must not be uploaded,
+    Studio would delete the topic. The completed languages are checkpointed for --resume.
+    """
+    if failed:
+        raise RefugeeResponseBuildError("Failed to build the languages: {0}; rebuild them with {1}".format(
+            ", ".join(failed), RESUME_KEYNAME))
+
+def get_topic_source_id(lang_obj):
+    return 'refugeeresponse-child-topic-{0}'.format(lang_obj.name)
+
+def create_topic_node(lang_obj):
+    tipic_source_id = get_topic_source_id(lang_obj)
+    return nodes.TopicNode(
+        title=lang_obj.native_name,
+        source_id=tipic_source_id,
+        author=REFUGEE_RESPONSE,
+        provider=REFUGEE_RESPONSE,
+        description=CHANNEL_DESCRIPTION,
+        language=lang_obj.code
+    )
+
+def fetch_playlist_info(playlist_item, use_cache = True, playlist_options = None):
+    """
+    Get the playlist info of one (lang, id_list) item into the cache, without reading back a
+    playlist that is already cached. Returns False on failure.
+    """
+    lang = playlist_item[0]
+    try:
+        playlist_obj = RefugeeResponsePlaylist(playlist_item, use_cache, **(playlist_options or dict()))
+        return playlist_obj.cache_playlist()
+    except RefugeeResponseOfflineError:
+        raise
+    except Exception as e:
+        LOGGER.error("[Language %s] Error getting playlist info: %s", lang, e)
+        return False
+
+def fetch_playlists(playlist_items, use_cache = True, max_workers = DEFAULT_PLAYLIST_WORKERS,
+                    playlist_options = None):
+    """
+    Get the playlist info of every (lang, id_list) item into the cache through a bounded worker pool.
+    Returns an OrderedDict of lang => True if the playlist is cached, in input order.
+    The playlist infos are not kept, read them back with RefugeeResponsePlaylist.iter_children.
+    """
+    def fetch_playlist(playlist_item):
+        with get_metrics().scope(playlist_item[0]):
+            return fetch_playlist_info(playlist_item, use_cache, playlist_options)
+
+    playlist_items = list(playlist_items)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [(item[0], executor.submit(fetch_playlist, item)) for item in playlist_items]
+        return OrderedDict((lang, future.result()) for lang, future in futures)
+
+def collect_garbage(max_size = None):
+    """
+    Collect the cache garbage after a build, a failure is logged and does not fail the build
+    """
+    try:
+        collect_youtube_cache_garbage(max_size)
+    except Exception as e:
+        LOGGER.error("Failed to collect the cache garbage: %s", e)
+
+def warm_cache(bundle_path = CACHE_BUNDLE_PATH, use_cache = True, max_workers = DEFAULT_PLAYLIST_WORKERS,
+               playlist_options = None, max_size = None):
+    """
+    Fill the cache with every PLAYLIST_MAP playlist, then pack it with the video descriptions
+    into a bundle for offline builds, without the cache garbage. Returns False if anything is missing.
+    """
+    fetched = fetch_playlists(PLAYLIST_MAP.items(), use_cache, max_workers, playlist_options)
+    failed = [lang for lang, cached in fetched.items() if not cached]
+    if failed:
+        LOGGER.error("Cache not bundled, failed to get the playlists of: %s", ", ".join(failed))
+        return False
+    if not os.path.exists(VIDEO_DESCRIPTION_JSON_PATH):
+        LOGGER.error("Cache not bundled, no video descriptions at %s", VIDEO_DESCRIPTION_JSON_PATH)
+        return False
+    collect_garbage(max_size)
+    close_youtube_cache()
+    create_bundle(YOUTUBE_CACHE_DIR, bundle_path)
+    return True
+
+def download_video_topics(topic_node, playlist_item, lang_obj, use_cache = True, to_sheet = False, playlist_info = None,
+                          thumbnail_cache = None, video_downloader = None):
     """
     Scrape, collect, and download the videos from playlist.
+    With a thumbnail_cache, the thumbnails are prefetched and the nodes get local paths.
+    With a video_downloader, the video files are pre-downloaded and the nodes use the local files.
+    Returns the node data of the added video nodes.
     """
-    playlist_obj = RefugeeResponsePlaylist(playlist_item, use_cache)
-    playlist_info = playlist_obj.get_playlist_info()
-    videos = [entry['id'] for entry in playlist_info.get('children')]
-    for video in playlist_info.get('children'):
-        video_id = video['id']
-        video_url = YOUTUBE_VIDEO_URL_FORMAT.format(video_id)
-        video_source_id = 'refugee-response-{0}-{1}'.format(lang_obj.name, video_id)
-        if video_id in VIDEO_DESCRIPTION_MAP:
-            video_description = VIDEO_DESCRIPTION_MAP[video_id]
-        else:
-            # Exclude videos
+    if playlist_info is not None:
+        videos = playlist_info.get('children')
+    else:
+        videos = RefugeeResponsePlaylist(playlist_item, use_cache).iter_children()
+    node_datas = iter_video_node_datas(videos or [], lang_obj)
+    return add_video_nodes(topic_node, iter_with_local_files(node_datas, thumbnail_cache, video_downloader))
+
+def iter_with_local_files(node_datas, thumbnail_cache = None, video_downloader = None):
+    """
+    Run the video node data through the thumbnail prefetch and video pre-download stages, if enabled
+    """
+    if thumbnail_cache:
+        node_datas = iter_with_local_thumbnails(node_datas, thumbnail_cache)
+    if video_downloader:
+        # Excluded videos have no node data, every video left is downloaded
+        node_datas = iter_with_local_videos(node_datas, video_downloader)
+    return node_datas
+
+def resolve_scheduled_youtube_source(video_id):
+    video_url = YOUTUBE_VIDEO_URL_FORMAT.format(video_id)
+    check_offline(video_url)
+    return get_extraction_scheduler().run(video_url, resolve_youtube_source, video_id)
+
+def get_video_file(node_data):
+    """
+    The pre-downloaded local file of the video if there is one, else the YouTube file
+    """
+    if node_data.get('video_path'):
+        return files.VideoFile(path=node_data['video_path'], language=node_data['language'])
+    return files.YouTubeVideoFile(youtube_id=node_data['id'], language=node_data['language'])
+
+def get_video_node_data(video, lang_obj):
+    """
+    Fields of the VideoNode of a playlist child, None if the video is excluded.
+    `id` is the YouTube id of the video file; local files are added by the download stages
+    as `thumbnail_path` and `video_path`.
+    """
+    video_id = video['id']
+    if (video_id, lang_obj.name) in VIDEO_DESCRIPTION_MAP:
+        video_description = VIDEO_DESCRIPTION_MAP[(video_id, lang_obj.name)]
+    else:
+        # Exclude videos
+        return None
+    return dict(
+        source_id='refugee-response-{0}-{1}'.format(lang_obj.name, video_id),
+        id=video_id,
+        title=video['title'],
+        description=video_description,
+        thumbnail=video['thumbnail'],
+        language=lang_obj.code,
+    )
+
+def iter_video_node_datas(videos, lang_obj):
+    for video in videos:
+        if not video:
             continue
-        LOGGER.info("Video Description: '%s'", video_description)
-        try:
+        node_data = get_video_node_data(video, lang_obj)
+        if node_data:
+            yield node_data
+
+def add_video_node_data(topic_node, node_data):
+    """
+    Add a VideoNode to the topic, returns False if it can't be created
+    """
+    LOGGER.info("Video Description: '%s'", node_data['description'])
+    try:
+        with get_metrics().measure(PHASE_NODE):
             video_node = nodes.VideoNode(
-                source_id=video_source_id, 
-                title=video['title'],
-                description=video_description,
+                source_id=node_data['source_id'],
+                title=node_data['title'],
+                description=node_data['description'],
                 author=REFUGEE_RESPONSE,
-                language=lang_obj.code,
+                language=node_data['language'],
                 provider=REFUGEE_RESPONSE,
-                thumbnail=video['thumbnail'],
+                thumbnail=node_data.get('thumbnail_path') or node_data['thumbnail'],
                 license=licenses.get_license("CC BY-NC-ND", copyright_holder=REFUGEE_RESPONSE),
                 files=[
-                    files.YouTubeVideoFile(
-                        youtube_id=video_id,
-                        language=lang_obj.code
-                    )
+                    get_video_file(node_data)
                 ]
             )
             topic_node.add_child(video_node)
-        except Exception as e:
-            LOGGER.error('Error downloading this video: %s', e)
+        return True
+    except Exception as e:
+        LOGGER.error('Error downloading this video: %s', e)
+        return False
+
+def add_video_nodes(topic_node, node_datas):
+    """
+    Add the VideoNodes to the topic, returns the node data of the added ones
+    """
+    return [node_data for node_data in node_datas if add_video_node_data(topic_node, node_data)]
 
+def extract_video_info(video_id, use_cache = True):
+    """
+    Extract the info of one video, returns (video_info, error message)
+    """
+    try:
+        video_url = YOUTUBE_VIDEO_URL_FORMAT.format(video_id)
+        rr_video_obj = RefugeeResponseVideo(url=video_url)
+        if not rr_video_obj.download_info(use_cache):
+            return None, "failed to extract video info"
+        video_info = get_youtube_cache().get_video(video_id)
+        if not video_info:
+            return None, "no cached video info after extraction"
+        return video_info, None
+    except Exception as e:
+        return None, str(e)
 
-def insert_video_info(video_list, playlist, use_cache = True):
-    playlist_item = (playlist, PLAYLIST_MAP[playlist][0])
+def insert_video_info(video_list, playlist, use_cache = True, max_workers = DEFAULT_PLAYLIST_WORKERS):
+    """
+    Extract the listed videos concurrently and merge them into the cached playlist with one write.
+    Returns a dict of video id => None on success, or the error message.
+    """
+    playlist_item = (playlist, PLAYLIST_MAP[playlist])
     playlist_obj = RefugeeResponsePlaylist(playlist_item, use_cache)
-    for video in video_list: 
-        try:
-            video_url = YOUTUBE_VIDEO_URL_FORMAT.format(video)
-            rr_video_obj = RefugeeResponseVideo(url=video_url)
-            if rr_video_obj.download_info(use_cache):
-                LOGGER.info("Success extract video info with title: %s", rr_video_obj.title)
-                if not playlist_obj.insert_video_info(video):
-                    LOGGER.error("Failed to insert video: %s", rr_video_obj.title)
-            else:
-                LOGGER.error("Failed to extract video info for: %s", video)
-        except Exception as e:
-            LOGGER.error('Error extract video info: %s', e)
+    video_list = [video.strip() for video in video_list if video.strip()]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            (video, executor.submit(extract_video_info, video, use_cache))
+            for video in video_list
+        ]
+        results = OrderedDict((video, future.result()) for video, future in futures)
+
+    video_infos = [video_info for video_info, error in results.values() if video_info]
+    errors = OrderedDict((video, error) for video, (video_info, error) in results.items())
+    if video_infos and not playlist_obj.insert_videos_info(video_infos):
+        for video, (video_info, error) in results.items():
+            if video_info:
+                errors[video] = "failed to insert into playlist " + playlist
+
+    for video, error in errors.items():
+        if error:
+            LOGGER.error("[Video: %s] Failed: %s", video, error)
+        else:
+            LOGGER.info("[Video: %s] Inserted into playlist %s: %s", video, playlist, results[video][0].get('title'))
+    LOGGER.info("Inserted %d of %d videos into playlist %s",
+                len([error for error in errors.values() if not error]), len(errors), playlist)
+    return errors
+
+def get_sheet_writer(sheet_id, sheet_mode = SHEET_MODE_BATCH, flush_size = DEFAULT_FLUSH_SIZE):
+    if sheet_mode == SHEET_MODE_APPEND:
+        return RefugeeResponseSheetWriter(sheet_id)
+    if sheet_mode == SHEET_MODE_SYNC:
+        return RefugeeResponseSheetSyncWriter(sheet_id, flush_size)
+    return RefugeeResponseBufferedSheetWriter(sheet_id, flush_size)
 
-def upload_description_to_google_sheet(sheet_id, use_cache = True):
+def upload_description_to_google_sheet(sheet_id, use_cache = True, sheet_mode = SHEET_MODE_BATCH,
+                                       flush_size = DEFAULT_FLUSH_SIZE):
     """
     Fetch and update video description to Google spreadsheet
     """
-    google_sheet_obj = RefugeeResponseSheetWriter(sheet_id)
+    with get_sheet_writer(sheet_id, sheet_mode, flush_size) as google_sheet_obj:
+        write_descriptions_to_sheet(google_sheet_obj, use_cache)
+    if sheet_mode == SHEET_MODE_SYNC:
+        LOGGER.info("Google sheet sync finished, %s", google_sheet_obj.get_summary())
+
+def download_descriptions_from_google_sheet(sheet_id, json_path = VIDEO_DESCRIPTION_JSON_PATH):
+    """
+    Update the local video description index from the Google spreadsheet, unless its revision is unchanged
+    """
+    RefugeeResponseSheetReader(sheet_id).download_descriptions(json_path)
+
+def write_descriptions_to_sheet(google_sheet_obj, use_cache = True):
+    """
+    Write the description record of every playlist video with the given sheet writer
+    """
     for lang, id_list in PLAYLIST_MAP.items():
         rr_lang_obj = RefugeeResponseLanguage(name=lang, code=lang)
         if not rr_lang_obj.get_lang_obj():
@@ -212,17 +968,12 @@ def upload_description_to_google_sheet(sheet_id, use_cache = True):
         if id_list is not None and len(id_list) > 0:
             playlist_id = id_list[0]
             playlist_obj = RefugeeResponsePlaylist((lang, id_list), use_cache)
-            playlist_info = playlist_obj.get_playlist_info()
-            if playlist_info is None:
-                LOGGER.error("Invalid video playlist: %s", playlist_id)
-                raise RefugeeResponseConfigError("Invalid playlist: " + playlist_id)
-
-            videos = playlist_info.get('children')
+            videos = playlist_obj.iter_children()
             if videos is None:
                 LOGGER.error("Invalid video playlist: %s", playlist_id)
                 raise RefugeeResponseConfigError("Invalid playlist: " + playlist_id)
-      
-            for video_info in playlist_info.get('children'):
+
+            for video_info in videos:
                 record = RefugeeResponseDescriptionRecord(video_info['id'],
                                                           video_info['source_url'],
                                                           video_info['description'],
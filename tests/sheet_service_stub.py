@@ -0,0 +1,82 @@
+"""
+In-memory stand-in of the Sheets `spreadsheets()` resource, shared by the tests and
+benchmarks/chef_benchmark.py
+"""
+import random
+import re
+import time
+
+
+class FakeSheetRequest():
+
+    def __init__(self, sheet, action):
+        self.sheet = sheet
+        self.action = action
+
+    def execute(self):
+        self.sheet.request_count += 1
+        if self.sheet.latency:
+            time.sleep(self.sheet.latency)
+        if self.sheet.random.random() < self.sheet.failure_rate:
+            raise Exception("HTTP Error 503: Service Unavailable")
+        return self.action()
+
+
+class FakeSheetService():
+    """
+    Holds the rows of one sheet; every request counts in `request_count`, waits `latency`
+    seconds and fails with a 503 at `failure_rate`
+    """
+    CELL_REGEX = re.compile(r'!([A-Z])(\d+)')
+
+    def __init__(self, rows=None, latency=0.0, failure_rate=0.0):
+        self.rows = [list(row) for row in rows or []]
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.request_count = 0
+        self.random = random.Random(0)
+
+    def values(self):
+        return self
+
+    def get_first_cell(self, range):
+        """
+        (column index, row number) of the top left cell of an A1 range
+        """
+        match = self.CELL_REGEX.search(range)
+        return ord(match.group(1)) - ord('A'), int(match.group(2))
+
+    def write_rows(self, range, values):
+        first_column, first_row = self.get_first_cell(range)
+        for offset, row in enumerate(values):
+            index = first_row - 1 + offset
+            while len(self.rows) <= index:
+                self.rows.append([])
+            old_row = self.rows[index]
+            old_row.extend([''] * (first_column + len(row) - len(old_row)))
+            old_row[first_column:first_column + len(row)] = row
+        return {'updatedRows': len(values)}
+
+    def append_rows(self, values):
+        first_row = len(self.rows) + 1
+        self.rows.extend(list(row) for row in values)
+        return {'tableRange': 'Sheet1!A1:E{0}'.format(first_row + len(values) - 1)}
+
+    def get(self, spreadsheetId, range):
+        return FakeSheetRequest(self, lambda: {'values': [list(row) for row in self.rows]})
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension):
+        return FakeSheetRequest(self, lambda: {'valueRanges': [{'values': [list(row) for row in self.rows]}]})
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        return FakeSheetRequest(self, lambda: self.append_rows(body['values']))
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return FakeSheetRequest(self, lambda: self.write_rows(range, body['values']))
+
+    def batchUpdate(self, spreadsheetId, body):
+        return FakeSheetRequest(self, lambda: [self.write_rows(data['range'], data['values'])
+                                               for data in body['data']])
+
+    def clear(self, spreadsheetId, range, body):
+        return FakeSheetRequest(self, lambda: self.rows.clear())
@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google_sheet_utils import (RefugeeResponseBufferedSheetWriter, RefugeeResponseDescriptionRecord,
+                                RefugeeResponseSheetReader, RefugeeResponseSheetSyncWriter, TITLE_LIST)
+from sheet_service_stub import FakeSheetService
+from utils import RefugeeResponseDescriptionMap
+
+
+def make_records(descriptions):
+    return [
+        RefugeeResponseDescriptionRecord(video_id, 'https://www.youtube.com/watch?v=' + video_id,
+                                         description, language, title='Title of ' + video_id)
+        for video_id, language, description in descriptions
+    ]
+
+
+def sync(sheet, records):
+    with RefugeeResponseSheetSyncWriter('spreadsheet', flush_size=2, sheet_service=sheet) as writer:
+        for record in records:
+            writer.write_description_record(record)
+    return writer
+
+
+def write_buffered(sheet, records, flush_size):
+    with RefugeeResponseBufferedSheetWriter('spreadsheet', flush_size=flush_size, sheet_service=sheet) as writer:
+        for record in records:
+            writer.write_description_record(record)
+    return writer
+
+
+class BufferedSheetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = make_records([
+            ('video{0:05d}x'.format(index), 'English', 'Video {0}'.format(index)) for index in range(5)
+        ])
+
+    def test_rows_are_sent_every_flush_size_rows(self):
+        sheet = FakeSheetService()
+        writer = write_buffered(sheet, self.records, flush_size=2)
+        self.assertEqual(sheet.rows, [TITLE_LIST] + [record.to_row() for record in self.records])
+        # One read of the first column, then the title and 5 rows sent 2 at a time
+        self.assertEqual(writer.request_count, 1 + 3)
+        self.assertEqual(sheet.request_count, writer.request_count)
+
+    def test_remaining_rows_are_flushed_on_exit(self):
+        sheet = FakeSheetService()
+        with RefugeeResponseBufferedSheetWriter('spreadsheet', flush_size=100, sheet_service=sheet) as writer:
+            for record in self.records:
+                writer.write_description_record(record)
+            self.assertEqual(sheet.rows, [])
+        self.assertEqual(len(sheet.rows), 1 + len(self.records))
+        self.assertEqual(writer.request_count, 2)
+
+    def test_rows_are_appended_after_the_existing_ones(self):
+        sheet = FakeSheetService()
+        write_buffered(sheet, self.records[:2], flush_size=10)
+        writer = write_buffered(sheet, self.records[2:], flush_size=10)
+        self.assertEqual(sheet.rows, [TITLE_LIST] + [record.to_row() for record in self.records])
+        self.assertEqual(writer.request_count, 2)
+
+    def test_invalid_sheet_is_rejected(self):
+        sheet = FakeSheetService([['Not a title']])
+        with self.assertRaises(Exception):
+            write_buffered(sheet, self.records, flush_size=2)
+        self.assertEqual(sheet.rows, [['Not a title']])
+
+
+class SheetSyncWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        # The same video is listed in the playlists of two languages
+        self.records = make_records([
+            ('video00001a', 'English', 'First video'),
+            ('video00002b', 'English', 'Second video'),
+            ('video00002b', 'Arabic', 'Second video'),
+            ('video00003c', 'Arabic', 'Third video'),
+        ])
+
+    def test_first_sync_writes_one_row_per_video_and_language(self):
+        sheet = FakeSheetService()
+        writer = sync(sheet, self.records)
+        self.assertEqual(sheet.rows[0], TITLE_LIST)
+        self.assertEqual(sheet.rows[1:], [record.to_row() for record in self.records])
+        self.assertEqual(writer.counts, dict(inserted=4, updated=0, unchanged=0))
+
+    def test_rerun_is_idempotent(self):
+        sheet = FakeSheetService()
+        sync(sheet, self.records)
+        rows = [list(row) for row in sheet.rows]
+        request_count = sheet.request_count
+
+        writer = sync(sheet, self.records)
+        self.assertEqual(sheet.rows, rows)
+        self.assertEqual(writer.counts, dict(inserted=0, updated=0, unchanged=4))
+        # Only the read of the sheet, no update request
+        self.assertEqual(sheet.request_count - request_count, 1)
+
+    def test_rerun_keeps_edited_descriptions(self):
+        sheet = FakeSheetService()
+        sync(sheet, self.records)
+        # Editors exclude a video and rewrite a description in the sheet
+        sheet.rows[2][TITLE_LIST.index('Description')] = 'EXCLUDE'
+        sheet.rows[3][TITLE_LIST.index('Description')] = 'Edited by editor'
+        edited_rows = [list(row) for row in sheet.rows]
+
+        writer = sync(sheet, self.records)
+        self.assertEqual(sheet.rows, edited_rows)
+        self.assertEqual(writer.counts, dict(inserted=0, updated=0, unchanged=4))
+
+    def test_rerun_syncs_youtube_columns_and_appends_new_rows(self):
+        sheet = FakeSheetService()
+        sync(sheet, self.records)
+        sheet.rows[3][TITLE_LIST.index('Description')] = 'Edited by editor'
+        retitled = RefugeeResponseDescriptionRecord('video00002b', self.records[2].video_url, 'Second video',
+                                                    'Arabic', title='New title on YouTube')
+        new = make_records([('video00004d', 'English', 'Fourth video')])[0]
+
+        writer = sync(sheet, self.records[:2] + [retitled, self.records[3], new])
+        self.assertEqual(writer.counts, dict(inserted=1, updated=1, unchanged=3))
+        self.assertEqual(len(sheet.rows), 6)
+        self.assertEqual(sheet.rows[3], ['video00002b', retitled.video_url, 'New title on YouTube', 'Arabic',
+                                         'Edited by editor'])
+        self.assertEqual(sheet.rows[5], new.to_row())
+
+        writer = sync(sheet, self.records[:2] + [retitled, self.records[3], new])
+        self.assertEqual(writer.counts, dict(inserted=0, updated=0, unchanged=5))
+
+
+class SheetReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.json_path = os.path.join(self.work_dir, 'video_description.json')
+
+    def download(self, rows):
+        sheet = FakeSheetService([TITLE_LIST] + [record.to_row() for record in make_records(rows)])
+        RefugeeResponseSheetReader('spreadsheet', sheet_service=sheet).download_descriptions(self.json_path)
+        return RefugeeResponseDescriptionMap(self.json_path)
+
+    def test_descriptions_are_read_per_language(self):
+        # Whatever the row order, each language gets the description of its own row
+        rows = [
+            ('video00001a', 'English', 'English description'),
+            ('video00001a', 'Arabic', 'Arabic description'),
+            ('video00002b', 'Arabic', 'EXCLUDE'),
+            ('video00002b', 'English', 'Second video'),
+        ]
+        for ordered_rows in (rows, rows[::-1]):
+            descriptions = self.download(ordered_rows)
+            self.assertEqual(descriptions[('video00001a', 'English')], 'English description')
+            self.assertEqual(descriptions[('video00001a', 'Arabic')], 'Arabic description')
+            self.assertEqual(descriptions[('video00002b', 'English')], 'Second video')
+            self.assertNotIn(('video00002b', 'Arabic'), descriptions)
+            self.assertNotIn(('video00001a', 'French'), descriptions)
+
+    def test_index_without_languages_applies_to_all_languages(self):
+        with open(self.json_path, 'w') as json_file:
+            json.dump({'video00001a': {'Description': 'First video'}, 'video00002b': {'Description': 'EXCLUDE'},
+                       'video00003c': {'Description': None}}, json_file)
+        descriptions = RefugeeResponseDescriptionMap(self.json_path)
+        self.assertEqual(descriptions[('video00001a', 'Arabic')], 'First video')
+        self.assertNotIn(('video00002b', 'Arabic'), descriptions)
+        self.assertEqual(descriptions[('video00003c', 'English')], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
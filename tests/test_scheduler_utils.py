@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_utils import RefugeeResponseNegativeCache
+from scheduler_utils import RefugeeResponseExtractionScheduler, is_permanent_error, is_transient_error
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=video00001a'
+
+
+class FlakyExtraction():
+    """
+    Raises the `errors` one per call, then returns 'info'
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.call_count = 0
+
+    def __call__(self):
+        self.call_count += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'info'
+
+
+def make_scheduler():
+    return RefugeeResponseExtractionScheduler(rate=0, max_retries=3, backoff_base=0)
+
+
+class ErrorClassificationTest(unittest.TestCase):
+
+    def test_server_errors_and_throttling_are_transient(self):
+        for message in ("HTTP Error 503: Service Unavailable", "HTTP Error 500: Internal Server Error",
+                        "ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests"):
+            self.assertTrue(is_transient_error(Exception(message)), message)
+            self.assertFalse(is_permanent_error(Exception(message)), message)
+
+    def test_unavailable_videos_are_permanent(self):
+        for message in ("ERROR: Video unavailable", "ERROR: This video is unavailable.",
+                        "ERROR: Private video. Sign in if you've been granted access to this video",
+                        "ERROR: This video has been removed by the uploader"):
+            self.assertFalse(is_transient_error(Exception(message)), message)
+            self.assertTrue(is_permanent_error(Exception(message)), message)
+
+    def test_negative_cache_agrees_with_the_scheduler(self):
+        for message in ("HTTP Error 503: Service Unavailable", "ERROR: Video unavailable"):
+            self.assertEqual(RefugeeResponseNegativeCache.is_unavailable_error(Exception(message)),
+                             not is_transient_error(Exception(message)), message)
+
+
+class ExtractionSchedulerTest(unittest.TestCase):
+
+    def test_service_unavailable_is_retried(self):
+        extraction = FlakyExtraction(Exception("HTTP Error 503: Service Unavailable"))
+        self.assertEqual(make_scheduler().run(VIDEO_URL, extraction), 'info')
+        self.assertEqual(extraction.call_count, 2)
+
+    def test_video_unavailable_is_not_retried(self):
+        extraction = FlakyExtraction(Exception("ERROR: Video unavailable"))
+        with self.assertRaises(Exception):
+            make_scheduler().run(VIDEO_URL, extraction)
+        self.assertEqual(extraction.call_count, 1)
+
+    def test_retries_are_bounded(self):
+        extraction = FlakyExtraction(*[Exception("HTTP Error 503: Service Unavailable")] * 5)
+        with self.assertRaises(Exception):
+            make_scheduler().run(VIDEO_URL, extraction)
+        self.assertEqual(extraction.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thumbnail_utils import RefugeeResponseThumbnailCache, iter_with_local_thumbnails
+
+THUMBNAIL_URL = 'https://i.ytimg.com/vi/{0}/hqdefault.jpg'
+
+
+class FakeImageResponse(io.BytesIO):
+
+    def __init__(self, content, content_type='image/jpeg'):
+        super().__init__(content)
+        self.headers = {'Content-Type': content_type}
+
+
+class FakeImageServer():
+    """
+    Stand-in of urllib.request.urlopen serving `images` (URL => bytes)
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self.requested_urls = []
+
+    def __call__(self, request, timeout=None):
+        url = request.full_url
+        self.requested_urls.append(url)
+        if url not in self.images:
+            raise Exception("HTTP Error 404: Not Found")
+        return FakeImageResponse(self.images[url])
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        # Two videos share the same image
+        self.server = FakeImageServer({
+            THUMBNAIL_URL.format('video00001a'): b'first image',
+            THUMBNAIL_URL.format('video00002b'): b'second image',
+            THUMBNAIL_URL.format('video00003c'): b'first image',
+        })
+        patcher = mock.patch('urllib.request.urlopen', self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_cache(self, downscale=False):
+        # Pillow may not be installed, downscale_image is replaced where downscaling is tested
+        with mock.patch('importlib.util.find_spec', return_value=object()):
+            return RefugeeResponseThumbnailCache(self.cache_dir, max_workers=2, downscale=downscale)
+
+    def test_identical_images_share_one_file(self):
+        cache = self.make_cache()
+        paths = cache.prefetch(self.server.images)
+        self.assertEqual(paths[THUMBNAIL_URL.format('video00001a')], paths[THUMBNAIL_URL.format('video00003c')])
+        self.assertNotEqual(paths[THUMBNAIL_URL.format('video00001a')], paths[THUMBNAIL_URL.format('video00002b')])
+        with open(paths[THUMBNAIL_URL.format('video00002b')], 'rb') as image_file:
+            self.assertEqual(image_file.read(), b'second image')
+        self.assertEqual(cache.downloaded_count, 3)
+
+    def test_index_is_reused_by_the_next_run(self):
+        paths = self.make_cache().prefetch(self.server.images)
+        request_count = len(self.server.requested_urls)
+
+        cache = self.make_cache()
+        self.assertEqual(cache.prefetch(self.server.images), paths)
+        self.assertEqual(len(self.server.requested_urls), request_count)
+        self.assertEqual(cache.downloaded_count, 0)
+
+    def test_failed_download_has_no_path(self):
+        url = THUMBNAIL_URL.format('missing0000')
+        cache = self.make_cache()
+        self.assertEqual(cache.prefetch([url]), {url: None})
+        self.assertIsNone(cache.get_path(url))
+
+    def test_downscaled_copies_are_indexed_separately(self):
+        url = THUMBNAIL_URL.format('video00001a')
+        original_path = self.make_cache().prefetch([url])[url]
+
+        def downscale_image(cache, path):
+            with open(path, 'wb') as image_file:
+                image_file.write(b'small image')
+
+        with mock.patch.object(RefugeeResponseThumbnailCache, 'downscale_image', downscale_image):
+            cache = self.make_cache(downscale=True)
+            downscaled_path = cache.prefetch([url])[url]
+        self.assertNotEqual(downscaled_path, original_path)
+        self.assertEqual(cache.downloaded_count, 1)
+        with open(downscaled_path, 'rb') as image_file:
+            self.assertEqual(image_file.read(), b'small image')
+        # Both copies stay indexed for the runs with and without downscaling
+        self.assertEqual(self.make_cache().get_path(url), original_path)
+        self.assertEqual(self.make_cache(downscale=True).get_path(url), downscaled_path)
+
+    def test_downscale_is_disabled_without_pillow(self):
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            cache = RefugeeResponseThumbnailCache(self.cache_dir, downscale=True)
+        self.assertFalse(cache.downscale)
+
+    def test_children_get_local_thumbnail_paths(self):
+        videos = [{'id': video_id, 'thumbnail': THUMBNAIL_URL.format(video_id)}
+                  for video_id in ('video00001a', 'video00002b', 'missing0000')]
+        children = list(iter_with_local_thumbnails(videos, self.make_cache(), batch_size=2))
+        self.assertEqual([child['id'] for child in children], ['video00001a', 'video00002b', 'missing0000'])
+        self.assertTrue(os.path.exists(children[0]['thumbnail_path']))
+        self.assertTrue(os.path.exists(children[1]['thumbnail_path']))
+        self.assertNotIn('thumbnail_path', children[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+from urllib.error import HTTPError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import video_utils
+from video_utils import RefugeeResponseVideoDownloader, PARTIAL_FILE_SUFFIX
+
+VIDEO_ID = 'video00001a'
+VIDEO_URL = 'https://example.com/' + VIDEO_ID + '.mp4'
+VIDEO_CONTENT = bytes(range(256)) * 40
+
+
+class FakeVideoResponse(io.BytesIO):
+
+    def __init__(self, content, status):
+        super().__init__(content)
+        self.status = status
+
+
+class FakeVideoServer():
+    """
+    Stand-in of urllib.request.urlopen serving `content` with HTTP range requests,
+    answered with a 416 error when not `satisfiable`
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.satisfiable = True
+        self.ranges = []
+
+    def __call__(self, request, timeout=None):
+        range_header = request.get_header('Range')
+        self.ranges.append(range_header)
+        if not range_header:
+            return FakeVideoResponse(self.content, 200)
+        offset = int(range_header[len('bytes='):-1])
+        if offset >= len(self.content) or not self.satisfiable:
+            raise HTTPError(request.full_url, 416, 'Range Not Satisfiable', {}, None)
+        return FakeVideoResponse(self.content[offset:], 206)
+
+
+class VideoDownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.download_dir, True)
+        self.server = FakeVideoServer(VIDEO_CONTENT)
+        patcher = mock.patch('urllib.request.urlopen', self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.expected_size = len(VIDEO_CONTENT)
+
+    def make_downloader(self, verify_checksums=False):
+        return RefugeeResponseVideoDownloader(self.download_dir, max_workers=2, verify_checksums=verify_checksums,
+                                              resolve_source=lambda video_id: (VIDEO_URL, self.expected_size))
+
+    def get_part_path(self):
+        return os.path.join(self.download_dir, VIDEO_ID + '.mp4' + PARTIAL_FILE_SUFFIX)
+
+    def write_part(self, content):
+        with open(self.get_part_path(), 'wb') as part_file:
+            part_file.write(content)
+
+    def read_video(self, path):
+        with open(path, 'rb') as video_file:
+            return video_file.read()
+
+    def test_download_is_recorded_in_the_manifest(self):
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertIsNone(result['error'])
+        self.assertEqual(self.read_video(result['path']), VIDEO_CONTENT)
+        self.assertEqual(result['bytes'], len(VIDEO_CONTENT))
+        self.assertFalse(result['resumed'])
+        with open(os.path.join(self.download_dir, video_utils.VIDEO_MANIFEST_FILE_NAME)) as json_file:
+            entry = json.load(json_file)[VIDEO_ID]
+        self.assertEqual(entry['size'], len(VIDEO_CONTENT))
+        self.assertEqual(entry['mtime'], os.path.getmtime(result['path']))
+        self.assertEqual(entry['md5'], video_utils.get_file_md5(result['path']))
+
+    def test_unchanged_file_is_reused_without_hashing(self):
+        self.make_downloader().download_all([VIDEO_ID])
+        with mock.patch('video_utils.get_file_md5') as get_file_md5:
+            result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertTrue(result['path'])
+        self.assertEqual(result['bytes'], 0)
+        get_file_md5.assert_not_called()
+        self.assertEqual(len(self.server.ranges), 1)
+
+    def test_verify_checksums_hashes_every_file(self):
+        self.make_downloader().download_all([VIDEO_ID])
+        with mock.patch('video_utils.get_file_md5', wraps=video_utils.get_file_md5) as get_file_md5:
+            result = self.make_downloader(verify_checksums=True).download_all([VIDEO_ID])[0]
+        self.assertTrue(result['path'])
+        self.assertEqual(get_file_md5.call_count, 1)
+
+    def test_touched_file_is_hashed_once(self):
+        path = self.make_downloader().download_all([VIDEO_ID])[0]['path']
+        os.utime(path, (1000000000, 1000000000))
+        with mock.patch('video_utils.get_file_md5', wraps=video_utils.get_file_md5) as get_file_md5:
+            self.assertEqual(self.make_downloader().download_all([VIDEO_ID])[0]['path'], path)
+            self.assertEqual(self.make_downloader().download_all([VIDEO_ID])[0]['path'], path)
+        # The new modification time is kept in the manifest after the first check
+        self.assertEqual(get_file_md5.call_count, 1)
+        self.assertEqual(len(self.server.ranges), 1)
+
+    def test_modified_file_is_downloaded_again(self):
+        path = self.make_downloader().download_all([VIDEO_ID])[0]['path']
+        with open(path, 'r+b') as video_file:
+            video_file.write(b'corrupted')
+        os.utime(path, (1000000000, 1000000000))
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertEqual(self.read_video(result['path']), VIDEO_CONTENT)
+        self.assertEqual(len(self.server.ranges), 2)
+
+    def test_partial_file_is_resumed(self):
+        self.write_part(VIDEO_CONTENT[:1000])
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertEqual(self.server.ranges, ['bytes=1000-'])
+        self.assertTrue(result['resumed'])
+        self.assertEqual(result['bytes'], len(VIDEO_CONTENT) - 1000)
+        self.assertEqual(self.read_video(result['path']), VIDEO_CONTENT)
+        self.assertFalse(os.path.exists(self.get_part_path()))
+
+    def test_unknown_size_restarts_the_download(self):
+        self.expected_size = None
+        self.write_part(b'x' * 1000)
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertEqual(self.server.ranges, [None])
+        self.assertFalse(result['resumed'])
+        self.assertEqual(self.read_video(result['path']), VIDEO_CONTENT)
+
+    def test_range_not_satisfiable_restarts_the_download(self):
+        self.server.satisfiable = False
+        self.write_part(b'x' * 1000)
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertEqual(self.server.ranges, ['bytes=1000-', None])
+        self.assertFalse(result['resumed'])
+        self.assertEqual(self.read_video(result['path']), VIDEO_CONTENT)
+
+    def test_size_mismatch_fails(self):
+        self.expected_size = len(VIDEO_CONTENT) + 1
+        result = self.make_downloader().download_all([VIDEO_ID])[0]
+        self.assertIsNone(result['path'])
+        self.assertIn('does not match', result['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
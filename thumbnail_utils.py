@@ -0,0 +1,190 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from cache_utils import get_temp_path, write_file_atomic
+from utils import check_offline
+
+LOGGER = logging.getLogger("RefugeeResponseThumbnails")
+LOGGER.setLevel(logging.DEBUG)
+
+THUMBNAIL_CACHE_DIR = os.path.join('chefdata', 'thumbnails')
+THUMBNAIL_INDEX_FILE_NAME = 'index.json'
+
+DEFAULT_THUMBNAIL_WORKERS = 8
+DEFAULT_THUMBNAIL_BATCH_SIZE = 50
+DEFAULT_THUMBNAIL_TIMEOUT = 30
+
+# Kolibri Studio displays thumbnails at 16:9, larger images are downscaled to fit in this box
+STUDIO_THUMBNAIL_SIZE = (400, 225)
+
+IMAGE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+
+class RefugeeResponseThumbnailCache():
+    """
+    Content-addressed local copy of remote thumbnails: every image is stored once as
+    `<sha1 of content><ext>` in `cache_dir`, and `index.json` maps each URL to its file
+    so that repeat runs download nothing.
+    downscale: if set, images are downscaled to fit in STUDIO_THUMBNAIL_SIZE (requires Pillow);
+    downscaled copies are indexed under their own keys (see get_index_key).
+    """
+    cache_dir = THUMBNAIL_CACHE_DIR
+    max_workers = DEFAULT_THUMBNAIL_WORKERS
+    downscale = False
+
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, max_workers=DEFAULT_THUMBNAIL_WORKERS, downscale=False,
+                 timeout=DEFAULT_THUMBNAIL_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_workers = max(1, max_workers)
+        if downscale and importlib.util.find_spec('PIL') is None:
+            LOGGER.warning("Pillow is not installed, thumbnails are not downscaled")
+            downscale = False
+        self.downscale = downscale
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(self.cache_dir, THUMBNAIL_INDEX_FILE_NAME)
+        self.index = dict()
+        self.downloaded_count = 0
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path) as json_file:
+                self.index = json.load(json_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            LOGGER.error("Ignored invalid thumbnail index %s: %s", self.index_path, e)
+
+    def save_index(self):
+        with self.lock:
+            write_file_atomic(self.index_path, json.dumps(self.index, indent=4, sort_keys=True))
+
+    def get_index_key(self, url):
+        """
+        Index key of the thumbnail at `url`: the URL itself, followed by the box size for
+        a downscaled copy, so that runs with and without downscaling don't share files
+        """
+        if self.downscale:
+            return '{0} {1}x{2}'.format(url, *STUDIO_THUMBNAIL_SIZE)
+        return url
+
+    def get_path(self, url):
+        """
+        Local path of an already fetched thumbnail, None if it is not cached
+        """
+        with self.lock:
+            file_name = self.index.get(self.get_index_key(url))
+        if file_name:
+            path = os.path.join(self.cache_dir, file_name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get_extension(self, url, content_type):
+        content_type = (content_type or '').split(';')[0].strip().lower()
+        if content_type in IMAGE_EXTENSIONS:
+            return IMAGE_EXTENSIONS[content_type]
+        extension = os.path.splitext(url.split('?')[0])[1].lower()
+        return extension if extension in IMAGE_EXTENSIONS.values() else '.jpg'
+
+    def downscale_image(self, path):
+        """
+        Downscale the image at `path` in place to fit in STUDIO_THUMBNAIL_SIZE
+        """
+        from PIL import Image
+        with Image.open(path) as image:
+            if image.width <= STUDIO_THUMBNAIL_SIZE[0] and image.height <= STUDIO_THUMBNAIL_SIZE[1]:
+                return
+            image.thumbnail(STUDIO_THUMBNAIL_SIZE)
+            image.save(path)
+
+    def fetch(self, url):
+        """
+        Download one thumbnail into the cache, returns its local path or None on failure.
+        Raises RefugeeResponseOfflineError on an index miss in offline mode.
+        """
+        path = self.get_path(url)
+        if path:
+            return path
+        check_offline(url)
+        # urllib.request loads http.client and ssl, only import it when a thumbnail is downloaded
+        from urllib.request import Request, urlopen
+        try:
+            with urlopen(Request(url), timeout=self.timeout) as response:
+                content = response.read()
+                content_type = response.headers.get('Content-Type')
+        except Exception as e:
+            LOGGER.error("Failed to download thumbnail %s: %s", url, e)
+            return None
+
+        digest = hashlib.sha1(content).hexdigest()
+        suffix = '_{0}x{1}'.format(*STUDIO_THUMBNAIL_SIZE) if self.downscale else ''
+        file_name = digest + suffix + self.get_extension(url, content_type)
+        path = os.path.join(self.cache_dir, file_name)
+        if not os.path.exists(path):
+            # Identical images share one file
+            temp_path = get_temp_path(path)
+            with open(temp_path, 'wb') as image_file:
+                image_file.write(content)
+            if self.downscale:
+                try:
+                    self.downscale_image(temp_path)
+                except Exception as e:
+                    LOGGER.error("Failed to downscale thumbnail %s: %s", url, e)
+                    os.remove(temp_path)
+                    return None
+            os.replace(temp_path, path)
+        with self.lock:
+            self.index[self.get_index_key(url)] = file_name
+            self.downloaded_count += 1
+        return path
+
+    def prefetch(self, urls):
+        """
+        Download the thumbnails of `urls` concurrently, returns a dict of url => local path
+        (None for the ones that failed)
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        missing_urls = [url for url in urls if not self.get_path(url)]
+        if missing_urls:
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    list(executor.map(self.fetch, missing_urls))
+            finally:
+                self.save_index()
+        return dict((url, self.get_path(url)) for url in urls)
+
+
+def iter_with_local_thumbnails(videos, thumbnail_cache, batch_size=DEFAULT_THUMBNAIL_BATCH_SIZE):
+    """
+    Yield the playlist children of `videos` with a `thumbnail_path` of the local copy of their
+    `thumbnail`, prefetching the thumbnails of each batch of `batch_size` children concurrently.
+    A thumbnail that can't be downloaded has no `thumbnail_path`.
+    """
+    batch = []
+
+    def flush(batch):
+        paths = thumbnail_cache.prefetch(video.get('thumbnail') for video in batch if video)
+        for video in batch:
+            if video and paths.get(video.get('thumbnail')):
+                video = dict(video, thumbnail_path=paths[video['thumbnail']])
+            yield video
+
+    for video in videos:
+        batch.append(video)
+        if len(batch) >= batch_size:
+            for video in flush(batch):
+                yield video
+            batch = []
+    for video in flush(batch):
+        yield video
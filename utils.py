@@ -1,20 +1,29 @@
+import atexit
 import json
 import logging
 import os
 import re
-import youtube_dl
+import threading
+import time
 
-from pressurecooker.youtube import YouTubeResource
-from le_utils.constants.languages import getlang_by_name, getlang
+from collections.abc import Mapping
+from cache_utils import YOUTUBE_CACHE_DIR, CACHE_BACKEND_SQLITE, CACHE_BACKEND_JSON, CACHE_BACKENDS, open_cache
+from cache_utils import normalize_playlist_info, index_playlist_children, RefugeeResponseNegativeCache, NEGATIVE_CACHE_FILE_NAME
+from cache_gc_utils import collect_cache_garbage, format_gc_report
+from metrics_utils import get_metrics, PHASE_EXTRACT
+from scheduler_utils import RefugeeResponseExtractionScheduler, RefugeeResponseTransientError
 
 LOGGER = logging.getLogger("RefugeeResponseUtils")
 LOGGER.setLevel(logging.DEBUG)
 
-YOUTUBE_CACHE_DIR = os.path.join('chefdata', 'youtubecache')
 YOUTUBE_ID_REGEX = re.compile(
     r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?(?P<youtube_id>[A-Za-z0-9\-=_]{11})'
 )
 YOUTUBE_PLAYLIST_URL_FORMAT = "https://www.youtube.com/playlist?list={0}"
+YOUTUBE_VIDEO_URL_FORMAT = "https://www.youtube.com/watch?v={0}"
+
+# Maximum number of stale (older than the TTL) videos re-extracted per playlist refresh
+DEFAULT_REFRESH_LIMIT = 10
 
 VIDEO_DESCRIPTION_JSON_PATH = os.path.join('chefdata', 'youtubecache', 'video_description.json')
 REFUGEE_RESPONSE_THUMBNAIL_PATH = os.path.join("files", "refresponse_logo.png")
@@ -91,6 +100,152 @@ UND_LANG = {
     }
 }
 
+_youtube_cache = None
+_youtube_cache_backend = CACHE_BACKEND_SQLITE
+_youtube_cache_raw = False
+_youtube_cache_lock = threading.Lock()
+_negative_cache = None
+_negative_cache_reprobe = False
+
+_extraction_scheduler = None
+_extraction_scheduler_options = dict()
+_offline = False
+
+NEGATIVE_CACHE_VIDEO = 'video'
+NEGATIVE_CACHE_PLAYLIST = 'playlist'
+
+def set_cache_backend(backend):
+    """
+    Select the cache backend (one of CACHE_BACKENDS) used by get_youtube_cache()
+    """
+    global _youtube_cache, _youtube_cache_backend
+    if backend not in CACHE_BACKENDS:
+        raise RefugeeResponseConfigError("Invalid cache backend: " + str(backend))
+    with _youtube_cache_lock:
+        if _youtube_cache is not None and backend != _youtube_cache_backend:
+            _youtube_cache.close()
+            _youtube_cache = None
+        _youtube_cache_backend = backend
+
+def set_cache_raw(raw):
+    """
+    Store full youtube_dl info dicts instead of compact records in the cache
+    """
+    global _youtube_cache_raw
+    with _youtube_cache_lock:
+        _youtube_cache_raw = raw
+        if _youtube_cache is not None:
+            _youtube_cache.raw = raw
+
+def get_youtube_cache():
+    """
+    Shared YouTube info cache of the selected backend, opened on first use
+    """
+    global _youtube_cache
+    with _youtube_cache_lock:
+        if _youtube_cache is None:
+            playlist_names = dict((id_list[0], lang) for lang, id_list in PLAYLIST_MAP.items() if id_list)
+            _youtube_cache = open_cache(_youtube_cache_backend, YOUTUBE_CACHE_DIR, playlist_names,
+                                        _youtube_cache_raw)
+        return _youtube_cache
+
+def close_youtube_cache():
+    """
+    Close the shared cache, e.g. before copying its files; it is opened again on next use
+    """
+    global _youtube_cache
+    with _youtube_cache_lock:
+        if _youtube_cache is not None:
+            _youtube_cache.close()
+            _youtube_cache = None
+
+# Also writes the buffered access times of the cache entries
+atexit.register(close_youtube_cache)
+
+def collect_youtube_cache_garbage(max_size=None):
+    """
+    Delete the entries of the shared cache that the PLAYLIST_MAP playlists do not need, and evict
+    the least recently used playlists over `max_size` bytes, see collect_cache_garbage
+    """
+    playlist_ids = [id_list[0] for id_list in PLAYLIST_MAP.values() if id_list]
+    return collect_cache_garbage(get_youtube_cache(), playlist_ids, max_size)
+
+def set_reprobe(reprobe):
+    """
+    Probe ids recorded in the negative cache again, ignoring their retry window
+    """
+    global _negative_cache_reprobe
+    _negative_cache_reprobe = reprobe
+
+def get_negative_cache():
+    """
+    Shared negative cache of failed video and playlist ids, loaded on first use
+    """
+    global _negative_cache
+    with _youtube_cache_lock:
+        if _negative_cache is None:
+            _negative_cache = RefugeeResponseNegativeCache(os.path.join(YOUTUBE_CACHE_DIR, NEGATIVE_CACHE_FILE_NAME))
+        return _negative_cache
+
+def skip_failed_item(kind, item_id):
+    """
+    True if the id failed before and its retry window has not expired yet
+    """
+    if _negative_cache_reprobe:
+        return False
+    entry = get_negative_cache().get(kind, item_id)
+    if entry and get_negative_cache().should_skip(kind, item_id):
+        LOGGER.info("[%s %s] Skipped, failed with '%s', retry after %s", kind, item_id, entry['reason'],
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['retry_after'])))
+        return True
+    return False
+
+def configure_extraction_scheduler(**options):
+    """
+    Set RefugeeResponseExtractionScheduler options (rate, host_concurrency, max_retries,
+    deadline, ...) of the shared scheduler, replacing it if it was already created
+    """
+    global _extraction_scheduler
+    with _youtube_cache_lock:
+        _extraction_scheduler_options.update(options)
+        _extraction_scheduler = None
+
+def get_extraction_scheduler():
+    """
+    Shared scheduler of every youtube_dl request, created on first use
+    """
+    global _extraction_scheduler
+    with _youtube_cache_lock:
+        if _extraction_scheduler is None:
+            _extraction_scheduler = RefugeeResponseExtractionScheduler(**_extraction_scheduler_options)
+        return _extraction_scheduler
+
+def set_offline(offline):
+    """
+    Strict offline mode: a cache miss raises RefugeeResponseOfflineError instead of going to the network
+    """
+    global _offline
+    _offline = offline
+
+def check_offline(url):
+    if _offline:
+        raise RefugeeResponseOfflineError("Cache miss in offline mode: " + url)
+
+def get_resource_info(url, options=None):
+    """
+    youtube_dl info of a video or playlist URL, run through the extraction scheduler
+    """
+    from pressurecooker.youtube import YouTubeResource
+    check_offline(url)
+
+    def extract():
+        info = YouTubeResource(url).get_resource_info(options)
+        if not info:
+            raise RefugeeResponseTransientError("No info returned for " + url)
+        return info
+    with get_metrics().measure(PHASE_EXTRACT):
+        return get_extraction_scheduler().run(url, extract)
+
 class RefugeeResponseError(Exception):
     pass
 
@@ -102,6 +257,16 @@ class RefugeeResponseConfigError(RefugeeResponseError):
     def __init__(self, message):
         self.message = message
 
+class RefugeeResponseBuildError(RefugeeResponseError):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+class RefugeeResponseOfflineError(RefugeeResponseError):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
 
 class RefugeeResponseLanguage():
     name = ''
@@ -122,6 +287,7 @@ class RefugeeResponseLanguage():
         if self.name != "":
             lang_code = self.code
             lang_name = self.name
+            from le_utils.constants.languages import getlang_by_name, getlang
             language_obj = getlang_by_name(lang_name) if not getlang(lang_name) else getlang(lang_name)
 
             if not language_obj:
@@ -171,46 +337,39 @@ class RefugeeResponseVideo():
             LOGGER.error('==> URL ' + self.url + ' does not match YOUTUBE_ID_REGEX')
             return False
         youtube_id = match.group('youtube_id')
-        if not os.path.isdir(YOUTUBE_CACHE_DIR):
-            os.mkdir(YOUTUBE_CACHE_DIR)
-        vinfo_json_path = os.path.join(YOUTUBE_CACHE_DIR, youtube_id + '.json')
+        cache = get_youtube_cache()
         # First try to get from cache:
         vinfo = None
-        if os.path.exists(vinfo_json_path) and use_cache:
-            vinfo = json.load(open(vinfo_json_path))
-            LOGGER.info("Retrieving cached video information...")
+        if use_cache:
+            vinfo = cache.get_video(youtube_id)
+            if vinfo:
+                LOGGER.info("Retrieving cached video information...")
         # else get using youtube_dl:
         if not vinfo:
+            check_offline(self.url)
+            if skip_failed_item(NEGATIVE_CACHE_VIDEO, youtube_id):
+                return False
             LOGGER.info("Downloading %s from youtube...", self.url)
             try:
-                video = YouTubeResource(self.url)
-            except youtube_dl.utils.ExtractorError as e:
-                if "unavailable" in str(e):
+                vinfo = get_resource_info(self.url)
+                cache.put_video(youtube_id, vinfo)
+                get_negative_cache().clear(NEGATIVE_CACHE_VIDEO, youtube_id)
+            except RefugeeResponseOfflineError:
+                raise
+            except Exception as e:
+                # Only permanent failures are negative-cached, transient ones are retried on the next run
+                if RefugeeResponseNegativeCache.is_unavailable_error(e):
                     LOGGER.error("Video not found at URL: %s", self.url)
-                    return False
-
-            if video:
-                try:
-                    vinfo = video.get_resource_info()
-                    json.dump(
-                        vinfo,
-                        open(vinfo_json_path, 'w'),
-                        indent=4,
-                        ensure_ascii=False,
-                        sort_keys=True
-                    )
-                    return True
-                except Exception as e:
+                    get_negative_cache().record_failure(NEGATIVE_CACHE_VIDEO, youtube_id, e)
+                else:
                     LOGGER.error("Failed to get video info: %s", e)
-                    return False
-
-        else:
-            return False
+                return False
 
+        # Both a cache hit and a fresh extraction fill in the video fields
         self.uid = vinfo['id']  # video must have id because required to set youtube_id later
         self.title = vinfo.get('title', '')
         self.description = vinfo.get('description', '')
-        if not vinfo['license']:
+        if not vinfo.get('license'):
             self.license = "Licensed not available"
         elif "Creative Commons" in vinfo['license']:
             self.license_common = True
@@ -222,102 +381,276 @@ class RefugeeResponsePlaylist():
     playlist_id = ''
     lang_name = ''
     use_cache = True
-    playlist_info_json_path = ''
+    incremental = False
+    ttl = None
+    refresh_limit = DEFAULT_REFRESH_LIMIT
 
-    def __init__(self, playlist_item, use_cache=True):
+    def __init__(self, playlist_item, use_cache=True, incremental=False, ttl=None,
+                 refresh_limit=DEFAULT_REFRESH_LIMIT):
+        """
+        incremental: refresh a cached playlist by diffing its video ids instead of using it as is
+        ttl: age in seconds after which a cached video is re-extracted during an incremental refresh,
+             at most `refresh_limit` videos per refresh (oldest first)
+        """
         self.lang_name = playlist_item[0]
         self.playlist_id = playlist_item[1][0]
         self.use_cache = use_cache
-        self.playlist_info_json_path = os.path.join(YOUTUBE_CACHE_DIR, self.lang_name + '.json')
+        self.incremental = incremental
+        self.ttl = ttl
+        self.refresh_limit = refresh_limit
 
     def get_playlist_info(self):
         """
-        Get playlist info from either local json cache or URL
+        Get playlist info from either local cache or URL
         """
-        if not os.path.isdir(YOUTUBE_CACHE_DIR):
-            os.mkdir(YOUTUBE_CACHE_DIR)
-
+        cache = get_youtube_cache()
         playlist_info = None
-        if os.path.exists(self.playlist_info_json_path) and self.use_cache:
-            LOGGER.info("[Playlist %s] Retrieving cached playlist information...", self.playlist_id)
-            playlist_info = json.load(open(self.playlist_info_json_path))
+        if self.use_cache:
+            playlist_info = cache.get_playlist(self.playlist_id)
+            if playlist_info and self.incremental:
+                return self.refresh_playlist_info(playlist_info)
+            if playlist_info:
+                LOGGER.info("[Playlist %s] Retrieving cached playlist information...", self.playlist_id)
+                normalize_playlist_info(playlist_info)
 
         if not playlist_info:
             playlist_url = YOUTUBE_PLAYLIST_URL_FORMAT.format(self.playlist_id)
-            playlist_resource = YouTubeResource(playlist_url)
-
-            if playlist_resource:
-                try:
-                    playlist_info = playlist_resource.get_resource_info( dict(ignoreerrors=True, skip_download=True) )
-          
-                    # Traverse through the video list to remove duplicates
-                    video_set = set()
-                    videos = playlist_info.get('children')
-                    for video in videos:
-                        if video['id'] in video_set:
-                            videos.remove(video)
-                        else:
-                            video_set.add(video['id'])
-
-                    json.dump(
-                        playlist_info,
-                        open(self.playlist_info_json_path, 'w'),
-                        indent=4,
-                        ensure_ascii=False,
-                        sort_keys=False
-                    )
-                    LOGGER.info("[Playlist %s] Successfully get playlist info", self.playlist_id)
-                    return playlist_info
-                except Exception as e:
-                    LOGGER.error("[Playlist %s] Failed to get playlist info: %s", self.playlist_id, e)
-                    return None
+            # A PLAYLIST_MAP playlist is never skipped: a build without it must fail, not drop the language
+            check_offline(playlist_url)
+            try:
+                playlist_info = get_resource_info(playlist_url, dict(ignoreerrors=True, skip_download=True))
+                normalize_playlist_info(playlist_info)
+                cache.put_playlist(self.playlist_id, playlist_info)
+                get_negative_cache().clear(NEGATIVE_CACHE_PLAYLIST, self.playlist_id)
+                LOGGER.info("[Playlist %s] Successfully get playlist info", self.playlist_id)
+                return playlist_info
+            except RefugeeResponseOfflineError:
+                raise
+            except Exception as e:
+                LOGGER.error("[Playlist %s] Failed to get playlist info: %s", self.playlist_id, e)
+                if RefugeeResponseNegativeCache.is_unavailable_error(e):
+                    get_negative_cache().record_failure(NEGATIVE_CACHE_PLAYLIST, self.playlist_id, e)
+                return None
         return playlist_info
 
-    def insert_video_info(self, video_id):
+    def list_video_ids(self):
         """
-        Insert video info json block to playlist json file
+        List the video ids of the playlist with a flat extraction, without extracting the videos
         """
-        if not os.path.isdir(YOUTUBE_CACHE_DIR):
-            os.mkdir(YOUTUBE_CACHE_DIR)
-            return False
+        import youtube_dl
+        playlist_url = YOUTUBE_PLAYLIST_URL_FORMAT.format(self.playlist_id)
+        check_offline(playlist_url)
+        options = dict(extract_flat='in_playlist', ignoreerrors=True, skip_download=True, quiet=True)
+
+        def extract():
+            with youtube_dl.YoutubeDL(options) as ydl:
+                return ydl.extract_info(playlist_url, download=False)
+        with get_metrics().measure(PHASE_EXTRACT):
+            info = get_extraction_scheduler().run(playlist_url, extract)
+        if not info:
+            return None
+        return [entry['id'] for entry in info.get('entries') or [] if entry and entry.get('id')]
+
+    def extract_video_info(self, video_id):
+        """
+        Run a full extraction of one video, returns its info or None on failure
+        """
+        rr_video_obj = RefugeeResponseVideo(url=YOUTUBE_VIDEO_URL_FORMAT.format(video_id))
+        if not rr_video_obj.download_info(use_cache=False):
+            return None
+        return get_youtube_cache().get_video(video_id)
+
+    def get_stale_video_ids(self, video_ids):
+        """
+        Ids of the cached videos older than the TTL, oldest first, at most `refresh_limit`
+        """
+        if not self.ttl or self.refresh_limit <= 0:
+            return []
+        cache = get_youtube_cache()
+        expire_time = time.time() - self.ttl
+        ages = []
+        for video_id in video_ids:
+            updated_at = cache.get_video_updated_at(video_id) or 0
+            if updated_at < expire_time:
+                ages.append((updated_at, video_id))
+        return [video_id for updated_at, video_id in sorted(ages)[:self.refresh_limit]]
+
+    def refresh_playlist_info(self, playlist_info):
+        """
+        Update the cached playlist info: extract only the added (and stale) videos and drop the removed ones
+        """
+        try:
+            video_ids = self.list_video_ids()
+        except RefugeeResponseOfflineError:
+            raise
+        except Exception as e:
+            LOGGER.error("[Playlist %s] Failed to list playlist videos, using cache: %s", self.playlist_id, e)
+            return playlist_info
+        if not video_ids:
+            # With ignoreerrors, a throttled or failed listing comes back empty: never
+            # take it for an emptied playlist and drop every cached video
+            LOGGER.error("[Playlist %s] Failed to list playlist videos, using cache", self.playlist_id)
+            return playlist_info
+
+        cache = get_youtube_cache()
+        cached_children = normalize_playlist_info(playlist_info)
+        added_ids = [video_id for video_id in video_ids if video_id not in cached_children]
+        removed_count = len(set(cached_children) - set(video_ids))
+        cached_ids = [video_id for video_id in video_ids if video_id in cached_children]
+        stale_ids = self.get_stale_video_ids(cached_ids)
+
+        # Videos shared with the playlist of another language are already cached
+        shared = dict()
+        for video_id in added_ids:
+            video_info = cache.get_video(video_id)
+            if video_info:
+                shared[video_id] = video_info
+        shared_ids = set(shared) - set(self.get_stale_video_ids(list(shared)))
+
+        extracted = dict()
+        for video_id in [video_id for video_id in added_ids if video_id not in shared_ids] + stale_ids:
+            video_info = self.extract_video_info(video_id)
+            if video_info:
+                extracted[video_id] = video_info
+            else:
+                LOGGER.error("[Playlist %s] Failed to extract video %s", self.playlist_id, video_id)
+
+        with cache.open_playlist_writer(self.playlist_id, playlist_info) as writer:
+            for video_id in video_ids:
+                if video_id in extracted:
+                    writer.append(extracted[video_id])
+                elif video_id in shared_ids:
+                    writer.append_cached(shared[video_id])
+                elif video_id in cached_children:
+                    writer.append_cached(cached_children[video_id])
+        playlist_info['children'] = [
+            extracted.get(video_id) or shared.get(video_id) or cached_children.get(video_id) for video_id in video_ids
+        ]
+        normalize_playlist_info(playlist_info)
+        LOGGER.info("[Playlist %s] Incremental refresh: %d added (%d shared), %d removed, %d refreshed, %d kept",
+                    self.playlist_id, len(added_ids), len(shared_ids), removed_count, len(stale_ids),
+                    len(cached_ids) - len(stale_ids))
+        return playlist_info
 
-        video_info_json_path = os.path.join(YOUTUBE_CACHE_DIR, video_id + '.json')
-        video_info = None
-        if os.path.exists(video_info_json_path):
-            LOGGER.info("[Video: %s] Retrieving cached video information...", video_id)
-            video_info = json.load(open(video_info_json_path))
+    def insert_video_info(self, video_id):
+        """
+        Insert cached video info block to cached playlist info
+        """
+        video_info = get_youtube_cache().get_video(video_id)
         if not video_info:
             LOGGER.error("[Video: %s] Failed to retrive video info", video_id)
             return False
+        LOGGER.info("[Video: %s] Retrieving cached video information...", video_id)
+        return self.insert_videos_info([video_info])
 
-        playlist_info = None
-        if os.path.exists(self.playlist_info_json_path):
-            LOGGER.info("[Playlist %s] Retrieving cached playlist information...", self.playlist_id)
-            playlist_info = json.load(open(self.playlist_info_json_path))
-
-        if playlist_info:
-            children_obj = playlist_info['children']
-            children_obj.append(video_info)
-            json.dump(playlist_info,
-                      open(self.playlist_info_json_path, 'w'),
-                      indent=4,
-                      ensure_ascii=False,
-                      sort_keys=False)
+    def insert_videos_info(self, video_infos):
+        """
+        Merge a batch of video info blocks into the cached playlist info with a single write.
+        A video already in the playlist has its entry replaced, the others are appended.
+        """
+        cache = get_youtube_cache()
+        playlist_header = cache.get_playlist_header(self.playlist_id)
+        if playlist_header is None:
+            LOGGER.error("[Playlist %s] No cached playlist information to insert into", self.playlist_id)
+            return False
+
+        LOGGER.info("[Playlist %s] Retrieving cached playlist information...", self.playlist_id)
+        new_children = index_playlist_children(video_infos, replace=True)
+        with cache.open_playlist_writer(self.playlist_id, playlist_header) as writer:
+            for child in cache.iter_playlist_children(self.playlist_id):
+                if child and child.get('id') in new_children:
+                    writer.append(new_children.pop(child['id']))
+                else:
+                    writer.append_cached(child)
+            writer.extend(new_children.values())
+        return True
+
+    def cache_playlist(self):
+        """
+        Make sure the playlist is in the cache, extracting (or refreshing) it only when needed:
+        a cached playlist is not read. Returns False if the playlist can't be extracted.
+        """
+        if self.use_cache and not self.incremental and get_youtube_cache().has_playlist(self.playlist_id):
             return True
-        return False
+        return self.get_playlist_info() is not None
 
-def get_video_description():
+    def iter_children(self):
+        """
+        Yield the playlist children one at a time from the cache, extracting the playlist first
+        if it is not cached (or the cache is not used). Returns None if the playlist can't be extracted.
+        """
+        if not self.cache_playlist():
+            return None
+        return get_youtube_cache().iter_playlist_children(self.playlist_id)
+
+def get_video_description(json_path=VIDEO_DESCRIPTION_JSON_PATH):
+    """
+    (video id, language name) => description of the included videos. The index written by
+    RefugeeResponseSheetReader has one entry per language of a video; an entry of the older
+    Video ID => {column title: value} layout applies to all languages, with None as language.
+    """
     video_description_map = dict()
-    if os.path.exists(VIDEO_DESCRIPTION_JSON_PATH):
-        video_description_json = json.load(open(VIDEO_DESCRIPTION_JSON_PATH))
+    if os.path.exists(json_path):
+        with open(json_path) as json_file:
+            video_description_json = json.load(json_file)
         for video_id, video_description_obj in video_description_json.items():
-            video_description = video_description_obj["Description"]
-            if video_description is not None and video_description.upper() != "EXCLUDE":
-                video_description_map[video_id] = video_description
-            elif video_description is None:
-                video_description_map[video_id] = ''
+            if "Description" in video_description_obj:
+                language_objs = {None: video_description_obj}
+            else:
+                language_objs = video_description_obj
+            for language, language_obj in language_objs.items():
+                video_description = language_obj["Description"]
+                if video_description is not None and video_description.upper() != "EXCLUDE":
+                    video_description_map[(video_id, language or None)] = video_description
+                elif video_description is None:
+                    video_description_map[(video_id, language or None)] = ''
     else:
         LOGGER.error("Video Description JSON file not exist")
     return video_description_map
 
-VIDEO_DESCRIPTION_MAP = get_video_description()
+class RefugeeResponseDescriptionMap(Mapping):
+    """
+    Read-only (video id, language name) => description mapping, loaded from `json_path` on
+    first access and reloaded whenever the file modification time changes. A video without
+    an entry for the language falls back to its entry without a language, if any.
+    """
+    json_path = VIDEO_DESCRIPTION_JSON_PATH
+
+    def __init__(self, json_path=VIDEO_DESCRIPTION_JSON_PATH):
+        self.json_path = json_path
+        self.descriptions = None
+        self.loaded_mtime = None
+        self.lock = threading.Lock()
+
+    def get_descriptions(self):
+        try:
+            mtime = os.path.getmtime(self.json_path)
+        except OSError:
+            mtime = None
+        with self.lock:
+            if self.descriptions is None or mtime != self.loaded_mtime:
+                self.descriptions = get_video_description(self.json_path)
+                self.loaded_mtime = mtime
+            return self.descriptions
+
+    def __getitem__(self, key):
+        descriptions = self.get_descriptions()
+        video_id, language = key
+        if (video_id, language) in descriptions:
+            return descriptions[(video_id, language)]
+        return descriptions[(video_id, None)]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.get_descriptions())
+
+    def __len__(self):
+        return len(self.get_descriptions())
+
+VIDEO_DESCRIPTION_MAP = RefugeeResponseDescriptionMap()
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from cache_utils import write_file_atomic
+from concurrent.futures import ThreadPoolExecutor
+from utils import RefugeeResponseOfflineError
+
+LOGGER = logging.getLogger("RefugeeResponseVideos")
+LOGGER.setLevel(logging.DEBUG)
+
+VIDEO_DOWNLOAD_DIR = os.path.join('chefdata', 'videos')
+VIDEO_MANIFEST_FILE_NAME = 'manifest.json'
+PARTIAL_FILE_SUFFIX = '.part'
+
+DEFAULT_VIDEO_WORKERS = 4
+DEFAULT_VIDEO_BATCH_SIZE = 20
+DEFAULT_VIDEO_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Same limit as ricecooker's YouTubeVideoFile default; a single progressive file so it can be fetched over HTTP
+YOUTUBE_VIDEO_FORMAT = 'best[height<=480][ext=mp4]/best[ext=mp4]/best'
+YOUTUBE_VIDEO_URL_FORMAT = "https://www.youtube.com/watch?v={0}"
+
+
+def get_file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as video_file:
+        for chunk in iter(lambda: video_file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def resolve_youtube_source(video_id):
+    """
+    Direct download URL and expected size (or None) of the selected format of a YouTube video
+    """
+    import youtube_dl
+    options = dict(format=YOUTUBE_VIDEO_FORMAT, quiet=True, skip_download=True)
+    with youtube_dl.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(YOUTUBE_VIDEO_URL_FORMAT.format(video_id), download=False)
+    return info['url'], info.get('filesize')
+
+
+class RefugeeResponseVideoDownloader():
+    """
+    Downloads video files into `download_dir` as `<video_id>.mp4` through a worker pool.
+    Interrupted downloads are resumed from their `.part` file with HTTP range requests when
+    the expected size is known, sizes are checked against it, and the size, modification time
+    and MD5 of every finished file are kept in `manifest.json`. A file is reused while its size
+    and modification time match; it is only hashed again when they changed or with verify_checksums.
+    resolve_source(video_id): returns (url, expected size or None), YouTube by default
+    """
+    download_dir = VIDEO_DOWNLOAD_DIR
+    max_workers = DEFAULT_VIDEO_WORKERS
+    verify_checksums = False
+
+    def __init__(self, download_dir=VIDEO_DOWNLOAD_DIR, max_workers=DEFAULT_VIDEO_WORKERS, resolve_source=None,
+                 timeout=DEFAULT_VIDEO_TIMEOUT, verify_checksums=False):
+        self.download_dir = download_dir
+        self.max_workers = max(1, max_workers)
+        self.resolve_source = resolve_source or resolve_youtube_source
+        self.verify_checksums = verify_checksums
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.manifest_path = os.path.join(self.download_dir, VIDEO_MANIFEST_FILE_NAME)
+        self.manifest = dict()
+        if not os.path.isdir(self.download_dir):
+            os.makedirs(self.download_dir, exist_ok=True)
+        try:
+            with open(self.manifest_path) as json_file:
+                self.manifest = json.load(json_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            LOGGER.error("Ignored invalid video manifest %s: %s", self.manifest_path, e)
+
+    def save_manifest(self):
+        with self.lock:
+            write_file_atomic(self.manifest_path, json.dumps(self.manifest, indent=4, sort_keys=True))
+
+    def get_video_path(self, video_id):
+        return os.path.join(self.download_dir, video_id + '.mp4')
+
+    def get_path(self, video_id, verify_checksum=False):
+        """
+        Local path of a completely downloaded video, None if it is missing or does not match the manifest.
+        The file is hashed when its modification time is not the one in the manifest, or with verify_checksum.
+        """
+        with self.lock:
+            entry = self.manifest.get(video_id)
+        path = self.get_video_path(video_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not entry or stat.st_size != entry['size']:
+            return None
+        if not verify_checksum and stat.st_mtime == entry.get('mtime'):
+            return path
+        if get_file_md5(path) != entry['md5']:
+            LOGGER.error("[Video %s] Checksum mismatch, downloading again", video_id)
+            return None
+        with self.lock:
+            entry['mtime'] = stat.st_mtime
+        return path
+
+    def fetch(self, url, part_path, expected_size):
+        """
+        Download `url` into `part_path`, resuming from its current size when `expected_size` is known.
+        Returns the bytes transferred.
+        """
+        # urllib.request loads http.client and ssl, only import it when a video is downloaded
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset and not expected_size:
+            # A partial file of unknown total size can't be checked once completed, start over
+            offset = 0
+        if expected_size and offset >= expected_size:
+            return 0
+        request = Request(url)
+        if offset:
+            request.add_header('Range', 'bytes={0}-'.format(offset))
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            if not offset or e.code != 416:
+                raise
+            # Range Not Satisfiable: the partial file is not a prefix of this source, start over
+            LOGGER.warning("Discarded the partial download %s: %s", part_path, e)
+            os.remove(part_path)
+            return self.fetch(url, part_path, expected_size)
+        transferred = 0
+        with response:
+            if offset and getattr(response, 'status', None) != 206:
+                # The server ignored the range request, start over
+                offset = 0
+            with open(part_path, 'ab' if offset else 'wb') as part_file:
+                for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    part_file.write(chunk)
+                    transferred += len(chunk)
+        return transferred
+
+    def download(self, video_id):
+        """
+        Download one video, returns a result dict with `path` (None on failure), `bytes`,
+        `seconds`, `resumed` and `error`
+        """
+        result = dict(video_id=video_id, path=None, bytes=0, seconds=0.0, resumed=False, error=None)
+        path = self.get_path(video_id, self.verify_checksums)
+        if path:
+            result['path'] = path
+            return result
+
+        part_path = self.get_video_path(video_id) + PARTIAL_FILE_SUFFIX
+        start = time.time()
+        try:
+            url, expected_size = self.resolve_source(video_id)
+            result['bytes'] = self.fetch(url, part_path, expected_size)
+            size = os.path.getsize(part_path)
+            # Bytes kept from a previous run
+            result['resumed'] = size > result['bytes']
+            if expected_size and size != expected_size:
+                if size > expected_size:
+                    os.remove(part_path)
+                raise IOError("size {0} does not match expected {1}".format(size, expected_size))
+            md5 = get_file_md5(part_path)
+            os.replace(part_path, self.get_video_path(video_id))
+            mtime = os.path.getmtime(self.get_video_path(video_id))
+            with self.lock:
+                self.manifest[video_id] = dict(size=size, mtime=mtime, md5=md5, downloaded_at=time.time())
+            result['path'] = self.get_video_path(video_id)
+        except RefugeeResponseOfflineError:
+            # A missing video fails the offline build instead of leaving the node without its file
+            raise
+        except Exception as e:
+            result['error'] = str(e)
+            LOGGER.error("[Video %s] Download failed: %s", video_id, e)
+        result['seconds'] = time.time() - start
+        if result['bytes']:
+            LOGGER.info("[Video %s] %.1f MB in %.1fs (%.2f MB/s)%s", video_id, result['bytes'] / 1e6,
+                        result['seconds'], result['bytes'] / 1e6 / max(result['seconds'], 1e-6),
+                        ", resumed" if result['resumed'] else "")
+        return result
+
+    def download_all(self, video_ids):
+        """
+        Download the videos concurrently, returns the result dicts in input order
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        if not video_ids:
+            return []
+        start = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self.download, video_ids))
+        finally:
+            self.save_manifest()
+        seconds = time.time() - start
+        total_bytes = sum(result['bytes'] for result in results)
+        LOGGER.info("Downloaded %d of %d videos, %.1f MB in %.1fs (%.2f MB/s)",
+                    len([result for result in results if result['path']]), len(results),
+                    total_bytes / 1e6, seconds, total_bytes / 1e6 / max(seconds, 1e-6))
+        return results
+
+
+def iter_with_local_videos(videos, downloader, select=None, batch_size=DEFAULT_VIDEO_BATCH_SIZE):
+    """
+    Yield the playlist children of `videos` with a `video_path` of the pre-downloaded file,
+    downloading each batch of `batch_size` children concurrently.
+    select(video): only the videos it accepts are downloaded; a failed download has no `video_path`.
+    """
+    batch = []
+
+    def flush(batch):
+        video_ids = [video['id'] for video in batch if video and (select is None or select(video))]
+        paths = dict((result['video_id'], result['path']) for result in downloader.download_all(video_ids))
+        for video in batch:
+            if video and paths.get(video['id']):
+                video = dict(video, video_path=paths[video['id']])
+            yield video
+
+    for video in videos:
+        batch.append(video)
+        if len(batch) >= batch_size:
+            for video in flush(batch):
+                yield video
+            batch = []
+    for video in flush(batch):
+        yield video